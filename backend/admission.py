@@ -0,0 +1,204 @@
+"""
+Per-user admission control for the expensive routes.
+
+Every user has a token bucket refilling at ADMISSION_RATE tokens/second up
+to ADMISSION_BURST. Each route costs a weight (ADMISSION_COST_<ROUTE>); a
+request that cannot pay is rejected at once with 429 and a Retry-After
+saying when it could. Buckets live in-process by default, or in a SQLite
+file shared by every worker on the host (ADMISSION_SHARED_DB), like the
+cache versions in cache.py. Shared buckets idle long enough to have refilled
+are deleted every ADMISSION_PRUNE_INTERVAL seconds; a missing bucket is a
+full one, so this changes no decision.
+
+On top of that, at most EMBED_MAX_CONCURRENCY uploads are processed at once
+across all users; more are turned away with 429 instead of queueing behind
+the chain and the image work.
+"""
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import services
+from metrics import Counter
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "0.5"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "10"))
+ADMISSION_SHARED_DB = os.getenv("ADMISSION_SHARED_DB", "")
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+ADMISSION_PRUNE_INTERVAL = float(os.getenv("ADMISSION_PRUNE_INTERVAL", "60"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_RETRY_AFTER = int(os.getenv("EMBED_RETRY_AFTER", "1"))
+
+# Tokens each route costs; an upload decodes, scans, embeds and sends a
+# transaction, a duplicate check only decodes and scans.
+ROUTE_COSTS = {
+    "upload": float(os.getenv("ADMISSION_COST_UPLOAD", "5")),
+    "check_duplicate": float(os.getenv("ADMISSION_COST_CHECK_DUPLICATE", "2")),
+}
+
+REJECTED = Counter(
+    "trifecta_admission_rejected_total", "Requests turned away with 429 by admission control.", ("route", "reason")
+)
+
+
+class LocalBuckets:
+    """Token buckets for this process only (LRU-bounded)."""
+
+    def __init__(self, max_keys: int = ADMISSION_MAX_KEYS):
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Spend `cost` tokens if available. Returns 0 on success, else seconds until it could succeed."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedBuckets:
+    """Token buckets in a SQLite file shared by all local workers."""
+
+    def __init__(self, path: str, prune_interval: float = ADMISSION_PRUNE_INTERVAL):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admission_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_admission_buckets_updated ON admission_buckets (updated_at)"
+        )
+        self._lock = threading.Lock()
+        self._prune_interval = prune_interval
+        self._pruned_at = time.time()
+
+    def take(self, key, cost, rate, burst):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM admission_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row or (burst, now)
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                self._conn.execute(
+                    "INSERT INTO admission_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    (key, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if now - self._pruned_at >= self._prune_interval:
+                self._pruned_at = now
+                try:
+                    self.prune(burst / rate, now)
+                except sqlite3.OperationalError:
+                    pass  # busy; the next interval tries again
+        return wait
+
+    def prune(self, idle: float, now: float = None) -> int:
+        """Delete buckets untouched for `idle` seconds (full again by then). Returns how many."""
+        now = time.time() if now is None else now
+        return self._conn.execute(
+            "DELETE FROM admission_buckets WHERE updated_at < ?", (now - idle,)
+        ).rowcount
+
+
+class AdmissionController:
+    def __init__(self, buckets, rate=ADMISSION_RATE, burst=ADMISSION_BURST, costs=None,
+                 embed_concurrency=EMBED_MAX_CONCURRENCY):
+        self.buckets = buckets
+        self.rate = rate
+        self.burst = burst
+        # A cost above the burst could never be paid
+        self.costs = {route: min(cost, burst) for route, cost in (costs or ROUTE_COSTS).items()}
+        self.embed_slots = threading.BoundedSemaphore(embed_concurrency)
+
+    def check(self, user, route: str) -> float:
+        """Charge `user` for one call to `route`. Returns 0 if admitted, else the seconds to wait."""
+        cost = self.costs.get(route)
+        if not cost:
+            return 0.0
+        # One bucket per user; routes draw from it by weight
+        wait = self.buckets.take(str(user), cost, self.rate, self.burst)
+        if wait:
+            REJECTED.inc(route=route, reason="rate")
+        return wait
+
+    def acquire_embed(self, route: str = "upload") -> bool:
+        """Take a global embed slot without waiting; release with embed_slots.release()."""
+        if self.embed_slots.acquire(blocking=False):
+            return True
+        REJECTED.inc(route=route, reason="embed_busy")
+        return False
+
+
+def _create_admission():
+    buckets = SharedBuckets(ADMISSION_SHARED_DB) if ADMISSION_SHARED_DB else LocalBuckets()
+    return AdmissionController(buckets)
+
+
+services.register("admission", _create_admission)
+
+
+def get_admission() -> AdmissionController:
+    return services.get("admission")
+
+
+def too_many(retry_after: float, message: str = "Too many requests, please slow down"):
+    """(body, headers) for a 429."""
+    seconds = max(1, math.ceil(retry_after))
+    return {"status": "rate_limited", "message": message, "retry_after": seconds}, {"Retry-After": str(seconds)}
+
+
+def admit(route: str, embed: bool = False):
+    """
+    Flask view decorator (below @jwt_required) that charges the caller's
+    bucket for `route` and, with embed=True, holds one of the global embed
+    slots for the duration of the request.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return fn(*args, **kwargs)
+            from flask import jsonify
+            from flask_jwt_extended import get_jwt_identity
+
+            controller = get_admission()
+            # Take the global slot first so a busy server does not also
+            # drain the caller's bucket.
+            if embed and not controller.acquire_embed(route):
+                body, headers = too_many(EMBED_RETRY_AFTER, "Server is busy embedding, please retry shortly")
+                return jsonify(body), 429, headers
+            try:
+                wait = controller.check(get_jwt_identity(), route)
+                if wait:
+                    body, headers = too_many(wait)
+                    return jsonify(body), 429, headers
+                return fn(*args, **kwargs)
+            finally:
+                if embed:
+                    controller.embed_slots.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,55 @@
+from flask import Blueprint, request, jsonify
+
+import anchoring
+from logs import get_logger
+
+anchor_bp = Blueprint("anchor_bp", __name__)
+log = get_logger("anchor_routes")
+
+
+@anchor_bp.route("/anchor/proof/<sha256>", methods=["GET"])
+def get_proof(sha256):
+    """Merkle proof and batch details for an image registered in batch mode."""
+    entry = anchoring.proof_for(sha256) if anchoring.has_local_leaves() else None
+    if entry is None:
+        return jsonify({"error": "No batched image with this hash"}), 404
+    return jsonify(entry), 200
+
+
+@anchor_bp.route("/anchor/verify", methods=["POST"])
+def verify_proof():
+    """
+    Verify that an image is covered by an anchored root.
+
+    Body: {"sha256", "perceptual_hash", "uploader", "proof", "root"} with an
+    optional "chain_index" to also check against the contract. With only
+    "sha256", the locally stored leaf and proof are verified.
+    """
+    body = request.get_json(silent=True) or {}
+    sha256 = body.get("sha256")
+    if not sha256:
+        return jsonify({"error": "sha256 is required"}), 400
+
+    if "proof" not in body:
+        entry = anchoring.proof_for(sha256) if anchoring.has_local_leaves() else None
+        if entry is None:
+            return jsonify({"error": "No batched image with this hash"}), 404
+        if entry["status"] != "anchored":
+            return jsonify({"valid": False, "status": entry["status"], "message": "Batch not anchored yet"}), 409
+        body = {**entry, **{k: v for k, v in body.items() if v is not None}}
+
+    missing = [k for k in ("perceptual_hash", "uploader", "proof", "root") if body.get(k) is None]
+    if missing:
+        return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
+
+    try:
+        result = anchoring.verify(
+            sha256, body["perceptual_hash"], body["uploader"], body["proof"], body["root"],
+            chain_index=body.get("chain_index")
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Malformed proof: {e}"}), 400
+    except Exception as e:
+        log.error("proof verification failed: %s", e)
+        return jsonify({"error": "Verification failed", "detail": str(e)}), 503
+    return jsonify(result), 200
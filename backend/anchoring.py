@@ -0,0 +1,528 @@
+"""
+Merkle-batched anchoring of image hashes.
+
+With ANCHOR_MODE=batch, store_image_on_chain() no longer sends one
+storeImageHash transaction per upload. Each (sha256, pHash, uploader) is
+recorded locally as a leaf, and a background thread collects up to
+ANCHOR_BATCH_SIZE leaves (or whatever arrived within ANCHOR_BATCH_WINDOW
+seconds), builds a Merkle tree and anchors only its root with
+anchorBatch(). One transaction then covers hundreds of images.
+
+    leaf = keccak256(abi.encodePacked(sha256, pHash, uploader))
+    node = keccak256(min(a, b) ++ max(a, b))     (sorted pairs, odd node promoted)
+
+This is the layout the contract's verifyLeaf() and OpenZeppelin's
+MerkleProof expect. Leaves, their proofs and the batches are kept in the
+SQLite file ANCHOR_DB. Batched pHashes are not readable from the contract,
+so the similarity scan also compares against this file whenever it exists.
+A batch whose transaction fails releases its leaves into the next batch,
+while one whose transaction is still pending stays in "sending" and is
+polled until it is mined or dropped; after consecutive failures the next attempt waits twice as long each time,
+up to ANCHOR_RETRY_MAX seconds.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import blockchain
+import deadlines
+import services
+from job_store import pid_alive
+from logs import get_logger
+
+log = get_logger("anchoring")
+
+ANCHOR_MODE = os.getenv("ANCHOR_MODE", "single").lower()
+ANCHOR_DB = os.getenv("ANCHOR_DB", "anchor_batches.db")
+ANCHOR_BATCH_SIZE = int(os.getenv("ANCHOR_BATCH_SIZE", "256"))
+ANCHOR_BATCH_WINDOW = float(os.getenv("ANCHOR_BATCH_WINDOW", "5"))
+ANCHOR_GAS = int(os.getenv("ANCHOR_GAS", "200000"))
+ANCHOR_RETRY_MAX = float(os.getenv("ANCHOR_RETRY_MAX", "300"))
+# A batch another live process opened is only recovered after this many seconds
+ANCHOR_BATCH_STALE = float(os.getenv("ANCHOR_BATCH_STALE", "600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS anchor_leaves (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha256      TEXT NOT NULL,
+    phash       TEXT NOT NULL,
+    uploader    TEXT NOT NULL,
+    leaf        TEXT NOT NULL,
+    batch_id    INTEGER,
+    position    INTEGER,
+    proof       TEXT,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_anchor_leaves_sha ON anchor_leaves (sha256);
+CREATE INDEX IF NOT EXISTS idx_anchor_leaves_batch ON anchor_leaves (batch_id);
+CREATE TABLE IF NOT EXISTS anchor_batches (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    root        TEXT NOT NULL,
+    count       INTEGER NOT NULL,
+    status      TEXT NOT NULL,
+    tx_hash     TEXT,
+    chain_index INTEGER,
+    gas_used    INTEGER,
+    error       TEXT,
+    owner_pid   INTEGER,
+    created_at  REAL NOT NULL,
+    anchored_at REAL
+);
+"""
+
+
+class BatchReverted(Exception):
+    """The batch transaction was mined and reverted; its leaves go to the next batch."""
+
+
+class BatchInFlight(Exception):
+    """The batch transaction may have been broadcast; _recover settles it against the chain."""
+
+
+def _keccak(data: bytes) -> bytes:
+    from eth_utils import keccak
+    return keccak(data)
+
+
+def leaf_hash(sha256: str, phash: str, uploader: str) -> bytes:
+    """keccak256(abi.encodePacked(string, string, address))."""
+    return _keccak(sha256.encode() + phash.encode() + _unhex(uploader))
+
+
+def _parent(a: bytes, b: bytes) -> bytes:
+    return _keccak(a + b) if a < b else _keccak(b + a)
+
+
+def merkle_levels(leaves: list) -> list:
+    """All tree levels, leaves first and the root last."""
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([
+            _parent(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ])
+    return levels
+
+
+def merkle_proof(levels: list, index: int) -> list:
+    """Sibling hashes from leaf `index` up to the root."""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf: bytes, proof: list, root: bytes) -> bool:
+    node = leaf
+    for sibling in proof:
+        node = _parent(node, sibling)
+    return node == root
+
+
+def _hex(value: bytes) -> str:
+    return "0x" + value.hex()
+
+
+def _unhex(value: str) -> bytes:
+    return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+
+
+class LeafStore:
+    """Leaves, proofs and batches in SQLite (see _SCHEMA)."""
+
+    def __init__(self, path: str = ANCHOR_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(anchor_batches)")}
+        if "owner_pid" not in columns:
+            # Files written before batches recorded their process
+            self._conn.execute("ALTER TABLE anchor_batches ADD COLUMN owner_pid INTEGER")
+
+    def add(self, sha256: str, phash: str, uploader: str) -> int:
+        leaf = _hex(leaf_hash(sha256, phash, uploader))
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO anchor_leaves (sha256, phash, uploader, leaf, created_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, phash, uploader, leaf, time.time())
+            )
+            return cur.lastrowid
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM anchor_leaves WHERE batch_id IS NULL").fetchone()[0]
+
+    def open_batch(self, limit: int):
+        """
+        Assign up to `limit` unbatched leaves to a new batch and store each
+        leaf's proof. Returns (batch id, root, leaf count) or None if nothing
+        is pending.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, leaf FROM anchor_leaves WHERE batch_id IS NULL ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+                if not rows:
+                    self._conn.execute("COMMIT")
+                    return None
+                levels = merkle_levels([_unhex(r["leaf"]) for r in rows])
+                root = _hex(levels[-1][0])
+                batch_id = self._conn.execute(
+                    "INSERT INTO anchor_batches (root, count, status, owner_pid, created_at) "
+                    "VALUES (?, ?, 'sending', ?, ?)",
+                    (root, len(rows), os.getpid(), time.time())
+                ).lastrowid
+                self._conn.executemany(
+                    "UPDATE anchor_leaves SET batch_id = ?, position = ?, proof = ? WHERE id = ?",
+                    [
+                        (batch_id, n, json.dumps([_hex(p) for p in merkle_proof(levels, n)]), r["id"])
+                        for n, r in enumerate(rows)
+                    ]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return batch_id, root, len(rows)
+
+    def update_batch(self, batch_id: int, **fields):
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE anchor_batches SET {columns} WHERE id = ?", (*fields.values(), batch_id))
+
+    def fail_batch(self, batch_id: int, error: str) -> bool:
+        """
+        Mark a batch that is still sending failed and hand its leaves to the
+        next one. False if it was already settled (e.g. by another process).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.execute(
+                    "UPDATE anchor_batches SET status = 'failed', error = ? WHERE id = ? AND status = 'sending'",
+                    (error, batch_id)
+                )
+                if cur.rowcount:
+                    self._conn.execute(
+                        "UPDATE anchor_leaves SET batch_id = NULL, position = NULL, proof = NULL WHERE batch_id = ?",
+                        (batch_id,)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def anchor_batch(self, batch_id: int, chain_index, gas_used: int) -> bool:
+        """Mark a batch that is still sending anchored. False if it was already settled."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE anchor_batches SET status = 'anchored', chain_index = ?, gas_used = ?, anchored_at = ? "
+                "WHERE id = ? AND status = 'sending'",
+                (chain_index, gas_used, time.time(), batch_id)
+            )
+        return cur.rowcount == 1
+
+    def batches(self, status: str = None) -> list:
+        with self._lock:
+            if status is None:
+                rows = self._conn.execute("SELECT * FROM anchor_batches ORDER BY id").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM anchor_batches WHERE status = ? ORDER BY id", (status,)
+                ).fetchall()
+        return [dict(r) for r in rows]
+
+    def lookup(self, sha256: str):
+        """The newest leaf for `sha256` joined with its batch, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT l.*, b.root, b.status, b.tx_hash, b.chain_index, b.anchored_at "
+                "FROM anchor_leaves l LEFT JOIN anchor_batches b ON b.id = l.batch_id "
+                "WHERE l.sha256 = ? ORDER BY l.id DESC LIMIT 1", (sha256,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["proof"] = json.loads(entry["proof"]) if entry["proof"] else None
+        return entry
+
+    def phashes(self) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, sha256, phash, uploader, batch_id, created_at FROM anchor_leaves"
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BatchAnchorer:
+    """Collects leaves and anchors their Merkle roots from a background thread."""
+
+    def __init__(self, store: LeafStore, batch_size: int = ANCHOR_BATCH_SIZE, window: float = ANCHOR_BATCH_WINDOW,
+                 stale: float = ANCHOR_BATCH_STALE):
+        self.store = store
+        self.stale = stale
+        self.batch_size = batch_size
+        self.window = window
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._failures = 0
+        self._retry_at = 0.0
+        # flush() and _recover() never run at once (close() flushes from another thread)
+        self._busy = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="anchor-batcher", daemon=True)
+
+    def start(self):
+        self._recover()
+        self._thread.start()
+        return self
+
+    def submit(self, sha256: str, phash: str, uploader: str = None) -> dict:
+        """Record a leaf for the next batch. Returns a store_image_on_chain()-shaped result."""
+        leaf_id = self.store.add(sha256, phash, uploader or blockchain.ACCOUNT_ADDRESS)
+        if self.store.pending_count() >= self.batch_size:
+            self._wake.set()
+        return {"txHash": None, "status": "queued", "gasUsed": 0, "batched": True, "leafId": leaf_id}
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.window)
+            self._wake.clear()
+            self._recover()
+            # Backing off after a failure; a full batch does not cut it short
+            if time.time() >= self._retry_at:
+                self.flush()
+
+    def flush(self):
+        """Anchor every pending leaf, in batches of at most batch_size."""
+        with self._busy:
+            while True:
+                opened = self.store.open_batch(self.batch_size)
+                if opened is None:
+                    return
+                batch_id, root, count = opened
+                try:
+                    self._anchor(batch_id, root, count)
+                except Exception as e:
+                    self._failures += 1
+                    delay = min(ANCHOR_RETRY_MAX, self.window * 2 ** min(self._failures - 1, 16))
+                    self._retry_at = time.time() + delay
+                    log.error("batch anchor failed: %s", e, extra={
+                        "batch": batch_id, "failures": self._failures, "retry_in": delay
+                    })
+                    # A transaction that may be out stays "sending" for _recover
+                    if not isinstance(e, BatchInFlight):
+                        self.store.fail_batch(batch_id, str(e))
+                    return
+                self._failures = 0
+
+    def _anchor(self, batch_id: int, root: str, count: int):
+        w3 = blockchain.get_w3()
+        contract = blockchain.get_contract()
+        with blockchain.send_lock:
+            tx = contract.functions.anchorBatch(_unhex(root), count).build_transaction({
+                "from": blockchain.ACCOUNT_ADDRESS,
+                "nonce": w3.eth.get_transaction_count(blockchain.ACCOUNT_ADDRESS, "pending"),
+                "gas": ANCHOR_GAS,
+                "gasPrice": w3.eth.gas_price
+            })
+            signed = w3.eth.account.sign_transaction(tx, blockchain.PRIVATE_KEY)
+            # Recorded first, so a crash before the receipt is settled by _recover
+            self.store.update_batch(batch_id, tx_hash=signed.hash.hex())
+            try:
+                w3.eth.send_raw_transaction(signed.raw_transaction)
+            except Exception as e:
+                raise BatchInFlight(f"send failed, transaction may be out: {e}") from e
+        # From here on, only a revert settles the batch as failed
+        try:
+            receipt = w3.eth.wait_for_transaction_receipt(signed.hash, timeout=blockchain.RECEIPT_TIMEOUT)
+            self._confirm(batch_id, receipt)
+        except BatchReverted:
+            raise
+        except Exception as e:
+            raise BatchInFlight(f"batch transaction not settled: {e}") from e
+
+    def _confirm(self, batch_id: int, receipt):
+        contract = blockchain.get_contract()
+        if receipt.status != 1:
+            raise BatchReverted(f"anchorBatch reverted (tx {receipt.transactionHash.hex()})")
+        events = contract.events.BatchAnchored().process_receipt(receipt)
+        chain_index = events[0]["args"]["index"] if events else None
+        if not self.store.anchor_batch(batch_id, chain_index, receipt.gasUsed):
+            log.warning("batch already settled elsewhere", extra={"batch": batch_id})
+            return
+        log.info("batch anchored", extra={
+            "batch": batch_id, "chain_index": chain_index, "gas_used": receipt.gasUsed,
+            "tx": receipt.transactionHash.hex()
+        })
+
+    def _recoverable(self, batch) -> bool:
+        """Batches of this process, of a process that is gone, or open for longer than stale."""
+        return (
+            batch["owner_pid"] == os.getpid()
+            or not pid_alive(batch["owner_pid"])
+            or time.time() - batch["created_at"] > self.stale
+        )
+
+    def _recover(self):
+        """
+        Settle batches left in "sending" by a receipt wait that did not
+        finish, or by a process that stopped (or stalled past `stale`). A
+        batch is anchored once its transaction is mined, and released into
+        the next batch if it reverted or the node does not know it (never
+        sent, or dropped). A transaction still pending, or one that cannot
+        be checked right now, keeps its batch in "sending" for the next round.
+        Batches another live process has just opened are left to it.
+        """
+        from web3.exceptions import TransactionNotFound
+
+        with self._busy:
+            w3 = None
+            for batch in self.store.batches("sending"):
+                if not self._recoverable(batch):
+                    continue
+                if not batch["tx_hash"]:
+                    log.warning("releasing unsent batch", extra={"batch": batch["id"]})
+                    self.store.fail_batch(batch["id"], "batch transaction never sent")
+                    continue
+                w3 = w3 or blockchain.get_w3()
+                try:
+                    try:
+                        receipt = w3.eth.get_transaction_receipt(batch["tx_hash"])
+                    except TransactionNotFound:
+                        try:
+                            w3.eth.get_transaction(batch["tx_hash"])
+                        except TransactionNotFound:
+                            log.warning("releasing batch with unknown transaction", extra={
+                                "batch": batch["id"], "tx": batch["tx_hash"]
+                            })
+                            self.store.fail_batch(batch["id"], "batch transaction unknown to the node")
+                        continue
+                    self._confirm(batch["id"], receipt)
+                except BatchReverted as e:
+                    log.warning("releasing unanchored batch: %s", e, extra={"batch": batch["id"]})
+                    self.store.fail_batch(batch["id"], str(e))
+                except Exception as e:
+                    log.warning("could not settle batch transaction: %s", e, extra={"batch": batch["id"]})
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+def _create_anchorer():
+    return BatchAnchorer(get_leaf_store()).start()
+
+
+def batching() -> bool:
+    return ANCHOR_MODE == "batch"
+
+
+# Batched pHashes stay relevant to duplicate checks after switching back to
+# single mode, so the store is opened whenever its file exists.
+LOCAL_LEAVES = batching() or os.path.exists(ANCHOR_DB)
+
+# Registered only when used, so single mode's /ready and warm-up are unchanged
+if LOCAL_LEAVES:
+    services.register("anchor_store", LeafStore)
+if batching():
+    services.register("anchorer", _create_anchorer)
+
+
+def get_leaf_store() -> LeafStore:
+    return services.get("anchor_store")
+
+
+def get_anchorer() -> BatchAnchorer:
+    return services.get("anchorer")
+
+
+def has_local_leaves() -> bool:
+    """Whether batched leaves exist that the similarity scan must include."""
+    return LOCAL_LEAVES
+
+
+def add_local_matches(result: dict, new_phash: str, threshold: int) -> dict:
+    """Fold batched leaves within `threshold` into an is_similar_to_existing() result."""
+    if not has_local_leaves():
+        return result
+    store = get_leaf_store()
+    min_distance = result["min_distance"] if result["min_distance"] is not None else float("inf")
+    for n, row in enumerate(store.phashes()):
+        if n % 4096 == 0:
+            deadlines.check()
+        distance = blockchain.hamming_distance(new_phash, row["phash"])
+        min_distance = min(min_distance, distance)
+        if distance <= threshold:
+            result["similar_images"].append({
+                "index": None,
+                "leafId": row["id"],
+                "batch": row["batch_id"],
+                "shaHash": row["sha256"],
+                "perceptualHash": row["phash"],
+                "uploader": row["uploader"],
+                "timestamp": int(row["created_at"]),
+                "distance": distance
+            })
+    result["min_distance"] = min_distance if min_distance != float("inf") else None
+    result["is_duplicate"] = len(result["similar_images"]) > 0
+    return result
+
+
+def proof_for(sha256: str):
+    """Leaf, proof and batch details for an image, or None if it was never batched."""
+    entry = get_leaf_store().lookup(sha256)
+    if entry is None:
+        return None
+    return {
+        "sha256": entry["sha256"],
+        "perceptual_hash": entry["phash"],
+        "uploader": entry["uploader"],
+        "leaf": entry["leaf"],
+        "proof": entry["proof"],
+        "position": entry["position"],
+        "batch": entry["batch_id"],
+        "root": entry["root"],
+        "status": entry["status"] or "pending",
+        "tx_hash": entry["tx_hash"],
+        "chain_index": entry["chain_index"],
+    }
+
+
+def verify(sha256: str, phash: str, uploader: str, proof: list, root: str, chain_index: int = None) -> dict:
+    """
+    Check that (sha256, phash, uploader) is included under `root`. With a
+    chain_index, also confirm that root is the one anchored on chain and let
+    the contract check the proof itself.
+    """
+    leaf = leaf_hash(sha256, phash, uploader)
+    proof_bytes = [_unhex(p) for p in proof]
+    result = {"leaf": _hex(leaf), "valid": verify_proof(leaf, proof_bytes, _unhex(root)), "on_chain": None}
+    if chain_index is not None:
+        contract = blockchain.get_contract()
+        anchored_root = contract.functions.getBatch(chain_index).call()[0]
+        result["on_chain"] = (
+            anchored_root == _unhex(root)
+            and contract.functions.verifyLeaf(chain_index, leaf, proof_bytes).call()
+        )
+    return result
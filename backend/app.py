@@ -1,85 +1,83 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, send_file
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt_identity
 )
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import pandas as pd
 import datetime
 import os
+import time
 from dotenv import load_dotenv
+import services
+from sentiment import analyze_sentiment
+from pagination import parse_page_args, fetch_page, count_rows
+from derivatives import add_preview_urls
+import metrics
+import profiling
+from logs import get_logger
+from passwords import PasswordHasher, HasherBusy, BCRYPT_LOG_ROUNDS, AUTH_RETRY_AFTER
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+log = get_logger("app")
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # Configurations
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "sqlite:///users.db")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY", "super-secret")
+app.config['BCRYPT_LOG_ROUNDS'] = BCRYPT_LOG_ROUNDS
 
 # Extensions
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+# bcrypt on a bounded pool, off the request threads
+passwords = PasswordHasher(bcrypt)
 jwt = JWTManager(app)
 
-# Supabase client
-try:
-    from supabaseClient import supabase
-except Exception as e:
-    supabase = None
-    print("Warning: supabaseClient.supabase not loaded:", e)
+# Supabase client (created lazily on first use)
+from supabaseClient import get_supabase
 
 # Blockchain + stego upload logic
 try:
     from uploadFile import async_upload_stego_and_insert
 except Exception as e:
     async_upload_stego_and_insert = None
-    print("Warning: uploadFile.async_upload_stego_and_insert not loaded:", e)
+    log.warning("uploadFile.async_upload_stego_and_insert not loaded: %s", e)
 
 # Upload blueprint
 try:
     from stego_routes import upload_bp
 except Exception as e:
     upload_bp = None
-    print("Warning: stego_routes.upload_bp not loaded:", e)
+    log.warning("stego_routes.upload_bp not loaded: %s", e)
 
 # Comments blueprint
 try:
     from comments_routes import comments_bp
     app.register_blueprint(comments_bp)
 except Exception as e:
-    print("Warning: comments_routes not loaded:", e)
+    log.warning("comments_routes not loaded: %s", e)
+
+# Feed blueprint (posts with their first comments attached)
+try:
+    from feed_routes import feed_bp
+    app.register_blueprint(feed_bp)
+except Exception as e:
+    log.warning("feed_routes not loaded: %s", e)
 
-# Emoji sentiment scoring
-emoji_scores = {}
+# Merkle-batch proofs (ANCHOR_MODE=batch)
 try:
-    df = pd.read_csv("Datasets/Emoji_trimmed.csv")
-    df['Score'] = df['Positive'] - df['Negative']
-    emoji_scores = dict(zip(df['Emoji'], df['Score']))
+    from anchor_routes import anchor_bp
+    app.register_blueprint(anchor_bp)
 except Exception as e:
-    print("Emoji dataset not loaded:", e)
-
-_analyzer = SentimentIntensityAnalyzer()
-
-def analyze_sentiment_text(text: str):
-    score = _analyzer.polarity_scores(text)
-    compound = score.get("compound", 0.0)
-    for ch in text:
-        if ch in emoji_scores:
-            compound += emoji_scores[ch]
-    score["compound"] = compound
-    if compound > 0.05:
-        sentiment = "positive"
-    elif compound < -0.05:
-        sentiment = "negative"
-    else:
-        sentiment = "neutral"
-    return sentiment, score
+    log.warning("anchor_routes not loaded: %s", e)
+
+# Emoji-aware VADER sentiment scoring (analyzer and lexicon load on first use)
+analyze_sentiment_text = analyze_sentiment
 
 def _extract_supabase_result(resp):
     if resp is None:
@@ -117,7 +115,10 @@ def register():
     if User.query.filter_by(username=username).first():
         return jsonify({"msg": "Username already exists"}), 400
 
-    hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        hashed_pw = passwords.hash(password)
+    except HasherBusy:
+        return _auth_busy()
     new_user = User(email=email, username=username, password=hashed_pw)
     db.session.add(new_user)
     db.session.commit()
@@ -133,12 +134,28 @@ def login():
         return jsonify({"msg": "username and password required"}), 400
 
     user = User.query.filter_by(username=username).first()
-    if not user or not bcrypt.check_password_hash(user.password, password):
-        return jsonify({"msg": "Invalid credentials"}), 401
+    try:
+        if not user or not passwords.verify(user.password, password):
+            return jsonify({"msg": "Invalid credentials"}), 401
+    except HasherBusy:
+        return _auth_busy()
+
+    # Transparently move the stored hash to the configured work factor
+    # (skipped when the pool is saturated; the next login retries)
+    if passwords.needs_rehash(user.password):
+        try:
+            user.password = passwords.hash(password)
+            db.session.commit()
+        except HasherBusy:
+            pass
 
     access_token = create_access_token(identity=username, expires_delta=datetime.timedelta(hours=1))
     return jsonify({"access_token": access_token, "username": user.username})
 
+def _auth_busy():
+    return jsonify({"msg": "Too many sign-in attempts in progress, please retry shortly"}), 503, \
+        {"Retry-After": str(AUTH_RETRY_AFTER)}
+
 # Sentiment analysis
 @app.route('/analyze', methods=['POST'])
 @jwt_required()
@@ -152,6 +169,7 @@ def analyze():
 @app.route('/comments', methods=['POST'])
 @jwt_required()
 def add_comment():
+    supabase = get_supabase()
     if supabase is None:
         return jsonify({"error": "Supabase client not configured"}), 500
 
@@ -189,6 +207,7 @@ def add_comment():
 
 @app.route('/comments', methods=['GET'])
 def get_comments():
+    supabase = get_supabase()
     if supabase is None:
         return jsonify({"error": "Supabase client not configured"}), 500
 
@@ -207,30 +226,139 @@ def get_comments():
 
     return jsonify({"comments": data or []}), 200
 
-# User's uploaded posts
+# User's uploaded posts (same paging params as GET /upload)
 @app.route("/my-posts", methods=["GET"])
 @jwt_required()
 def get_my_posts():
     username = get_jwt_identity()
+    supabase = get_supabase()
+    if supabase is None:
+        return jsonify({"error": "Supabase client not configured"}), 500
+
+    try:
+        limit, cursor, columns = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
-        resp = supabase.table("stego_uploads").select("*").eq("username", username).order("created_at", desc=True).execute()
-        data = resp.data
+        data, next_cursor = fetch_page(
+            supabase, "stego_uploads", columns, limit, cursor, filters={"username": username}
+        )
+        # The profile's post count; later pages don't repeat it
+        total = None if cursor else count_rows(supabase, "stego_uploads", filters={"username": username})
     except Exception as e:
         return jsonify({"error": "Failed to fetch posts", "detail": str(e)}), 500
 
-    return jsonify({"posts": data}), 200
+    add_preview_urls(data)
+    body = {"posts": data, "next_cursor": next_cursor}
+    if total is not None:
+        body["total"] = total
+    return jsonify(body), 200
 
 # Health check
 @app.route("/health")
 def health():
     return "OK", 200
 
+# Readiness: which lazily initialized subsystems have been built
+@app.route("/ready")
+def ready():
+    states = services.status()
+    ok = all(state == "ready" for state in states.values())
+    return jsonify({"ready": ok, "services": states}), (200 if ok else 503)
+
+# Outbound connection-pool utilization (Web3 RPC and Supabase); admin only,
+# with the profiling token (X-Profile: <PROFILE_TOKEN>)
+@app.route("/stats/pools")
+def stats_pools():
+    if not profiling.authorized(request.headers.get(profiling.HEADER)):
+        return jsonify({"error": "Not found"}), 404
+    from http_pools import pool_stats
+    return jsonify(pool_stats()), 200
+
+# Prometheus scrape endpoint (per-stage timings, request latency, RPC calls,
+# registry size, upload queue depth, pool usage)
+@app.route("/metrics")
+def metrics_endpoint():
+    import http_pools  # noqa: F401 -- registers the pool gauges
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# Recent profiling captures (PROFILE_ENABLED=1, X-Profile: <PROFILE_TOKEN>)
+@app.route("/debug/profiles")
+def list_profiles():
+    if not profiling.PROFILE_ENABLED or not profiling.authorized(request.headers.get(profiling.HEADER)):
+        return jsonify({"error": "Not found"}), 404
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    return jsonify({"dir": profiling.PROFILE_DIR, "profiles": profiling.recent(limit)}), 200
+
+@app.route("/debug/profiles/<name>")
+def get_profile(name):
+    if not profiling.PROFILE_ENABLED or not profiling.authorized(request.headers.get(profiling.HEADER)):
+        return jsonify({"error": "Not found"}), 404
+    path = profiling.capture_path(name)
+    if path is None:
+        return jsonify({"error": "Not found"}), 404
+    return send_file(path, as_attachment=True, download_name=name)
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = profiling.begin(
+        request.path, request.headers.get(profiling.HEADER), request.headers.get("X-Request-ID")
+    )
+
+@app.after_request
+def _record_request_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=endpoint, method=request.method, status=response.status_code
+        )
+    capture = g.pop("profile", None)
+    if capture is not None:
+        profiling.end(capture, response.status_code)
+        response.headers["X-Profile-Id"] = capture.request_id
+    return response
+
+@app.teardown_request
+def _finish_profile(exc):
+    # after_request does not run when a view raises
+    capture = g.pop("profile", None)
+    if capture is not None:
+        profiling.end(capture, 500)
+
 # Register upload blueprint if available
 if upload_bp:
     try:
         app.register_blueprint(upload_bp)
     except Exception as e:
-        print("Failed to register upload_bp:", e)
+        log.error("failed to register upload_bp: %s", e)
+
+# Resume background uploads a previous process left unfinished. Off by
+# default so importing the app stays lazy; the executor (and its resume)
+# is otherwise built by services.warm_up() or the first upload.
+if async_upload_stego_and_insert is not None and os.getenv("UPLOAD_RESUME_ON_START", "0") == "1":
+    try:
+        from uploadFile import get_upload_executor
+        get_upload_executor()
+    except Exception as e:
+        log.warning("upload job queue not resumed: %s", e)
+
+# The anchor batcher and the uploads janitor are registered services, started
+# like the executor: by services.warm_up() or on first use (the first batched
+# chain write, the first upload). Importing janitor only registers it.
+try:
+    import janitor  # noqa: F401 -- registers the upload_janitor service
+except Exception as e:
+    log.warning("uploads janitor not registered: %s", e)
+
+# Optional eager initialization (WARM_UP=1); pre-fork servers should call
+# services.preload_modules() in the master and services.warm_up() per worker.
+if services.warm_up_enabled():
+    services.preload_modules()
+    services.warm_up()
 
 # Run the app
 if __name__ == '__main__':
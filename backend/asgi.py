@@ -0,0 +1,549 @@
+"""
+Async serving mode.
+
+/check-duplicate, /upload, /comments and /feed are served by async handlers
+that use AsyncWeb3 (blockchain_async.py) and the async Supabase client, so a
+request waiting on Ganache or Supabase - most notably on a transaction
+receipt - holds no thread. CPU-bound steps (sentiment, LSB reveal, pHash,
+embedding, SHA-256) run on a thread pool of ASYNC_CPU_WORKERS. Every other
+route is served by the Flask app, mounted underneath.
+
+    pip install uvicorn starlette python-multipart a2wsgi aiohttp
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Responses match the Flask routes. The background upload queue
+(uploadFile.py) is shared with the sync mode; in-flight uploads are bounded
+by its slots, so raise UPLOAD_QUEUE_MAX to admit more concurrent uploads.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import blockchain
+import blockchain_async
+import metrics
+import precheck
+import profiling
+import admission
+import reservations
+from app import app as flask_app
+from cache import get_comment_cache
+from comments_routes import SupabaseError, _extract_supabase_result
+from deadlines import deadline, DeadlineExceeded, CHECK_DUPLICATE_DEADLINE, UPLOAD_DEADLINE
+from derivatives import add_preview_urls
+from feed_routes import FEED_COMMENTS_DEFAULT, FEED_COMMENTS_MAX, aattach_comments
+from logs import get_logger
+from pagination import afetch_page, parse_page_args
+from reservations import get_reservations
+from sentiment import analyze_sentiment
+from stego_routes import UPLOAD_RETRY_AFTER
+from stego_utils import (
+    STEGO_LOCAL_RETENTION, embed_message_bytes, get_bytes_hash, get_image_hash, get_perceptual_hash,
+    new_stego_path, reveal_message, spool_upload
+)
+from supabaseClient import get_async_supabase
+from uploadFile import async_upload_stego_and_insert, get_upload_executor
+
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", str(os.cpu_count() or 4)))
+SIMILARITY_THRESHOLD = 10
+
+log = get_logger("asgi")
+
+_cpu = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="cpu")
+
+
+async def run_cpu(fn, *args):
+    """Run a CPU-bound call on the worker pool."""
+    return await asyncio.get_running_loop().run_in_executor(_cpu, fn, *args)
+
+
+def _remove(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class AuthError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.response = JSONResponse({"msg": message}, status_code=status)
+
+
+def jwt_identity(request, optional=False):
+    """
+    Identity from the Bearer token, validated with the Flask app's
+    flask_jwt_extended settings so tokens work in both modes.
+    """
+    from flask_jwt_extended import decode_token
+    from flask_jwt_extended.config import config
+
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        if optional:
+            return None
+        raise AuthError("Missing Authorization Header", 401)
+    try:
+        with flask_app.app_context():
+            return decode_token(header[len("Bearer "):])[config.identity_claim_key]
+    except Exception as e:
+        if type(e).__name__ == "ExpiredSignatureError":
+            raise AuthError("Token has expired", 401)
+        raise AuthError(str(e), 422)
+
+
+def observed(handler):
+    """Record request latency under the route path, as the Flask hooks do."""
+    async def wrapper(request):
+        start = time.perf_counter()
+        # Work hops between the loop and the CPU pool, so sample every thread
+        capture = profiling.begin(
+            request.url.path, request.headers.get(profiling.HEADER), request.headers.get("X-Request-ID"),
+            all_threads=True
+        )
+        response = None
+        try:
+            response = await handler(request)
+        except AuthError as e:
+            response = e.response
+        finally:
+            # An unhandled exception is recorded as the 500 it becomes, then re-raised
+            status = response.status_code if response is not None else 500
+            if capture is not None:
+                profiling.end(capture, status)
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                endpoint=request.url.path, method=request.method, status=status
+            )
+        if capture is not None:
+            response.headers["X-Profile-Id"] = capture.request_id
+        return response
+    return wrapper
+
+
+@observed
+async def check_duplicate(request):
+    username = jwt_identity(request)
+    denied = await _admission_denied(username, "check_duplicate")
+    if denied:
+        return denied
+    form = await request.form()
+    image = form.get("image")
+    if image is None or isinstance(image, str):
+        return JSONResponse({"status": "error", "message": "Image required"}, 400)
+
+    with deadline(CHECK_DUPLICATE_DEADLINE):
+        try:
+            return await _check_duplicate(image, username)
+        except DeadlineExceeded:
+            log.warning("duplicate check: deadline of %ss exceeded", CHECK_DUPLICATE_DEADLINE)
+            return _timed_out()
+
+
+async def _admission_denied(username, route):
+    """429 response if `username` is over budget for `route`, else None."""
+    if not admission.ADMISSION_ENABLED:
+        return None
+    # Shared buckets take a SQLite write lock (up to its 5s busy timeout)
+    wait = await asyncio.to_thread(admission.get_admission().check, username, route)
+    if not wait:
+        return None
+    body, headers = admission.too_many(wait)
+    return JSONResponse(body, 429, headers=headers)
+
+
+def _timed_out():
+    return JSONResponse({
+        "status": "error",
+        "message": "Blockchain call timed out",
+        "hint": "Check if Ganache is running on http://127.0.0.1:8545"
+    }, 503)
+
+
+async def _check_duplicate(image, username):
+    try:
+        if not await blockchain_async.health_check():
+            return JSONResponse({"status": "error", "message": "Blockchain connection unavailable"}, 503)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.warning("duplicate check: health check failed: %s", e)
+        return JSONResponse({
+            "status": "error",
+            "message": f"Blockchain health check failed: {str(e)}"
+        }, 503)
+
+    # Spooled like /upload: in memory up to UPLOAD_SPOOL_MAX, never a whole
+    # large body read into bytes
+    spool = await run_cpu(spool_upload, image)
+    try:
+        image_sha256 = await run_cpu(get_image_hash, spool)
+        try:
+            phash = await run_cpu(get_perceptual_hash, spool)
+        except Exception as e:
+            log.error("duplicate check: failed to compute perceptual hash: %s", e)
+            return JSONResponse({
+                "status": "error",
+                "message": "Failed to compute perceptual hash",
+                "error": str(e)
+            }, 500)
+    finally:
+        spool.close()
+
+    try:
+        result = await blockchain_async.is_similar_to_existing(phash, similarity_threshold=SIMILARITY_THRESHOLD)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.exception("duplicate check: blockchain similarity check failed: %s", e)
+        return JSONResponse({
+            "status": "error",
+            "message": "Failed to check for duplicates on blockchain",
+            "error": str(e),
+            "hint": "Make sure Ganache is running and contract is deployed"
+        }, 500)
+
+    if result["is_duplicate"]:
+        return JSONResponse({
+            "status": "duplicate",
+            "is_duplicate": True,
+            "message": "Similar image already exists on blockchain",
+            "similar_images": [
+                {k: img[k] for k in ("index", "timestamp", "distance", "uploader")}
+                for img in result["similar_images"]
+            ],
+            "min_distance": result["min_distance"],
+            "perceptual_hash": phash
+        })
+    return JSONResponse({
+        "status": "unique",
+        "is_duplicate": False,
+        "message": "Image is unique",
+        "perceptual_hash": phash,
+        "min_distance": result["min_distance"],
+        "precheck_token": precheck.issue(
+            username, image_sha256, phash, blockchain.CONTRACT_ADDRESS, result["registry_size"]
+        )
+    })
+
+
+@observed
+async def upload(request):
+    username = jwt_identity(request)
+    controller = admission.get_admission() if admission.ADMISSION_ENABLED else None
+    # Global slot first so a busy server does not also drain the caller's bucket
+    if controller is not None and not controller.acquire_embed("upload"):
+        body, headers = admission.too_many(
+            admission.EMBED_RETRY_AFTER, "Server is busy embedding, please retry shortly"
+        )
+        return JSONResponse(body, 429, headers=headers)
+    try:
+        denied = await _admission_denied(username, "upload")
+        return denied or await _upload(request, username)
+    finally:
+        if controller is not None:
+            controller.embed_slots.release()
+
+
+async def _upload(request, username):
+    form = await request.form()
+    image, message = form.get("image"), form.get("message")
+    precheck_token = form.get("precheck_token")
+    if image is None or isinstance(image, str) or message is None:
+        return JSONResponse({"status": "error", "message": "Image and message required"}, 400)
+
+    slot = get_upload_executor().reserve()
+    if slot is None:
+        return JSONResponse({
+            "status": "busy",
+            "message": "Too many uploads in progress, please retry shortly"
+        }, 503, headers={"Retry-After": str(UPLOAD_RETRY_AFTER)})
+
+    spool = None
+    try:
+        # Starlette's own spool is copied into ours, which stays in memory up
+        # to UPLOAD_SPOOL_MAX instead of reading the whole body into bytes
+        spool = await run_cpu(spool_upload, image)
+        reused = None
+        if precheck_token:
+            reused = precheck.verify(
+                precheck_token, username, await run_cpu(get_image_hash, spool), blockchain.CONTRACT_ADDRESS
+            )
+        with deadline(UPLOAD_DEADLINE):
+            return await _process_upload(spool, message, username, slot, reused)
+    except DeadlineExceeded:
+        log.warning("upload: deadline of %ss exceeded", UPLOAD_DEADLINE, extra={"user": username})
+        return _timed_out()
+    finally:
+        slot.release_unused()
+        if spool is not None:
+            spool.close()
+
+
+async def _process_upload(image, message, username, slot, reused=None):
+    sentiment, score = await run_cpu(analyze_sentiment, message)
+    if sentiment == "negative":
+        return JSONResponse({
+            "status": "rejected",
+            "message": "Cannot embed secret message is not positive.",
+            "sentiment": sentiment,
+            "score": score
+        }, 400)
+
+    try:
+        hidden_message = await run_cpu(reveal_message, image)
+    except Exception as e:
+        log.warning("reveal error: %s", e)
+        hidden_message = None
+    if hidden_message:
+        return JSONResponse({"status": "hidden data detected", "hidden_message": hidden_message}, 400)
+
+    try:
+        if not await blockchain_async.health_check():
+            return JSONResponse({"status": "error", "message": "Blockchain connection unavailable"}, 503)
+        if reused:
+            phash, checked_up_to = reused
+        else:
+            phash, checked_up_to = await run_cpu(get_perceptual_hash, image), 0
+        result = await blockchain_async.is_similar_to_existing(
+            phash, similarity_threshold=SIMILARITY_THRESHOLD, start_index=checked_up_to
+        )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error("duplicate check failed: %s", e)
+        return JSONResponse({
+            "status": "error",
+            "message": "Failed to verify image uniqueness on blockchain",
+            "error": str(e)
+        }, 500)
+
+    if result["is_duplicate"]:
+        similar = result["similar_images"][0]
+        log.info("duplicate upload blocked", extra={
+            "user": username, "index": similar["index"], "distance": similar["distance"]
+        })
+        return _duplicate_response(similar)
+
+    reservation = None
+    if reservations.UPLOAD_CHAIN_ASYNC:
+        reservation, conflict = await run_cpu(get_reservations().reserve, phash, username, SIMILARITY_THRESHOLD)
+        if conflict:
+            log.info("duplicate upload blocked by a pending upload", extra={
+                "user": username, "reservation": conflict["reservation"], "distance": conflict["distance"]
+            })
+            return _duplicate_response(conflict)
+    try:
+        return await _embed_and_register(image, message, username, slot, phash, sentiment, score, reused,
+                                         reservation)
+    finally:
+        if reservation is not None:
+            await run_cpu(reservation.release_unused)
+
+
+def _duplicate_response(similar):
+    return JSONResponse({
+        "status": "duplicate",
+        "message": "This image is too similar to an existing image on the blockchain",
+        "is_duplicate": True,
+        "details": {
+            "distance": similar["distance"],
+            "threshold": SIMILARITY_THRESHOLD,
+            "existing_image_index": similar["index"],
+            "existing_uploader": similar["uploader"],
+            "timestamp": similar["timestamp"]
+        }
+    }, 409)
+
+
+async def _embed_and_register(image, message, username, slot, phash, sentiment, score, reused, reservation):
+    output_path = new_stego_path()
+    try:
+        stego_bytes = await run_cpu(embed_message_bytes, image, message)
+        if STEGO_LOCAL_RETENTION != "none":
+            await run_cpu(_write, output_path, stego_bytes)
+        image_hash = await run_cpu(get_bytes_hash, stego_bytes)
+    except Exception as e:
+        log.error("embedding failed: %s", e)
+        _remove(output_path)
+        return JSONResponse({"status": "error", "message": "Failed to embed message.", "error": str(e)}, 500)
+
+    # With a reservation the upload job stores on chain before anything else
+    if reservation is not None:
+        tx_result = {"txHash": None, "status": "pending"}
+    else:
+        try:
+            tx_result = await blockchain_async.store_image_on_chain(sha_hash=image_hash, perceptual_hash=phash)
+        except DeadlineExceeded:
+            _remove(output_path)
+            raise
+        except Exception as e:
+            log.error("failed to store on chain: %s", e)
+            _remove(output_path)
+            return JSONResponse({
+                "status": "error",
+                "message": "Failed to store image on blockchain",
+                "error": str(e)
+            }, 500)
+
+    data_to_insert = {
+        "username": username,
+        "hash": image_hash,
+        "perceptual_hash": phash,
+        "sentiment": sentiment,
+        "score": score,
+        "blockchain_stored": reservation is None
+    }
+    # A local SQLite insert and a queue put; cheap, but still blocking I/O.
+    job_id = await run_cpu(
+        lambda: async_upload_stego_and_insert(
+            output_path, data_to_insert, skip_blockchain=reservation is None, slot=slot, image_bytes=stego_bytes,
+            reservation=reservation
+        )
+    )
+    return JSONResponse({
+        "status": "ok",
+        "message": "Message embedded and uploaded successfully!",
+        "upload_job_id": job_id,
+        "saved_path": output_path if STEGO_LOCAL_RETENTION == "keep" else None,
+        "sha256": image_hash,
+        "perceptual_hash": phash,
+        "sentiment": sentiment,
+        "score": score,
+        "blockchain_tx": tx_result["txHash"],
+        "blockchain_batched": tx_result.get("batched", False),
+        "blockchain_pending": reservation is not None,
+        "precheck_reused": reused is not None
+    })
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@observed
+async def get_comments(request):
+    supabase = await get_async_supabase()
+    if supabase is None:
+        return JSONResponse({"error": "Supabase client not configured"}, 500)
+
+    post_id = request.query_params.get("post_id")
+    if post_id is None:
+        return JSONResponse({"error": "post_id query parameter required"}, 400)
+    try:
+        pid_val = int(post_id)
+    except ValueError:
+        pid_val = post_id
+
+    async def load_comments():
+        resp = await supabase.table("comments").select("*").eq("post_id", pid_val).order("created_at").execute()
+        data, error = _extract_supabase_result(resp)
+        if error:
+            raise SupabaseError(error)
+        return data or []
+
+    try:
+        comments, etag = await get_comment_cache().aget(pid_val, load_comments)
+    except SupabaseError as e:
+        return JSONResponse({"error": e.error}, 500)
+    except Exception as e:
+        log.exception("comments select failed: %s", e)
+        return JSONResponse({"error": "Supabase select failed", "detail": str(e)}, 500)
+
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"comments": comments}, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+@observed
+async def add_comment(request):
+    username = jwt_identity(request)
+    supabase = await get_async_supabase()
+    if supabase is None:
+        return JSONResponse({"error": "Supabase client not configured"}, 500)
+
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = {}
+    payload = payload if isinstance(payload, dict) else {}
+    post_id, text = payload.get("post_id"), payload.get("text")
+    if post_id is None or text is None:
+        return JSONResponse({"error": "post_id and text are required"}, 400)
+    try:
+        post_id_val = int(post_id)
+    except (TypeError, ValueError):
+        post_id_val = post_id
+
+    row = {
+        "post_id": post_id_val,
+        "username": username or payload.get("username") or "Anonymous",
+        "image_url": payload.get("image_url"),
+        "text": text
+    }
+    if payload.get("avatar_url"):
+        row["avatar_url"] = payload["avatar_url"]
+
+    try:
+        resp = await supabase.table("comments").insert(row).execute()
+    except Exception as e:
+        log.exception("comments insert failed: %s", e)
+        return JSONResponse({"error": "Supabase insert failed", "detail": str(e)}, 500)
+
+    data, error = _extract_supabase_result(resp)
+    if error:
+        return JSONResponse({"error": error}, 500)
+    get_comment_cache().invalidate(post_id_val)
+    created = data[0] if isinstance(data, list) and data else data
+    return JSONResponse({"status": "ok", "comment": created})
+
+
+@observed
+async def get_feed(request):
+    jwt_identity(request)
+    supabase = await get_async_supabase()
+    if supabase is None:
+        return JSONResponse({"error": "Supabase not configured"}, 500)
+
+    try:
+        limit, cursor, columns = parse_page_args(request.query_params)
+        per_post = int(request.query_params.get("comments", FEED_COMMENTS_DEFAULT))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    per_post = max(0, min(per_post, FEED_COMMENTS_MAX))
+
+    try:
+        posts, next_cursor = await afetch_page(supabase, "stego_uploads", columns, limit, cursor)
+        await aattach_comments(supabase, posts, per_post)
+        add_preview_urls(posts)
+    except Exception as e:
+        log.exception("feed fetch failed: %s", e)
+        return JSONResponse({"error": "Supabase fetch failed", "detail": str(e)}, 500)
+
+    return JSONResponse({"posts": posts, "next_cursor": next_cursor})
+
+
+async def _comments(request):
+    return await (add_comment if request.method == "POST" else get_comments)(request)
+
+
+app = Starlette(
+    routes=[
+        Route("/check-duplicate", check_duplicate, methods=["POST"]),
+        Route("/upload", upload, methods=["POST"]),
+        Route("/comments", _comments, methods=["GET", "POST"]),
+        Route("/feed", get_feed, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+)
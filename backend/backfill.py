@@ -0,0 +1,564 @@
+"""
+Bulk import of an existing image archive.
+
+Registers every image under a directory the way /upload would, minus the
+embedded message, without one HTTP request and one blocking transaction per
+image:
+
+  1. hash      SHA-256 and pHash for every file, in a process pool
+  2. dedupe    one vectorized pass against the registry (chain, Merkle leaves
+               and reservations) and the archive's own earlier images
+  3. chain     storeImageHash transactions sent back to back with consecutive
+               nonces, receipts collected per window; with ANCHOR_MODE=batch
+               the leaves go to the batch anchorer instead
+  4. publish   storage uploads on a thread pool, rows inserted in bulk
+
+Transactions are sent from BACKFILL_CHAIN_PRIVATE_KEY, a different account
+from the server's, so the two never compete for nonces; the images are still
+recorded with the server's account as uploader. Without it the run refuses to
+start unless --server-account confirms the app is not serving uploads. With
+ANCHOR_MODE=batch the contract only accepts roots from its owner and approved
+anchorers, so the contract owner must first call setAnchorer(<that account>, true).
+
+Every step is checkpointed per file in BACKFILL_DB, so an interrupted run
+picks up where it stopped when started again with the same arguments. A
+transaction's hash is recorded before it is sent; on resume its receipt
+decides whether the image is registered or goes back in line.
+
+    python backfill.py /data/archive --username archive
+    python backfill.py /data/archive --username archive --dry-run   # steps 1-2 only
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from logs import get_logger
+
+log = get_logger("backfill")
+
+BACKFILL_DB = os.getenv("BACKFILL_DB", "backfill.db")
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(os.cpu_count() or 4)))
+BACKFILL_CHAIN_WINDOW = int(os.getenv("BACKFILL_CHAIN_WINDOW", "64"))
+BACKFILL_IO_WORKERS = int(os.getenv("BACKFILL_IO_WORKERS", "8"))
+BACKFILL_INSERT_BATCH = int(os.getenv("BACKFILL_INSERT_BATCH", "500"))
+PROGRESS_INTERVAL = float(os.getenv("BACKFILL_PROGRESS_INTERVAL", "2"))
+STORE_GAS = 3000000  # same limit as blockchain.store_image_on_chain
+BACKFILL_CHAIN_PRIVATE_KEY = os.getenv("BACKFILL_CHAIN_PRIVATE_KEY")
+# Hashes per "already inserted?" lookup; they travel in the query string
+EXISTS_QUERY_CHUNK = 100
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+# pending -> hashed -> unique -> [sent ->] registered -> uploaded -> done
+#                   -> duplicate                   failed (any step)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backfill_files (
+    path          TEXT PRIMARY KEY,
+    status        TEXT NOT NULL,
+    sha256        TEXT,
+    phash         TEXT,
+    duplicate_of  TEXT,
+    distance      INTEGER,
+    tx_hash       TEXT,
+    leaf_id       INTEGER,
+    file_url      TEXT,
+    previews      INTEGER NOT NULL DEFAULT 0,
+    error         TEXT,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_backfill_files_status ON backfill_files (status, path);
+"""
+
+
+class Checkpoint:
+    """Per-file progress of a backfill, in SQLite."""
+
+    def __init__(self, path: str = BACKFILL_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(backfill_files)")}
+        if "previews" not in columns:
+            # Checkpoints written before previews were tracked
+            self._conn.execute("ALTER TABLE backfill_files ADD COLUMN previews INTEGER NOT NULL DEFAULT 0")
+
+    def add_paths(self, paths) -> int:
+        """Record files not seen before as pending; returns how many were new."""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO backfill_files (path, status, updated_at) VALUES (?, 'pending', ?)",
+                ((p, now) for p in paths)
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def rows(self, *statuses) -> list:
+        marks = ", ".join("?" for _ in statuses)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT * FROM backfill_files WHERE status IN ({marks}) ORDER BY path", statuses
+            ).fetchall()
+
+    def update(self, path: str, **fields):
+        self.update_many([(path, fields)])
+
+    def update_many(self, changes):
+        """Apply [(path, {column: value})] in one transaction."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for path, fields in changes:
+                    columns = ", ".join(f"{k} = ?" for k in fields)
+                    self._conn.execute(
+                        f"UPDATE backfill_files SET {columns}, updated_at = ? WHERE path = ?",
+                        (*fields.values(), now, path)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def retry_failed(self) -> int:
+        """Send failed files back to the step they failed in."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE backfill_files SET error = NULL, status = CASE "
+                "WHEN file_url IS NOT NULL THEN 'uploaded' "
+                "WHEN tx_hash IS NOT NULL OR leaf_id IS NOT NULL THEN 'registered' "
+                "WHEN phash IS NOT NULL THEN 'unique' "
+                "ELSE 'pending' END WHERE status = 'failed'"
+            )
+            return cur.rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM backfill_files GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Progress:
+    """Throttled "done/total, images/sec, eta" lines on stderr."""
+
+    def __init__(self, step: str, total: int):
+        self.step = step
+        self.total = total
+        self.done = 0
+        self.start = self._last = time.perf_counter()
+
+    def tick(self, n: int = 1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self._print(now)
+
+    def finish(self):
+        self._print(time.perf_counter(), final=True)
+
+    def _print(self, now, final=False):
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        line = f"[{self.step:8s}] {self.done}/{self.total}  {rate:8.1f} images/s"
+        if final:
+            line += f"  in {elapsed:.1f}s"
+        elif rate > 0 and self.total > self.done:
+            line += f"  eta {(self.total - self.done) / rate:.0f}s"
+        print(line, file=sys.stderr, flush=True)
+
+
+# Bits set in every byte value, for popcount over uint64 pHashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class PhashIndex:
+    """
+    64-bit pHashes packed in a uint64 array. nearest() is one XOR and
+    popcount over the whole array, which keeps deduplicating an archive of
+    N images against M registered ones at N vectorized passes instead of
+    N * M hamming_distance() calls.
+    """
+
+    def __init__(self):
+        self._values = np.empty(1024, dtype=np.uint64)
+        self._refs = []
+
+    def __len__(self):
+        return len(self._refs)
+
+    def add(self, phash: str, ref: str):
+        # hamming_distance() never matches hashes of another length either
+        if not phash or len(phash) != 16:
+            return
+        n = len(self._refs)
+        if n == len(self._values):
+            self._values = np.resize(self._values, n * 2)
+        self._values[n] = int(phash, 16)
+        self._refs.append(ref)
+
+    def nearest(self, phash: str):
+        """(distance, ref) of the closest stored pHash, or (None, None)."""
+        if not self._refs or not phash or len(phash) != 16:
+            return None, None
+        xor = self._values[:len(self._refs)] ^ np.uint64(int(phash, 16))
+        distances = _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        best = int(distances.argmin())
+        return int(distances[best]), self._refs[best]
+
+
+def _hash_file(path: str):
+    """Process-pool worker: (path, sha256, phash, error)."""
+    from stego_utils import get_perceptual_hash
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        return path, hashlib.sha256(data).hexdigest(), get_perceptual_hash(data), None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+
+
+def discover(root: str) -> list:
+    found = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if name.lower().endswith(EXTENSIONS):
+                found.append(os.path.abspath(os.path.join(dirpath, name)))
+    return sorted(found)
+
+
+def hash_files(checkpoint: Checkpoint, workers: int):
+    rows = checkpoint.rows("pending")
+    if not rows:
+        return
+    progress = Progress("hash", len(rows))
+    changes = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_hash_file, [r["path"] for r in rows], chunksize=16)
+        for path, sha256, phash, error in results:
+            if error:
+                changes.append((path, {"status": "failed", "error": error}))
+            else:
+                changes.append((path, {"status": "hashed", "sha256": sha256, "phash": phash}))
+            if len(changes) >= 256:
+                checkpoint.update_many(changes)
+                changes = []
+            progress.tick()
+    checkpoint.update_many(changes)
+    progress.finish()
+
+
+def registry_index(rpc_workers: int) -> PhashIndex:
+    """Every pHash the duplicate check would compare against."""
+    import anchoring
+    import blockchain
+    import reservations
+
+    index = PhashIndex()
+    if not blockchain.health_check():
+        raise Exception("Blockchain not connected or contract not deployed")
+    contract = blockchain.get_contract()
+    total = contract.functions.getImageCount().call()
+    progress = Progress("registry", total)
+    with ThreadPoolExecutor(max_workers=rpc_workers) as pool:
+        phashes = pool.map(lambda i: contract.functions.getPerceptualHash(i).call(), range(total))
+        for i, phash in enumerate(phashes):
+            index.add(phash, f"chain:{i}")
+            progress.tick()
+    progress.finish()
+
+    if anchoring.has_local_leaves():
+        for row in anchoring.get_leaf_store().phashes():
+            index.add(row["phash"], f"leaf:{row['id']}")
+    if os.path.exists(reservations.RESERVATION_DB):
+        for row in reservations.get_reservations().phashes():
+            index.add(row["phash"], f"reservation:{row['id']}")
+    return index
+
+
+def dedupe(checkpoint: Checkpoint, registry: PhashIndex, threshold: int):
+    """
+    Mark each hashed file unique or duplicate. Files are taken in path
+    order, so of two similar archive images the first one is kept.
+    """
+    rows = checkpoint.rows("hashed")
+    if not rows:
+        return
+    archive = PhashIndex()
+    for row in checkpoint.rows("unique", "sent", "registered", "uploaded", "done", "failed"):
+        archive.add(row["phash"], row["path"])
+
+    progress = Progress("dedupe", len(rows))
+    changes = []
+    for row in rows:
+        match = None
+        for index in (registry, archive):
+            distance, ref = index.nearest(row["phash"])
+            if distance is not None and distance <= threshold and (match is None or distance < match[0]):
+                match = (distance, ref)
+        if match:
+            changes.append((row["path"], {"status": "duplicate", "duplicate_of": match[1], "distance": match[0]}))
+        else:
+            changes.append((row["path"], {"status": "unique"}))
+            archive.add(row["phash"], row["path"])
+        progress.tick()
+    checkpoint.update_many(changes)
+    progress.finish()
+
+
+def _settle_sent(checkpoint: Checkpoint):
+    """Resolve transactions a previous run sent but never saw mined."""
+    import blockchain
+    from web3.exceptions import TransactionNotFound
+
+    w3 = blockchain.get_w3()
+    for row in checkpoint.rows("sent"):
+        try:
+            w3.eth.get_transaction(row["tx_hash"])
+        except TransactionNotFound:
+            # Dropped, or the run stopped before sending it: send it again
+            log.warning("transaction %s unknown, resending", row["tx_hash"], extra={"path": row["path"]})
+            checkpoint.update(row["path"], status="unique", tx_hash=None)
+            continue
+        except Exception as e:
+            # It may still be mined; keep the row sent and check again next run
+            log.warning("could not check transaction %s: %s", row["tx_hash"], e, extra={"path": row["path"]})
+            continue
+        receipt = w3.eth.wait_for_transaction_receipt(row["tx_hash"], timeout=blockchain.RECEIPT_TIMEOUT)
+        _record_receipt(checkpoint, row["path"], receipt)
+
+
+def _record_receipt(checkpoint: Checkpoint, path: str, receipt):
+    if receipt.status == 1:
+        checkpoint.update(path, status="registered")
+    else:
+        checkpoint.update(path, status="failed", tx_hash=None,
+                          error=f"storeImageHash reverted (tx {receipt.transactionHash.hex()})")
+
+
+def use_sender(private_key: str) -> str:
+    """Send this process's transactions from `private_key`; returns the server's account, the uploader."""
+    import blockchain
+    from eth_account import Account
+
+    uploader = blockchain.ACCOUNT_ADDRESS
+    blockchain.ACCOUNT_ADDRESS = Account.from_key(private_key).address
+    blockchain.PRIVATE_KEY = private_key
+    return uploader
+
+
+def register_on_chain(checkpoint: Checkpoint, window: int, uploader: str):
+    """storeImageHash for every unique file, `window` transactions in flight at a time."""
+    import blockchain
+
+    _settle_sent(checkpoint)
+    rows = checkpoint.rows("unique")
+    if not rows:
+        return
+    w3 = blockchain.get_w3()
+    contract = blockchain.get_contract()
+    progress = Progress("chain", len(rows))
+    for start in range(0, len(rows), window):
+        nonce = w3.eth.get_transaction_count(blockchain.ACCOUNT_ADDRESS, "pending")
+        gas_price = w3.eth.gas_price
+        sent = []
+        try:
+            for row in rows[start:start + window]:
+                tx = contract.functions.storeImageHash(
+                    row["sha256"], row["phash"], uploader
+                ).build_transaction({
+                    "from": blockchain.ACCOUNT_ADDRESS,
+                    "nonce": nonce,
+                    "gas": STORE_GAS,
+                    "gasPrice": gas_price
+                })
+                signed = w3.eth.account.sign_transaction(tx, blockchain.PRIVATE_KEY)
+                # Recorded first, so a crash between here and the receipt is settled on resume
+                checkpoint.update(row["path"], status="sent", tx_hash=signed.hash.hex())
+                try:
+                    w3.eth.send_raw_transaction(signed.raw_transaction)
+                except Exception:
+                    checkpoint.update(row["path"], status="unique", tx_hash=None)
+                    raise
+                sent.append((row["path"], signed.hash))
+                nonce += 1
+        finally:
+            # Whatever went out is awaited even when a send failed
+            for path, tx_hash in sent:
+                receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=blockchain.RECEIPT_TIMEOUT)
+                _record_receipt(checkpoint, path, receipt)
+                progress.tick()
+    progress.finish()
+
+
+def register_batched(checkpoint: Checkpoint, uploader: str):
+    """Queue every unique file as a Merkle leaf (ANCHOR_MODE=batch)."""
+    import anchoring
+
+    rows = checkpoint.rows("unique")
+    if not rows:
+        return
+    store = anchoring.get_leaf_store()
+    anchorer = anchoring.get_anchorer()
+    progress = Progress("chain", len(rows))
+    try:
+        for row in rows:
+            # A leaf added just before an interrupted run stopped is not added twice
+            existing = store.lookup(row["sha256"])
+            leaf_id = existing["id"] if existing else anchorer.submit(row["sha256"], row["phash"], uploader)["leafId"]
+            checkpoint.update(row["path"], status="registered", leaf_id=leaf_id)
+            progress.tick()
+    finally:
+        anchorer.close()
+    progress.finish()
+    pending = store.pending_count()
+    if pending:
+        log.warning("%d leaf/leaves not anchored yet; the next batch anchorer run retries them", pending)
+
+
+def _upload(row):
+    from stego_utils import upload_stego_to_supabase
+    ext = os.path.splitext(row["path"])[1].lower()
+    content_type = mimetypes.guess_type(row["path"])[0] or "application/octet-stream"
+    return upload_stego_to_supabase(row["path"], "image", f"{row['sha256']}{ext}", content_type=content_type)
+
+
+def publish(checkpoint: Checkpoint, username: str, io_workers: int, insert_batch: int, previews: bool):
+    """Storage upload (and previews) for registered files, then their rows in bulk."""
+    from derivatives import ensure_previews
+    from stego_utils import existing_stego_hashes, insert_stego_records
+
+    rows = checkpoint.rows("registered")
+    if rows:
+        progress = Progress("upload", len(rows))
+
+        def upload_one(row):
+            try:
+                url = _upload(row)
+            except Exception as e:
+                return row["path"], {"status": "failed", "error": f"storage upload: {e}"}
+            rendered = False
+            if previews:
+                try:
+                    ensure_previews(row["sha256"], row["path"])
+                    rendered = True
+                except Exception as e:
+                    log.warning("preview generation failed: %s", e, extra={"path": row["path"]})
+            return row["path"], {"status": "uploaded", "file_url": url, "previews": int(rendered)}
+
+        with ThreadPoolExecutor(max_workers=io_workers) as pool:
+            changes = []
+            for change in pool.map(upload_one, rows):
+                changes.append(change)
+                if len(changes) >= 64:
+                    checkpoint.update_many(changes)
+                    changes = []
+                progress.tick()
+            checkpoint.update_many(changes)
+        progress.finish()
+
+    rows = checkpoint.rows("uploaded")
+    if not rows:
+        return
+    progress = Progress("insert", len(rows))
+    for start in range(0, len(rows), insert_batch):
+        chunk = rows[start:start + insert_batch]
+        try:
+            # Rows a previous run inserted before it could checkpoint them
+            present = set()
+            for n in range(0, len(chunk), EXISTS_QUERY_CHUNK):
+                present |= existing_stego_hashes([r["sha256"] for r in chunk[n:n + EXISTS_QUERY_CHUNK]])
+            records = [
+                {"username": username, "file_url": r["file_url"], "hash": r["sha256"], "sentiment": None,
+                 "score": None, "previews": bool(r["previews"])}
+                for r in chunk if r["sha256"] not in present
+            ]
+            if records:
+                insert_stego_records(records)
+        except Exception as e:
+            log.error("bulk insert failed: %s", e)
+            checkpoint.update_many([(r["path"], {"status": "failed", "error": f"insert: {e}"}) for r in chunk])
+        else:
+            checkpoint.update_many([(r["path"], {"status": "done"}) for r in chunk])
+        progress.tick(len(chunk))
+    progress.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register an existing image archive in bulk.")
+    parser.add_argument("root", help="directory to import (walked recursively)")
+    parser.add_argument("--username", required=True, help="owner of the inserted records")
+    parser.add_argument("--db", default=BACKFILL_DB, help="checkpoint file; reuse it to resume")
+    parser.add_argument("--threshold", type=int, default=10, help="pHash distance counted as a duplicate")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="hashing processes")
+    parser.add_argument("--rpc-workers", type=int, default=8, help="threads reading the registry")
+    parser.add_argument("--chain-window", type=int, default=BACKFILL_CHAIN_WINDOW,
+                        help="transactions in flight before waiting for receipts")
+    parser.add_argument("--io-workers", type=int, default=BACKFILL_IO_WORKERS, help="storage upload threads")
+    parser.add_argument("--insert-batch", type=int, default=BACKFILL_INSERT_BATCH, help="rows per insert")
+    parser.add_argument("--no-previews", action="store_true", help="skip display previews")
+    parser.add_argument("--retry-failed", action="store_true", help="retry files that failed in a previous run")
+    parser.add_argument("--dry-run", action="store_true", help="hash and deduplicate only")
+    parser.add_argument("--server-account", action="store_true",
+                        help="send from the server's account (only while the app is not serving uploads)")
+    args = parser.parse_args()
+    if not (args.dry_run or BACKFILL_CHAIN_PRIVATE_KEY or args.server_account):
+        sys.exit("set BACKFILL_CHAIN_PRIVATE_KEY to a funded account other than the server's, or stop the "
+                 "app and pass --server-account; sharing its account while it serves uploads reuses nonces")
+
+    checkpoint = Checkpoint(args.db)
+    started = time.perf_counter()
+    try:
+        if args.retry_failed:
+            print(f"retrying {checkpoint.retry_failed()} failed file(s)", file=sys.stderr)
+        paths = discover(args.root)
+        print(f"{len(paths)} image(s) under {args.root}, {checkpoint.add_paths(paths)} new", file=sys.stderr)
+
+        hash_files(checkpoint, args.workers)
+        if checkpoint.rows("hashed"):
+            dedupe(checkpoint, registry_index(args.rpc_workers), args.threshold)
+        if not args.dry_run:
+            import anchoring
+            import blockchain
+            uploader = use_sender(BACKFILL_CHAIN_PRIVATE_KEY) if BACKFILL_CHAIN_PRIVATE_KEY \
+                else blockchain.ACCOUNT_ADDRESS
+            if anchoring.batching():
+                register_batched(checkpoint, uploader)
+            else:
+                register_on_chain(checkpoint, args.chain_window, uploader)
+            publish(checkpoint, args.username, args.io_workers, args.insert_batch, not args.no_previews)
+
+        counts = checkpoint.counts()
+        total = sum(counts.values())
+        elapsed = time.perf_counter() - started
+        print("  ".join(f"{status}={count}" for status, count in sorted(counts.items())), file=sys.stderr)
+        print(f"{total} image(s) in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} images/s overall)",
+              file=sys.stderr)
+        if counts.get("failed"):
+            sys.exit(f"{counts['failed']} file(s) failed; see the error column in {args.db}, "
+                     "then rerun with --retry-failed")
+    finally:
+        checkpoint.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Login throughput, and what a login storm does to other routes.
+
+Each configuration runs in a fresh interpreter with its own SQLite user
+table and a threaded werkzeug server. It first measures /health latency at
+rest, then again while --concurrency clients log in back to back for
+--seconds. Reports logins/sec, login latency, /health latency idle vs under
+load, and how many logins were shed with 503.
+
+    python -m benchmarks.auth_load --concurrency 32 --seconds 10
+    python -m benchmarks.auth_load --rounds 10,12 --workers 0,2,4
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _pcts(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        "p50_ms": round(statistics.median(samples), 1),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+    }
+
+
+def _probe(session, url, stop, samples, interval=0.02):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        session.get(url, timeout=30)
+        samples.append((time.perf_counter() - t0) * 1000)
+        time.sleep(interval)
+
+
+def child(args):
+    import requests
+    from werkzeug.serving import make_server
+
+    workdir = tempfile.mkdtemp(prefix="auth_load_")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'users.db')}",
+        "UPLOAD_JOB_DB": os.path.join(workdir, "upload_jobs.db"),
+        "UPLOAD_RESUME_ON_START": "0",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    import app as app_module
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    users = [f"user{n}" for n in range(args.users)]
+    with requests.Session() as s:
+        for name in users:
+            s.post(f"{base}/auth/register", json={
+                "email": f"{name}@example.com", "username": name, "password": "correct horse"
+            })
+
+    idle = []
+    stop = threading.Event()
+    timer = threading.Timer(2.0, stop.set)
+    timer.start()
+    _probe(requests.Session(), f"{base}/health", stop, idle)
+
+    logins, statuses, lock = [], {}, threading.Lock()
+    stop = threading.Event()
+
+    def storm(n):
+        session = requests.Session()
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            resp = session.post(f"{base}/auth/login", json={
+                "username": users[n % len(users)], "password": "correct horse"
+            }, timeout=60)
+            with lock:
+                logins.append((time.perf_counter() - t0) * 1000)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+            n += 1
+
+    threads = [threading.Thread(target=storm, args=(n,)) for n in range(args.concurrency)]
+    loaded = []
+    probe = threading.Thread(target=_probe, args=(requests.Session(), f"{base}/health", stop, loaded))
+    start = time.perf_counter()
+    for t in threads + [probe]:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads + [probe]:
+        t.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print(json.dumps({
+        "logins_per_sec": round(statuses.get(200, 0) / elapsed, 1),
+        "status": statuses,
+        "login": _pcts(logins),
+        "health_idle": _pcts(idle),
+        "health_under_load": _pcts(loaded),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", default="12", help="comma-separated bcrypt work factors")
+    parser.add_argument("--workers", default="0,2", help="comma-separated AUTH_HASH_WORKERS (0 = inline)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    for rounds in args.rounds.split(","):
+        for workers in args.workers.split(","):
+            env = dict(os.environ, BCRYPT_LOG_ROUNDS=rounds, AUTH_HASH_WORKERS=workers)
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.auth_load", "--child",
+                 "--concurrency", str(args.concurrency), "--seconds", str(args.seconds),
+                 "--users", str(args.users)],
+                cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                result = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"}
+            else:
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"rounds={rounds:>2} workers={workers:>2}  {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+End-to-end load test for /check-duplicate and /upload.
+
+Everything runs locally:
+  - an EVM: in-process eth-tester (default) or any JSON-RPC node such as
+    anvil/Ganache (--evm rpc --rpc-url ... --private-key ...), with
+    contracts/ImageRegistry.sol compiled (py-solc-x) and deployed fresh;
+  - a Supabase stand-in (SQLite tables + in-memory storage) registered in
+    the service registry in place of the real client;
+  - the real Flask app, served by a threaded werkzeug server.
+
+Reports throughput and p50/p95/p99 per endpoint, and how /check-duplicate
+latency scales as the on-chain registry grows.
+
+    pip install "web3[tester]" py-solc-x
+    python -m benchmarks.e2e_upload --concurrency 8 --requests 100 --registry-sizes 0,100,500
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTRACT_SOURCE = os.path.join(BACKEND_DIR, "contracts", "ImageRegistry.sol")
+SOLC_VERSION = "0.8.19"
+
+SCHEMA = """
+CREATE TABLE stego_uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, file_url TEXT, hash TEXT,
+    sentiment TEXT, score TEXT, previews INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE INDEX idx_stego_uploads_feed ON stego_uploads (created_at DESC, id DESC);
+CREATE INDEX idx_stego_uploads_hash ON stego_uploads (hash);
+CREATE TABLE comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER, username TEXT, avatar_url TEXT,
+    image_url TEXT, text TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+)
+"""
+
+
+def compile_registry():
+    """Compile the registry contract; returns (abi, bytecode)."""
+    import solcx
+
+    if SOLC_VERSION not in [str(v) for v in solcx.get_installed_solc_versions()]:
+        solcx.install_solc(SOLC_VERSION)
+    with open(CONTRACT_SOURCE) as f:
+        compiled = solcx.compile_source(f.read(), output_values=["abi", "bin"], solc_version=SOLC_VERSION)
+    _, artifact = compiled.popitem()
+    return artifact["abi"], artifact["bin"]
+
+
+def start_evm(args):
+    """Return (w3, account_address, private_key) for a fresh local chain."""
+    from web3 import Web3
+
+    if args.evm == "eth-tester":
+        from web3 import EthereumTesterProvider
+
+        class LockedTesterProvider(EthereumTesterProvider):
+            # py-evm is not thread-safe; serialize calls from request threads
+            _lock = threading.Lock()
+
+            def make_request(self, method, params):
+                with self._lock:
+                    return super().make_request(method, params)
+
+        provider = LockedTesterProvider()
+        w3 = Web3(provider)
+        key = provider.ethereum_tester.backend.account_keys[0]
+        return w3, w3.eth.accounts[0], key.to_hex()
+
+    w3 = Web3(Web3.HTTPProvider(args.rpc_url))
+    account = w3.eth.account.from_key(args.private_key).address
+    return w3, account, args.private_key
+
+
+def deploy_registry(w3, account, private_key):
+    abi, bytecode = compile_registry()
+    factory = w3.eth.contract(abi=abi, bytecode=bytecode)
+    tx = factory.constructor().build_transaction({
+        "from": account,
+        "nonce": w3.eth.get_transaction_count(account),
+        "gasPrice": w3.eth.gas_price,
+    })
+    signed = w3.eth.account.sign_transaction(tx, private_key)
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_raw_transaction(signed.raw_transaction))
+    return receipt.contractAddress
+
+
+def seed_registry(target_size):
+    """Store random pHashes on chain until the registry holds target_size images."""
+    import blockchain
+
+    current = blockchain.get_total_images()
+    for _ in range(max(0, target_size - current)):
+        blockchain.store_image_on_chain(f"{random.getrandbits(256):064x}", f"{random.getrandbits(64):016x}")
+
+
+def make_png(size: int, seed: int) -> bytes:
+    """Synthetic photo-like PNG: smooth random gradients plus noise, unique per seed."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    channels = []
+    for _ in range(3):
+        a, b, c = rng.uniform(-4, 4, 3)
+        channels.append(127 + 100 * np.sin(a * x + b * y + c) + rng.normal(0, 8, (size, size)))
+    pixels = np.clip(np.dstack(channels), 0, 255).astype("uint8")
+    buf = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 1)
+
+    return {"p50_ms": round(statistics.median(samples), 1), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+
+def drive(url, token, images, concurrency, form=None):
+    """POST each image to url at the given concurrency; returns a result summary."""
+    import requests
+
+    session = requests.Session()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def one(item):
+        n, png = item
+        t0 = time.perf_counter()
+        resp = session.post(url, headers=headers, data=form,
+                            files={"image": (f"img_{n}.png", png, "image/png")}, timeout=300)
+        return (time.perf_counter() - t0) * 1000, resp.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, enumerate(images)))
+    elapsed = time.perf_counter() - start
+    summary = {"req_per_sec": round(len(results) / elapsed, 2), "status": dict(Counter(c for _, c in results))}
+    summary.update(percentiles([ms for ms, _ in results]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--evm", choices=("eth-tester", "rpc"), default="eth-tester")
+    parser.add_argument("--rpc-url", default="http://127.0.0.1:8545")
+    parser.add_argument("--private-key", default=None, help="funded key for --evm rpc")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per phase")
+    parser.add_argument("--registry-sizes", default="0,100,500")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.evm == "rpc" and not args.private_key:
+        parser.error("--private-key is required with --evm rpc")
+
+    workdir = tempfile.mkdtemp(prefix="e2e_upload_")
+    os.environ.update({
+        "SUPABASE_URL": "http://localhost",
+        "SUPABASE_KEY": "stand-in",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'users.db')}",
+        "UPLOAD_JOB_DB": os.path.join(workdir, "upload_jobs.db"),
+        "UPLOAD_RESUME_ON_START": "0",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+    import blockchain
+    import services
+    from benchmarks.postgrest_standin import StandInClient
+
+    w3, account, private_key = start_evm(args)
+    blockchain.ACCOUNT_ADDRESS = account
+    blockchain.PRIVATE_KEY = private_key
+    blockchain.CONTRACT_ADDRESS = deploy_registry(w3, account, private_key)
+    if args.evm == "eth-tester":
+        services.register("web3", lambda: w3)
+    else:
+        blockchain.GANACHE_RPC = args.rpc_url
+        services.reset("web3")
+    services.reset("contract")
+    print(f"Registry deployed at {blockchain.CONTRACT_ADDRESS} ({args.evm})")
+
+    standin = StandInClient(json_columns={"stego_uploads": ("score",)})
+    standin.executescript(SCHEMA)
+    services.register("supabase", lambda: standin)
+
+    from flask_jwt_extended import create_access_token
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    with app_module.app.app_context():
+        token = create_access_token(identity="bench")
+
+    def image_set(offset):
+        unique = [make_png(args.image_size, offset + n) for n in range(args.requests)]
+        return [random.choice(unique[:max(1, n)]) if random.random() < args.duplicate_ratio else png
+                for n, png in enumerate(unique)]
+
+    print("\n/check-duplicate vs registry size:")
+    for size in (int(s) for s in args.registry_sizes.split(",")):
+        seed_registry(size)
+        result = drive(f"{base}/check-duplicate", token, image_set(size * 1000), args.concurrency)
+        print(f"  registry={blockchain.get_total_images():>6}  {result}")
+
+    print("\n/upload:")
+    result = drive(f"{base}/upload", token, image_set(10**7), args.concurrency,
+                   form={"message": "have a wonderful day"})
+    print(f"  registry={blockchain.get_total_images():>6}  {result}")
+
+    from uploadFile import get_upload_executor
+    executor = get_upload_executor()
+    executor.join()
+    print(f"  background jobs: {executor.store.counts()}  stored objects: "
+          f"{len(standin.storage.objects)} ({standin.storage.total_bytes() / 2**20:.1f} MB)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cold-start cost of loading the emoji scores.
+
+Each loader runs in a fresh interpreter so import time and RSS are measured
+the way a new worker pays them.
+
+    python emoji_lexicon.py                      # build Datasets/Emoji_lexicon.json
+    python -m benchmarks.emoji_lexicon_load
+"""
+import json
+import subprocess
+import sys
+
+LOADERS = {
+    # Previous startup path: pandas import + read_csv.
+    "pandas_csv": (
+        "import pandas as pd\n"
+        "df = pd.read_csv(EMOJI_CSV_PATH)\n"
+        "df['Score'] = df['Positive'] - df['Negative']\n"
+        "scores = dict(zip(df['Emoji'], df['Score']))\n"
+    ),
+    "stdlib_csv": "scores = _read_csv_scores(EMOJI_CSV_PATH)\n",
+    "json_lexicon": "scores = load_emoji_scores()\n",
+}
+
+_HARNESS = """
+import json, resource, time
+t0 = time.perf_counter()
+from emoji_lexicon import EMOJI_CSV_PATH, _read_csv_scores, load_emoji_scores
+{body}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{
+    "entries": len(scores),
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}}))
+"""
+
+
+def run_loader(body: str, repeat: int = 5):
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", _HARNESS.format(body=body)],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"}
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    runs.sort(key=lambda r: r["seconds"])
+    best = runs[0]
+    return {
+        "entries": best["entries"],
+        "best_ms": round(best["seconds"] * 1000, 2),
+        "median_ms": round(runs[len(runs) // 2]["seconds"] * 1000, 2),
+        "max_rss_mb": round(max(r["max_rss_kb"] for r in runs) / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    for name, body in LOADERS.items():
+        print(f"{name:14s} {run_loader(body)}")
@@ -0,0 +1,108 @@
+"""
+Feed listing cost: legacy select("*") of every row vs keyset pages.
+
+Seeds stego_uploads in a local stand-in (SQLite in memory, or Postgres via
+--dsn) and reports JSON payload size and p50/p95 latency for the full
+listing, the first keyset page and a page deep in the feed.
+
+    python -m benchmarks.feed_pagination [--rows 10000,100000] [--dsn postgresql://...]
+"""
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+
+from benchmarks.postgrest_standin import StandInClient
+from pagination import FEED_COLUMNS, decode_cursor, encode_cursor, fetch_page
+
+SCHEMA = {
+    "sqlite": """
+        DROP TABLE IF EXISTS stego_uploads;
+        CREATE TABLE stego_uploads (
+            id INTEGER PRIMARY KEY, username TEXT, file_url TEXT, hash TEXT,
+            sentiment TEXT, score TEXT, previews INTEGER DEFAULT 0, created_at TEXT
+        );
+        CREATE INDEX idx_stego_uploads_feed ON stego_uploads (created_at DESC, id DESC)
+    """,
+    "postgres": """
+        DROP TABLE IF EXISTS stego_uploads;
+        CREATE TABLE stego_uploads (
+            id BIGINT PRIMARY KEY, username TEXT, file_url TEXT, hash TEXT,
+            sentiment TEXT, score JSONB, previews BOOLEAN DEFAULT false, created_at TIMESTAMPTZ
+        );
+        CREATE INDEX idx_stego_uploads_feed ON stego_uploads (created_at DESC, id DESC)
+    """,
+}
+
+
+def seed(client, rows):
+    client.executescript(SCHEMA[client.dialect])
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    batch = []
+    for n in range(1, rows + 1):
+        batch.append({
+            "id": n,
+            "username": f"user{n % 500}",
+            "file_url": f"https://example.supabase.co/storage/v1/object/public/image/stego_uploads/stego_{n:032x}.png",
+            "hash": f"{random.getrandbits(256):064x}",
+            "sentiment": "positive",
+            "score": {"neg": 0.0, "neu": 0.4, "pos": 0.6, "compound": 0.7},
+            "created_at": (start + datetime.timedelta(seconds=n)).isoformat(),
+        })
+        if len(batch) == 5000:
+            client.table("stego_uploads").insert(batch).execute()
+            batch = []
+    if batch:
+        client.table("stego_uploads").insert(batch).execute()
+
+
+def measure(fn, iterations):
+    samples, size = [], 0
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        data = fn()
+        size = len(json.dumps(data, default=str))
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "payload_kb": round(size / 1024, 1),
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+    }
+
+
+def run(client, rows, page_size, iterations):
+    seed(client, rows)
+
+    def legacy():
+        return client.table("stego_uploads").select("*").order("created_at", desc=True).execute().data
+
+    def first_page():
+        return fetch_page(client, "stego_uploads", FEED_COLUMNS, page_size)[0]
+
+    middle = client.table("stego_uploads").select("id,created_at").eq("id", rows // 2).execute().data[0]
+    middle["created_at"] = str(middle["created_at"])
+    deep_cursor = decode_cursor(encode_cursor(middle))
+
+    def deep_page():
+        return fetch_page(client, "stego_uploads", FEED_COLUMNS, page_size, deep_cursor)[0]
+
+    print(f"{rows} rows:")
+    print("   legacy select * :", measure(legacy, max(3, iterations // 10)))
+    print("   keyset page 1   :", measure(first_page, iterations))
+    print("   keyset deep page:", measure(deep_page, iterations))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="10000,100000")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--dsn", default=None, help="local Postgres DSN (default: SQLite in memory)")
+    args = parser.parse_args()
+
+    for rows in (int(r) for r in args.rows.split(",")):
+        client = StandInClient(args.dsn, json_columns={"stego_uploads": ("score",)})
+        run(client, rows, args.page_size, args.iterations)
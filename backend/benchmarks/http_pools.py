@@ -0,0 +1,94 @@
+"""
+Load test for outbound JSON-RPC connection handling.
+
+Starts a local keep-alive JSON-RPC server (answers eth_blockNumber with a
+configurable delay) and drives it from many threads with:
+  no_keepalive    - a fresh connection per call
+  default_session - one requests.Session with library defaults
+  pooled          - http_pools.create_rpc_session() (bounded keep-alive pool)
+
+Reports throughput, p50/p95/p99 latency and TCP connections accepted.
+
+    python -m benchmarks.http_pools [--threads 32] [--calls 200] [--delay-ms 1]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from http_pools import create_rpc_session
+
+
+class _RPCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.delay)
+        payload = json.dumps({"jsonrpc": "2.0", "id": body.get("id"), "result": "0x10"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class _CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    accepted = 0
+
+    def get_request(self):
+        conn = super().get_request()
+        self.accepted += 1
+        return conn
+
+
+def _call(post, url, n):
+    t0 = time.perf_counter()
+    resp = post(url, json={"jsonrpc": "2.0", "id": n, "method": "eth_blockNumber", "params": []}, timeout=10)
+    resp.raise_for_status()
+    return (time.perf_counter() - t0) * 1000
+
+
+def run(label, post, url, server, threads, calls):
+    server.accepted = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        samples = sorted(pool.map(lambda n: _call(post, url, n), range(threads * calls)))
+    elapsed = time.perf_counter() - start
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+    print(f"{label:16s} {len(samples) / elapsed:8.0f} req/s  p50={statistics.median(samples):.2f}ms "
+          f"p95={pct(0.95)}ms p99={pct(0.99)}ms  connections={server.accepted}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=200, help="calls per thread")
+    parser.add_argument("--delay-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    _RPCHandler.delay = args.delay_ms / 1000
+    server = _CountingServer(("127.0.0.1", 0), _RPCHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def no_keepalive(url, **kwargs):
+        return requests.post(url, headers={"Connection": "close"}, **kwargs)
+
+    run("no_keepalive", no_keepalive, url, server, args.threads, args.calls)
+    run("default_session", requests.Session().post, url, server, args.threads, args.calls)
+    run("pooled", create_rpc_session().post, url, server, args.threads, args.calls)
+    server.shutdown()
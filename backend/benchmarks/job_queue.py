@@ -0,0 +1,77 @@
+"""
+Throughput of the durable upload job queue.
+
+Runs the real UploadExecutor + SQLite JobStore with a handler that only
+records its pipeline stages (no network), so the numbers are the queue's own
+overhead: submit, per-stage commits, completion. Also times resume() of a
+backlog left by a "crashed" process.
+
+    python -m benchmarks.job_queue [--jobs 2000] [--workers 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from job_store import JobStore
+from uploadFile import UploadExecutor
+
+STAGES = ("storage_upload", "db_insert")
+
+
+def _handler(executor, job):
+    for stage in STAGES:
+        if stage not in job["stages_done"]:
+            executor.update(job, stage=stage, attempts=job["attempts"] + 1)
+            executor.complete_stage(job, stage, {"ok": True})
+    return {"file_url": "bench://" + job["id"]}
+
+
+def _wait_for_drain(executor, total, timeout=600):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        counts = executor.store.counts()
+        if counts.get("done", 0) + counts.get("failed", 0) >= total:
+            return
+        time.sleep(0.01)
+    raise TimeoutError("queue did not drain")
+
+
+def bench_throughput(db_path, jobs, workers):
+    executor = UploadExecutor(workers=workers, queue_max=jobs, history=jobs, store=JobStore(db_path))
+    executor.register_handler("bench", _handler)
+    start = time.perf_counter()
+    for n in range(jobs):
+        executor.submit("bench", {"output_path": f"uploads/stego_{n}.png", "data": {"hash": str(n)}}, owner="bench")
+    submitted = time.perf_counter() - start
+    _wait_for_drain(executor, jobs)
+    elapsed = time.perf_counter() - start
+    return {"submit_per_sec": round(jobs / submitted), "jobs_per_sec": round(jobs / elapsed)}
+
+
+def bench_resume(db_path, jobs, workers):
+    store = JobStore(db_path)
+    for n in range(jobs):
+        job = store.create("bench", {"output_path": f"uploads/stego_{n}.png", "data": {"hash": str(n)}}, owner="bench")
+        # Left by a process that is gone: its lease has run out
+        store.update(job["id"], lease_until=0)
+    store.close()
+
+    start = time.perf_counter()
+    executor = UploadExecutor(workers=workers, queue_max=jobs, history=jobs, store=JobStore(db_path))
+    executor.register_handler("bench", _handler)
+    resumed = executor.resume()
+    _wait_for_drain(executor, jobs)
+    elapsed = time.perf_counter() - start
+    return {"resumed": resumed, "jobs_per_sec": round(jobs / elapsed)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print("throughput:", bench_throughput(os.path.join(tmp, "throughput.db"), args.jobs, args.workers))
+        print("resume:    ", bench_resume(os.path.join(tmp, "resume.db"), args.jobs, args.workers))
@@ -0,0 +1,133 @@
+"""
+Per-image transactions vs Merkle-batched anchoring on a local EVM.
+
+Deploys contracts/ImageRegistry.sol fresh (eth-tester in-process, or any
+JSON-RPC node with --evm rpc), registers --images random (sha256, pHash)
+pairs the old way (one storeImageHash each) and through the batch anchorer,
+and reports transactions, gas and images/sec for both. Every batched image's
+proof is then checked locally and with the contract's verifyLeaf().
+
+--check skips the timing and only compares the Python proofs with
+verifyLeaf() on trees of every small shape (odd levels included), plus one
+tampered proof per tree that must be rejected. It exits non-zero on any
+mismatch.
+
+    pip install "web3[tester]" py-solc-x
+    python -m benchmarks.merkle_anchor --images 500 --batch-size 256
+    python -m benchmarks.merkle_anchor --check
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHECK_TREE_SIZES = (1, 2, 3, 4, 5, 6, 7, 8, 9, 15, 16, 17, 33)
+
+
+def check_proofs(rng) -> int:
+    """verifyLeaf() against the Python proofs for each CHECK_TREE_SIZES tree. Returns the mismatches."""
+    import anchoring
+
+    mismatches = 0
+    for size in CHECK_TREE_SIZES:
+        anchorer = anchoring.BatchAnchorer(anchoring.get_leaf_store(), batch_size=size, window=3600)
+        images = [(f"{rng.getrandbits(256):064x}", f"{rng.getrandbits(64):016x}") for _ in range(size)]
+        for sha, phash in images:
+            anchorer.submit(sha, phash)
+        anchorer.flush()
+        for sha, _ in images:
+            entry = anchoring.proof_for(sha)
+            if entry["status"] != "anchored":
+                print(f"size {size:3d}: batch {entry['batch']} not anchored")
+                mismatches += 1
+                continue
+            result = anchoring.verify(entry["sha256"], entry["perceptual_hash"], entry["uploader"],
+                                      entry["proof"], entry["root"], chain_index=entry["chain_index"])
+            if not (result["valid"] and result["on_chain"]):
+                print(f"size {size:3d}: position {entry['position']} valid={result['valid']} "
+                      f"on_chain={result['on_chain']}")
+                mismatches += 1
+        # A proof for a different leaf must not verify
+        entry = anchoring.proof_for(images[0][0])
+        tampered = anchoring.verify(entry["sha256"], "0" * 16, entry["uploader"],
+                                    entry["proof"], entry["root"], chain_index=entry["chain_index"])
+        if tampered["valid"] or tampered["on_chain"]:
+            print(f"size {size:3d}: tampered leaf accepted")
+            mismatches += 1
+    print(f"verifyLeaf checked {len(CHECK_TREE_SIZES)} tree sizes, {mismatches} mismatches")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--evm", choices=("eth-tester", "rpc"), default="eth-tester")
+    parser.add_argument("--rpc-url", default="http://127.0.0.1:8545")
+    parser.add_argument("--private-key", default=None, help="funded key for --evm rpc")
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--check", action="store_true", help="only check proofs against verifyLeaf()")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="merkle_anchor_")
+    os.environ.update({"ANCHOR_MODE": "batch", "ANCHOR_DB": os.path.join(workdir, "anchor.db")})
+    sys.path.insert(0, BACKEND_DIR)
+
+    import anchoring
+    import blockchain
+    import services
+    from benchmarks.e2e_upload import deploy_registry, start_evm
+
+    w3, account, private_key = start_evm(args)
+    blockchain.ACCOUNT_ADDRESS = account
+    blockchain.PRIVATE_KEY = private_key
+    blockchain.CONTRACT_ADDRESS = deploy_registry(w3, account, private_key)
+    if args.evm == "eth-tester":
+        services.register("web3", lambda: w3)
+    else:
+        blockchain.GANACHE_RPC = args.rpc_url
+        services.reset("web3")
+    services.reset("contract")
+
+    rng = random.Random(1)
+    if args.check:
+        sys.exit(1 if check_proofs(rng) else 0)
+
+    images = [(f"{rng.getrandbits(256):064x}", f"{rng.getrandbits(64):016x}") for _ in range(args.images)]
+
+    # One transaction per image
+    anchoring.ANCHOR_MODE = "single"
+    start, gas = time.perf_counter(), 0
+    for sha, phash in images:
+        gas += blockchain.store_image_on_chain(sha, phash)["gasUsed"]
+    single_s = time.perf_counter() - start
+    print(f"single  txs={len(images):6d}  gas={gas:>12,}  gas/image={gas // len(images):>8,}  "
+          f"images/s={len(images) / single_s:8.1f}")
+
+    # Merkle batches, flushed by hand instead of on the window timer
+    anchoring.ANCHOR_MODE = "batch"
+    anchorer = anchoring.BatchAnchorer(anchoring.get_leaf_store(), batch_size=args.batch_size, window=3600)
+    start = time.perf_counter()
+    for sha, phash in images:
+        anchorer.submit(sha, phash)
+    anchorer.flush()
+    batch_s = time.perf_counter() - start
+    batches = anchoring.get_leaf_store().batches()
+    gas = sum(b["gas_used"] or 0 for b in batches)
+    print(f"batched txs={len(batches):6d}  gas={gas:>12,}  gas/image={gas // len(images):>8,}  "
+          f"images/s={len(images) / batch_s:8.1f}  failed={sum(b['status'] != 'anchored' for b in batches)}")
+
+    local = on_chain = 0
+    for sha, _ in images:
+        entry = anchoring.proof_for(sha)
+        result = anchoring.verify(entry["sha256"], entry["perceptual_hash"], entry["uploader"],
+                                  entry["proof"], entry["root"], chain_index=entry["chain_index"])
+        local += result["valid"]
+        on_chain += bool(result["on_chain"])
+    print(f"proofs  valid locally {local}/{len(images)}  valid on chain {on_chain}/{len(images)}")
+
+
+if __name__ == "__main__":
+    main()
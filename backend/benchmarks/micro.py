@@ -0,0 +1,208 @@
+"""
+Micro-benchmarks for the primitives every request path is built on, with
+stored baselines and a regression gate.
+
+Images are synthetic (a gradient with noise, so they compress like photos)
+at each --sizes resolution, saved as JPEG for hashing and PNG for embedding;
+hash sets are random 64-bit pHashes of each --hash-counts size. Nothing
+touches the network, the chain or Supabase.
+
+    python -m benchmarks.micro                     # run and print
+    python -m benchmarks.micro --save              # record the baseline
+    python -m benchmarks.micro --check             # exit 1 on a regression
+    python -m benchmarks.micro --check --threshold 10 --only phash,hamming
+
+A case regresses when its best per-call time is more than --threshold
+percent (MICRO_BENCH_THRESHOLD, default 20) slower than the baseline.
+Baselines are machine-specific; record one per box. LSB embedding and
+detection are pure Python per pixel, so they only run at sizes up to
+--embed-max-pixels.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baselines", "micro.json")
+DEFAULT_THRESHOLD = float(os.getenv("MICRO_BENCH_THRESHOLD", "20"))
+
+MESSAGES = [
+    "What a lovely sunset over the bay 🌅",
+    "Not sure how I feel about this one, honestly.",
+    "Best trip ever!!! 😍🎉 can't wait to go back",
+    "The light was terrible and the photo is blurry 😞",
+]
+
+
+def measure(fn, repeat: int, min_time: float) -> dict:
+    """Best and median seconds per call over `repeat` rounds of at least `min_time` each."""
+    fn()  # warm caches and lazy imports
+    per_call = []
+    for _ in range(repeat):
+        calls, start = 0, time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_call.append(elapsed / calls)
+    return {"seconds": min(per_call), "median_seconds": statistics.median(per_call), "calls": calls}
+
+
+def synthetic_image(width: int, height: int, seed: int = 0):
+    from PIL import Image
+
+    rng = random.Random(seed)
+    base = Image.linear_gradient("L").rotate(rng.randrange(360)).resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    channels = [Image.blend(base, noise, 0.3 + 0.1 * i).point(lambda v, s=rng.randrange(64): (v + s) % 256)
+                for i in range(3)]
+    return Image.merge("RGB", channels)
+
+
+def parse_sizes(text: str):
+    return [tuple(int(n) for n in size.lower().split("x")) for size in text.split(",") if size]
+
+
+def cases(args, workdir):
+    """Yield (name, fn) for every case selected by --only."""
+    import blockchain
+    import stego_utils
+
+    stego_utils.UPLOAD_FOLDER = workdir
+    wanted = set(args.only.split(",")) if args.only else None
+
+    def selected(group):
+        return wanted is None or group in wanted
+
+    if selected("hamming"):
+        rng = random.Random(7)
+        for count in [int(n) for n in args.hash_counts.split(",")]:
+            hashes = [f"{rng.getrandbits(64):016x}" for _ in range(count)]
+            probe = f"{rng.getrandbits(64):016x}"
+            yield f"hamming/{count}", lambda h=hashes, p=probe: [blockchain.hamming_distance(p, x) for x in h]
+
+    if selected("crypto"):
+        key = os.urandom(32)
+        blob = stego_utils.encrypt_message(MESSAGES[0], key)
+        yield "encrypt_message", lambda: stego_utils.encrypt_message(MESSAGES[0], key)
+        yield "decrypt_message", lambda: stego_utils.decrypt_message(blob, key)
+
+    if selected("sentiment"):
+        from sentiment import analyze_sentiment
+        yield "sentiment", lambda: [analyze_sentiment(m) for m in MESSAGES]
+
+    for width, height in parse_sizes(args.sizes):
+        label = f"{width}x{height}"
+        if not any(selected(g) for g in ("sha256", "phash", "embed", "detect")):
+            break
+        image = synthetic_image(width, height)
+        jpeg = os.path.join(workdir, f"{label}.jpg")
+        png = os.path.join(workdir, f"{label}.png")
+        image.save(jpeg, quality=90)
+        image.save(png)
+        if selected("sha256"):
+            yield f"sha256/{label}", lambda p=jpeg: stego_utils.get_image_hash(p)
+        if selected("phash"):
+            yield f"phash/{label}", lambda p=jpeg: stego_utils.get_perceptual_hash(p)
+        if width * height > args.embed_max_pixels:
+            continue
+        if selected("embed"):
+            yield f"embed/{label}", lambda p=png: stego_utils.embed_message(p, MESSAGES[0])
+        if selected("detect"):
+            stego = stego_utils.embed_message(png, MESSAGES[0])
+            yield f"detect/{label}", lambda p=stego: stego_utils.detect_steganography(p)
+
+
+def run(args) -> dict:
+    sys.path.insert(0, BACKEND_DIR)
+    workdir = tempfile.mkdtemp(prefix="micro_bench_")
+    results = {}
+    try:
+        for name, fn in cases(args, workdir):
+            try:
+                results[name] = measure(fn, args.repeat, args.min_time)
+            except ImportError as e:
+                print(f"{name:24s} skipped ({e})")
+                continue
+            print(f"{name:24s} {results[name]['seconds'] * 1000:10.3f} ms/call")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Names of cases more than `threshold` percent slower than the baseline."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:24s} new (no baseline)")
+            continue
+        change = (result["seconds"] / before["seconds"] - 1) * 100
+        flag = "REGRESSION" if change > threshold else "ok"
+        print(f"{name:24s} {before['seconds'] * 1000:10.3f} -> {result['seconds'] * 1000:10.3f} ms  "
+              f"{change:+6.1f}%  {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="640x480,1920x1080,4000x3000", help="image resolutions, WxH")
+    parser.add_argument("--hash-counts", default="1000,10000,100000", help="registry sizes for hamming scans")
+    parser.add_argument("--only", default="",
+                        help="comma-separated groups: hamming,crypto,sentiment,sha256,phash,embed,detect")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--embed-max-pixels", type=int, default=1920 * 1080)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="compare against the baseline, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"no baseline at {args.baseline}; run with --save first")
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} regression(s) beyond {args.threshold}%: {', '.join(regressions)}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f)["results"]
+        # Keep cases this run did not select (--only)
+        previous.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "machine": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "cpus": os.cpu_count(),
+                },
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": previous,
+            }, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Reduced-resolution pHash: hash drift and speedup against a full decode.
+
+For every image under --corpus (or, without one, synthetic JPEGs and PNGs at
+--sizes), computes the pHash the old way (imagehash on the full-resolution
+decode) and with stego_utils.get_perceptual_hash, then reports the Hamming
+distance between the two and the time each took. Exits 1 if any image
+drifts more than --max-distance bits, which would change what the duplicate
+check (threshold 10 by default) considers similar.
+
+    python -m benchmarks.phash_fastpath --corpus /data/archive
+    python -m benchmarks.phash_fastpath --sizes 1920x1080,6000x4000 --decode-size 128
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def full_decode_phash(path: str) -> str:
+    """pHash as computed before the fast path."""
+    import imagehash
+    from PIL import Image
+    with Image.open(path) as img:
+        return str(imagehash.phash(img))
+
+
+def corpus_files(root: str, limit: int):
+    found = []
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(EXTENSIONS):
+                found.append(os.path.join(dirpath, name))
+                if len(found) >= limit:
+                    return found
+    return found
+
+
+def synthetic_files(sizes: str, workdir: str):
+    from benchmarks.micro import parse_sizes, synthetic_image
+
+    paths = []
+    for n, (width, height) in enumerate(parse_sizes(sizes)):
+        image = synthetic_image(width, height, seed=n)
+        jpeg = os.path.join(workdir, f"{width}x{height}.jpg")
+        png = os.path.join(workdir, f"{width}x{height}.png")
+        image.save(jpeg, quality=90)
+        image.save(png)
+        paths += [jpeg, png]
+    return paths
+
+
+def best_of(fn, arg, repeat: int):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="directory of real images to check")
+    parser.add_argument("--limit", type=int, default=1000, help="max corpus images")
+    parser.add_argument("--sizes", default="1024x768,4000x3000,6000x4000", help="synthetic sizes without --corpus")
+    parser.add_argument("--decode-size", type=int, help="override PHASH_DECODE_SIZE")
+    parser.add_argument("--max-distance", type=int, default=3, help="allowed drift in bits")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    import blockchain
+    import stego_utils
+
+    if args.decode_size is not None:
+        stego_utils.PHASH_DECODE_SIZE = args.decode_size
+
+    paths = corpus_files(args.corpus, args.limit) if args.corpus else \
+        synthetic_files(args.sizes, tempfile.mkdtemp(prefix="phash_fastpath_"))
+    if not paths:
+        sys.exit("no images found")
+
+    distances, full_times, fast_times, worst = [], [], [], []
+    for path in paths:
+        old, full_s = best_of(full_decode_phash, path, args.repeat)
+        new, fast_s = best_of(stego_utils.get_perceptual_hash, path, args.repeat)
+        distance = blockchain.hamming_distance(old, new)
+        distances.append(distance)
+        full_times.append(full_s)
+        fast_times.append(fast_s)
+        if distance > args.max_distance:
+            worst.append((distance, path))
+        if not args.corpus:
+            print(f"{os.path.basename(path):20s} full {full_s * 1000:8.1f} ms  fast {fast_s * 1000:7.1f} ms  "
+                  f"x{full_s / fast_s:5.1f}  distance {distance}")
+
+    print(f"images: {len(paths)}  decode size: {stego_utils.PHASH_DECODE_SIZE}")
+    print(f"distance: mean {statistics.mean(distances):.2f}  max {max(distances)}  "
+          f"zero {sum(d == 0 for d in distances)}/{len(distances)}")
+    print(f"time: full {sum(full_times):.2f}s  fast {sum(fast_times):.2f}s  "
+          f"speedup x{sum(full_times) / sum(fast_times):.1f}")
+    if worst:
+        for distance, path in sorted(worst, reverse=True)[:20]:
+            print(f"  drift {distance:2d}  {path}")
+        sys.exit(f"{len(worst)} image(s) drifted more than {args.max_distance} bits")
+
+
+if __name__ == "__main__":
+    main()
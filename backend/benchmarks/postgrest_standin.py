@@ -0,0 +1,236 @@
+"""
+Local stand-in for the parts of the supabase-py table API the backend uses.
+
+Queries are translated to SQL and run on SQLite (default, in-memory) or on a
+local Postgres through psycopg2 when a DSN is given, so benchmarks exercise
+real indexes and real result sizes without a Supabase project.
+
+Supported: table().select(cols) / .insert(rows), .eq(), .in_(), .or_() with
+PostgREST filter syntax (col.op.value, and(...)), .order(), .limit(),
+.execute() -> object with .data; and storage.from_(bucket) with upload(),
+list() and get_public_url(), kept in memory.
+"""
+import json
+import re
+import sqlite3
+import threading
+
+_OPS = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+def _split_top_level(expr: str):
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _parse_value(raw: str):
+    if raw.startswith('"') and raw.endswith('"'):
+        return raw[1:-1]
+    if re.fullmatch(r"-?\d+", raw):
+        return int(raw)
+    return raw
+
+
+def _parse_filter(expr: str, joiner: str, ph: str):
+    """Translate a PostgREST logical filter into (sql, params)."""
+    clauses, params = [], []
+    for part in _split_top_level(expr):
+        part = part.strip()
+        match = re.fullmatch(r"(and|or)\((.*)\)", part)
+        if match:
+            sql, sub_params = _parse_filter(match.group(2), match.group(1).upper(), ph)
+            clauses.append(f"({sql})")
+            params.extend(sub_params)
+            continue
+        column, op, raw = part.split(".", 2)
+        clauses.append(f"{column} {_OPS[op]} {ph}")
+        params.append(_parse_value(raw))
+    return f" {joiner} ".join(clauses), params
+
+
+class _Query:
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._columns = "*"
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._insert = None
+        self._count = None
+
+    def select(self, columns="*", count=None):
+        self._columns = columns
+        self._count = count
+        return self
+
+    def insert(self, rows):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def eq(self, column, value):
+        self._where.append(f"{column} = {self._client.ph}")
+        self._params.append(value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self._where.append("1 = 0")
+            return self
+        self._where.append(f"{column} IN ({', '.join(self._client.ph for _ in values)})")
+        self._params.extend(values)
+        return self
+
+    def or_(self, expr):
+        sql, params = _parse_filter(expr, "OR", self._client.ph)
+        self._where.append(f"({sql})")
+        self._params.extend(params)
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append(f"{column} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, n):
+        self._limit = int(n)
+        return self
+
+    def execute(self):
+        if self._insert is not None:
+            return _Response(self._client.insert_rows(self._table, self._insert))
+        sql = f"SELECT {self._columns} FROM {self._table}"
+        if self._where:
+            sql += " WHERE " + " AND ".join(self._where)
+        if self._order:
+            sql += " ORDER BY " + ", ".join(self._order)
+        if self._limit is not None:
+            sql += f" LIMIT {self._limit}"
+        return _Response(self._client.query(sql, self._params))
+
+
+class _StandInBucket:
+    def __init__(self, name, objects, lock):
+        self.name = name
+        self._objects = objects
+        self._lock = lock
+
+    def upload(self, path, file, file_options=None):
+        data = file if isinstance(file, (bytes, bytearray)) else file.read()
+        with self._lock:
+            self._objects[f"{self.name}/{path}"] = bytes(data)
+        return {"path": path}
+
+    def list(self, path=""):
+        prefix = f"{self.name}/{path.rstrip('/')}/"
+        with self._lock:
+            return [{"name": key[len(prefix):]} for key in self._objects
+                    if key.startswith(prefix) and "/" not in key[len(prefix):]]
+
+    def get_public_url(self, path):
+        return f"http://localhost/storage/v1/object/public/{self.name}/{path}"
+
+
+class StandInStorage:
+    """In-memory object store with the supabase-py storage bucket API."""
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def from_(self, bucket_name):
+        return _StandInBucket(bucket_name, self.objects, self._lock)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self.objects.values())
+
+
+class StandInClient:
+    """
+    Minimal supabase-py lookalike. `json_columns` maps table -> columns that
+    hold JSON and are decoded on read (like JSONB through PostgREST).
+    """
+
+    def __init__(self, dsn: str = None, json_columns=None):
+        self._lock = threading.Lock()
+        self.json_columns = json_columns or {}
+        self.round_trips = 0
+        self.storage = StandInStorage()
+        if dsn:
+            import psycopg2
+            self.conn = psycopg2.connect(dsn)
+            self.conn.autocommit = True
+            self.ph = "%s"
+            self.dialect = "postgres"
+        else:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self.ph = "?"
+            self.dialect = "sqlite"
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def executescript(self, sql: str):
+        with self._lock:
+            cur = self.conn.cursor()
+            for statement in filter(None, (s.strip() for s in sql.split(";"))):
+                cur.execute(statement)
+            if self.dialect == "sqlite":
+                self.conn.commit()
+
+    def insert_rows(self, table, rows):
+        if not rows:
+            return []
+        json_cols = self.json_columns.get(table, ())
+        columns = list(rows[0])
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(self.ph for _ in columns)})"
+        values = [
+            tuple(json.dumps(row[c]) if c in json_cols else row[c] for c in columns)
+            for row in rows
+        ]
+        with self._lock:
+            self.round_trips += 1
+            cur = self.conn.cursor()
+            cur.executemany(sql, values)
+            if self.dialect == "sqlite":
+                self.conn.commit()
+        return rows
+
+    def query(self, sql, params):
+        with self._lock:
+            self.round_trips += 1
+            cur = self.conn.cursor()
+            cur.execute(sql, params)
+            names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        json_cols = [n for cols in self.json_columns.values() for n in cols]
+        result = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name in json_cols:
+                if isinstance(item.get(name), str):
+                    item[name] = json.loads(item[name])
+            result.append(item)
+        return result
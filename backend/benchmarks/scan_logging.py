@@ -0,0 +1,107 @@
+"""
+Cost of logging inside the on-chain similarity scan.
+
+Runs blockchain.is_similar_to_existing against an in-memory stand-in
+contract (so only the loop and its logging are measured) with logging off
+(INFO), debug with per-item sampling, and debug for every item. Log output
+goes to /dev/null; the listener thread still formats every record.
+
+    python -m benchmarks.scan_logging --images 20000 --repeat 5
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+
+class _Call:
+    def __init__(self, value):
+        self._value = value
+
+    def call(self):
+        return self._value
+
+
+class _Functions:
+    def __init__(self, hashes):
+        self._hashes = hashes
+
+    def getImageCount(self):
+        return _Call(len(self._hashes))
+
+    def getPerceptualHash(self, index):
+        return _Call(self._hashes[index])
+
+    def getImage(self, index):
+        return _Call(("0" * 64, self._hashes[index], "0x0", 0))
+
+
+class StandInContract:
+    def __init__(self, hashes):
+        self.functions = _Functions(hashes)
+
+
+class StandInWeb3:
+    class eth:
+        @staticmethod
+        def get_code(address):
+            return b"\x60\x80\x60\x40"
+
+    @staticmethod
+    def is_connected():
+        return True
+
+
+MODES = {
+    "off": ("INFO", 100),
+    "debug_sampled": ("DEBUG", 100),
+    "debug_every_item": ("DEBUG", 1),
+}
+
+
+def run(images: int, repeat: int):
+    import blockchain
+    import logs
+    import services
+
+    rng = random.Random(7)
+    hashes = [f"{rng.getrandbits(64):016x}" for _ in range(images)]
+    services.register("web3", lambda: StandInWeb3())
+    services.register("contract", lambda: StandInContract(hashes))
+    probe = f"{rng.getrandbits(64):016x}"
+
+    devnull = open(os.devnull, "w")
+    results = {}
+    for mode, (level, every) in MODES.items():
+        logs.configure(level=level, stream=devnull)
+        logs.LOG_SAMPLE_EVERY = every
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            blockchain.is_similar_to_existing(probe, similarity_threshold=0)
+            runs.append(time.perf_counter() - start)
+        # Include the time the listener needs to drain what the scan queued.
+        start = time.perf_counter()
+        logs.shutdown()
+        drain = time.perf_counter() - start
+        results[mode] = {
+            "median_ms": round(statistics.median(runs) * 1000, 2),
+            "per_item_us": round(statistics.median(runs) / images * 1e6, 3),
+            "drain_ms": round(drain * 1000, 2),
+        }
+    devnull.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for mode, result in run(args.images, args.repeat).items():
+        print(f"{mode:18s} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Cold-start benchmark for the Flask app.
+
+Reports the slowest imports from `python -X importtime -c "import app"` and
+the wall time from process spawn to the first successful GET /health, with
+lazy startup (default) and with WARM_UP=1.
+
+    python -m benchmarks.startup [--runs 3] [--top 15]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+_SERVER = (
+    "from app import app\n"
+    "app.run(host='127.0.0.1', port={port}, debug=False, use_reloader=False)\n"
+)
+
+
+def import_profile(top: int = 15):
+    """Return [(cumulative_us, self_us, module)] for the slowest imports of app."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True, text=True
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+        except ValueError:
+            continue
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_health(env_overrides=None, timeout: float = 120.0) -> float:
+    """Spawn the app and return seconds until /health first answers 200."""
+    port = _free_port()
+    env = dict(os.environ, **(env_overrides or {}))
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", _SERVER.format(port=port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/health"
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError("/health did not answer in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print("Slowest imports (cumulative us, self us, module):")
+    for cumulative_us, self_us, module in import_profile(args.top):
+        print(f"  {cumulative_us:>10} {self_us:>10} {module}")
+
+    for label, env in (("lazy", {"WARM_UP": "0"}), ("warm_up", {"WARM_UP": "1"})):
+        samples = []
+        for _ in range(args.runs):
+            try:
+                samples.append(time_to_first_health(env))
+            except Exception as e:
+                print(f"{label}: {e}")
+                break
+        if samples:
+            samples.sort()
+            print(f"{label:8s} time-to-first-/health: best={samples[0]*1000:.0f}ms "
+                  f"median={samples[len(samples)//2]*1000:.0f}ms")
@@ -0,0 +1,104 @@
+"""
+Storage upload I/O: legacy file round trip vs in-memory upload.
+
+Uses a local stand-in for the Supabase client (registered in the service
+registry), so no network is involved. The stand-in consumes the uploaded
+bytes and can simulate the round trip of the extra get_public_url call
+the legacy path made (--rtt-ms).
+
+    python -m benchmarks.storage_upload [--sizes 1,4,16] [--iterations 20] [--rtt-ms 0]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import services
+import stego_utils
+
+
+class _Bucket:
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    def upload(self, path, file, file_options=None):
+        data = file if isinstance(file, (bytes, bytearray)) else file.read()
+        hashlib.sha256(data).digest()
+        return {"path": path}
+
+    def get_public_url(self, path):
+        time.sleep(self.rtt)
+        return f"http://localhost/storage/v1/object/public/image/{path}"
+
+
+class _Storage:
+    def __init__(self, rtt):
+        self._bucket = _Bucket(rtt)
+
+    def from_(self, bucket_name):
+        return self._bucket
+
+
+class LocalSupabaseStandIn:
+    def __init__(self, rtt=0.0):
+        self.storage = _Storage(rtt)
+
+
+def _io_counters():
+    """(chars read, chars written) by this process, from /proc/self/io."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError):
+        return 0, 0
+
+
+def legacy_upload(stand_in, data, path):
+    """Previous flow: write the PNG, reopen it to upload, then ask for the URL."""
+    with open(path, "wb") as f:
+        f.write(data)
+    bucket = stand_in.storage.from_("image")
+    remote_path = f"stego_uploads/{os.path.basename(path)}"
+    with open(path, "rb") as f:
+        bucket.upload(path=remote_path, file=f, file_options={"content-type": "image/png", "upsert": "true"})
+    return bucket.get_public_url(remote_path)
+
+
+def in_memory_upload(data, path):
+    return stego_utils.upload_stego_to_supabase(data, file_name=os.path.basename(path))
+
+
+def run(label, fn, iterations):
+    r0, w0 = _io_counters()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    r1, w1 = _io_counters()
+    return {
+        "mode": label,
+        "ms_per_upload": round(elapsed / iterations * 1000, 3),
+        "file_read_mb": round((r1 - r0) / iterations / 2**20, 2),
+        "file_write_mb": round((w1 - w0) / iterations / 2**20, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,4,16", help="payload sizes in MB")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stand_in = LocalSupabaseStandIn(rtt=args.rtt_ms / 1000)
+    services.register("supabase", lambda: stand_in)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stego_bench.png")
+        for size_mb in (float(s) for s in args.sizes.split(",")):
+            data = os.urandom(int(size_mb * 2**20))
+            print(f"{size_mb:g} MB payload:")
+            print("  ", run("legacy_file", lambda: legacy_upload(stand_in, data, path), args.iterations))
+            print("  ", run("in_memory", lambda: in_memory_upload(data, path), args.iterations))
@@ -1,31 +1,87 @@
-from web3 import Web3
 import json
+import logging
+import os
+import threading
 import time
+import deadlines
+import services
+from deadlines import DeadlineExceeded
+from metrics import timed, RPC_CALLS, REGISTRY_SIZE
+from logs import get_logger, sample
 
+log = get_logger("blockchain")
 
-GANACHE_RPC = "http://127.0.0.1:8545"
 
-PRIVATE_KEY = "0xcf6a23ee2b3d83cd6956bece00934812079ab9023762048b17ad8b1e13a4bcc4"
+GANACHE_RPC = os.getenv("GANACHE_RPC", "http://127.0.0.1:8545")
 
-ACCOUNT_ADDRESS = "0x6ea8Ae4A6d66fBDaCb8f44199564cB7Dc4993FD5"
+PRIVATE_KEY = os.getenv("CHAIN_PRIVATE_KEY", "0xcf6a23ee2b3d83cd6956bece00934812079ab9023762048b17ad8b1e13a4bcc4")
 
+ACCOUNT_ADDRESS = os.getenv("CHAIN_ACCOUNT_ADDRESS", "0x6ea8Ae4A6d66fBDaCb8f44199564cB7Dc4993FD5")
 
-w3 = Web3(Web3.HTTPProvider(GANACHE_RPC))
+# Longest wait for a transaction receipt. Not capped by the request deadline:
+# by then the transaction has been sent.
+RECEIPT_TIMEOUT = float(os.getenv("RECEIPT_TIMEOUT", "120"))
 
+# Held from reading the nonce until the transaction is sent, so threads
+# sending from ACCOUNT_ADDRESS (upload workers, the batch anchorer) get
+# consecutive nonces. Receipts are awaited outside it.
+send_lock = threading.Lock()
+
+
+def _create_web3():
+    from web3 import Web3
+    from http_pools import create_rpc_session, RPC_TIMEOUT
+
+    class CountingHTTPProvider(Web3.HTTPProvider):
+        """Counts calls, and sizes each call's timeout to the request deadline."""
+
+        def get_request_kwargs(self):
+            kwargs = dict(super().get_request_kwargs())
+            kwargs["timeout"] = deadlines.timeout(RPC_TIMEOUT)
+            return kwargs
+
+        def make_request(self, method, params):
+            deadlines.check()
+            RPC_CALLS.inc(method=method)
+            return super().make_request(method, params)
+
+    provider = CountingHTTPProvider(
+        GANACHE_RPC,
+        request_kwargs={"timeout": RPC_TIMEOUT},
+        session=create_rpc_session()
+    )
+    return Web3(provider)
+
+
+def get_w3():
+    """Shared Web3 instance, created on first use."""
+    return services.get("web3")
+
+
+def get_contract():
+    """Shared contract instance, created on first use."""
+    return services.get("contract")
+
+
+@timed("chain_health")
 def health_check():
     """Check if connected to Ganache and contract is deployed"""
+    w3 = get_w3()
     if not w3.is_connected():
+        # is_connected() swallows errors; a spent deadline is not "unhealthy"
+        deadlines.check()
         return False
     
     # Check if contract exists at address
     try:
         code = w3.eth.get_code(CONTRACT_ADDRESS)
         if len(code) <= 2:  # '0x' only means no contract
-            print(f"[BLOCKCHAIN] ❌ No contract at {CONTRACT_ADDRESS}")
+            log.error("no contract deployed", extra={"contract": CONTRACT_ADDRESS})
             return False
         return True
     except Exception as e:
-        print(f"[BLOCKCHAIN] Health check failed: {e}")
+        deadlines.check()
+        log.warning("health check failed: %s", e)
         return False
 
 
@@ -36,6 +92,121 @@ CONTRACT_ABI =[
 		"stateMutability": "nonpayable",
 		"type": "constructor"
 	},
+	{
+		"anonymous": False,
+		"inputs": [
+			{
+				"indexed": True,
+				"internalType": "uint256",
+				"name": "index",
+				"type": "uint256"
+			},
+			{
+				"indexed": False,
+				"internalType": "bytes32",
+				"name": "root",
+				"type": "bytes32"
+			},
+			{
+				"indexed": False,
+				"internalType": "uint256",
+				"name": "count",
+				"type": "uint256"
+			}
+		],
+		"name": "BatchAnchored",
+		"type": "event"
+	},
+	{
+		"inputs": [
+			{
+				"internalType": "bytes32",
+				"name": "_root",
+				"type": "bytes32"
+			},
+			{
+				"internalType": "uint256",
+				"name": "_count",
+				"type": "uint256"
+			}
+		],
+		"name": "anchorBatch",
+		"outputs": [
+			{
+				"internalType": "uint256",
+				"name": "",
+				"type": "uint256"
+			}
+		],
+		"stateMutability": "nonpayable",
+		"type": "function"
+	},
+	{
+		"inputs": [
+			{
+				"internalType": "address",
+				"name": "",
+				"type": "address"
+			}
+		],
+		"name": "anchorers",
+		"outputs": [
+			{
+				"internalType": "bool",
+				"name": "",
+				"type": "bool"
+			}
+		],
+		"stateMutability": "view",
+		"type": "function"
+	},
+	{
+		"inputs": [
+			{
+				"internalType": "uint256",
+				"name": "index",
+				"type": "uint256"
+			}
+		],
+		"name": "getBatch",
+		"outputs": [
+			{
+				"internalType": "bytes32",
+				"name": "",
+				"type": "bytes32"
+			},
+			{
+				"internalType": "uint256",
+				"name": "",
+				"type": "uint256"
+			},
+			{
+				"internalType": "address",
+				"name": "",
+				"type": "address"
+			},
+			{
+				"internalType": "uint256",
+				"name": "",
+				"type": "uint256"
+			}
+		],
+		"stateMutability": "view",
+		"type": "function"
+	},
+	{
+		"inputs": [],
+		"name": "getBatchCount",
+		"outputs": [
+			{
+				"internalType": "uint256",
+				"name": "",
+				"type": "uint256"
+			}
+		],
+		"stateMutability": "view",
+		"type": "function"
+	},
 	{
 		"inputs": [
 			{
@@ -115,6 +286,24 @@ CONTRACT_ABI =[
 		"stateMutability": "view",
 		"type": "function"
 	},
+	{
+		"inputs": [
+			{
+				"internalType": "address",
+				"name": "_account",
+				"type": "address"
+			},
+			{
+				"internalType": "bool",
+				"name": "_allowed",
+				"type": "bool"
+			}
+		],
+		"name": "setAnchorer",
+		"outputs": [],
+		"stateMutability": "nonpayable",
+		"type": "function"
+	},
 	{
 		"inputs": [
 			{
@@ -137,45 +326,114 @@ CONTRACT_ABI =[
 		"outputs": [],
 		"stateMutability": "nonpayable",
 		"type": "function"
+	},
+	{
+		"inputs": [
+			{
+				"internalType": "uint256",
+				"name": "index",
+				"type": "uint256"
+			},
+			{
+				"internalType": "bytes32",
+				"name": "leaf",
+				"type": "bytes32"
+			},
+			{
+				"internalType": "bytes32[]",
+				"name": "proof",
+				"type": "bytes32[]"
+			}
+		],
+		"name": "verifyLeaf",
+		"outputs": [
+			{
+				"internalType": "bool",
+				"name": "",
+				"type": "bool"
+			}
+		],
+		"stateMutability": "view",
+		"type": "function"
 	}
 ]
 
 
-CONTRACT_ADDRESS = "0x0567DEe31b322d95B7a7e5B59727987e446e8E0f"
+CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0567DEe31b322d95B7a7e5B59727987e446e8E0f")
+
+def _create_contract():
+    try:
+        return get_w3().eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
+    except Exception as e:
+        log.error("failed to load contract: %s", e)
+        raise
+
+
+services.register("web3", _create_web3)
+services.register("contract", _create_contract)
+
+
+def send_store_transaction(sha_hash, perceptual_hash, on_signed=None):
+    """
+    Build, sign and send storeImageHash under send_lock; returns the tx hash
+    without waiting for the receipt. Every sender from ACCOUNT_ADDRESS,
+    including the async routes (blockchain_async), goes through here, so no
+    two of them read the same pending nonce.
+    """
+    w3 = get_w3()
+    contract_instance = get_contract()
+    try:
+        with send_lock:
+            nonce = w3.eth.get_transaction_count(ACCOUNT_ADDRESS, "pending")
+
+            tx = contract_instance.functions.storeImageHash(
+                sha_hash,
+                perceptual_hash,
+                ACCOUNT_ADDRESS
+            ).build_transaction({
+                "from": ACCOUNT_ADDRESS,
+                "nonce": nonce,
+                "gas": 3000000,
+                "gasPrice": w3.eth.gas_price
+            })
+
+            signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
+            if on_signed is not None:
+                on_signed(signed_tx.hash.hex())
+            return w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    except Exception as e:
+        deadlines.translate(e)
+        log.error("failed to store on chain: %s", e)
+        raise
 
-try:
-    contract_instance = w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
-except Exception as e:
-    print(f"[BLOCKCHAIN] ❌ Failed to load contract: {e}")
-    contract_instance = None
 
+@timed("chain_store")
+def store_image_on_chain(sha_hash, perceptual_hash, on_signed=None):
+    """
+    Store image hashes on blockchain (or queue them for a Merkle batch, see anchoring.py).
 
-def store_image_on_chain(sha_hash, perceptual_hash):
-    """Store image hashes on blockchain"""
+    on_signed(tx_hash), if given, is called with the hash of the signed
+    transaction before it is sent, so the caller can record it and settle it
+    with wait_for_stored() after a crash instead of sending a second one.
+    """
+    import anchoring
+    if anchoring.batching():
+        return anchoring.get_anchorer().submit(sha_hash, perceptual_hash)
     if not health_check():
         raise Exception("Blockchain not connected or contract not deployed")
-    
-    try:
-        nonce = w3.eth.get_transaction_count(ACCOUNT_ADDRESS)
-
-        tx = contract_instance.functions.storeImageHash(
-            sha_hash,
-            perceptual_hash,
-            ACCOUNT_ADDRESS
-        ).build_transaction({
-            "from": ACCOUNT_ADDRESS,
-            "nonce": nonce,
-            "gas": 3000000,
-            "gasPrice": w3.eth.gas_price
-        })
 
-        signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        
-        print(f"[BLOCKCHAIN] Waiting for transaction confirmation...")
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    w3 = get_w3()
+    tx_hash = send_store_transaction(sha_hash, perceptual_hash, on_signed)
+
+    # Once sent, the transaction is mined whatever the request does. Giving
+    # up at the request deadline would leave the image on chain with no post
+    # (and every retry a duplicate), so the receipt gets the full timeout.
+    try:
+        log.debug("waiting for transaction confirmation", extra={"tx": tx_hash.hex()})
+        with deadlines.lifted():
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=RECEIPT_TIMEOUT)
         
-        print(f"[BLOCKCHAIN] Transaction confirmed! Hash: {tx_hash.hex()}")
+        log.info("transaction confirmed", extra={"tx": tx_hash.hex(), "gas_used": receipt.gasUsed})
 
         return {
             "txHash": tx_hash.hex(),
@@ -183,10 +441,33 @@ def store_image_on_chain(sha_hash, perceptual_hash):
             "gasUsed": receipt.gasUsed
         }
     except Exception as e:
-        print(f"[BLOCKCHAIN] Failed to store on chain: {e}")
+        log.error("no receipt for transaction %s: %s", tx_hash.hex(), e)
         raise
 
 
+def wait_for_stored(tx_hash: str):
+    """
+    Outcome of a store_image_on_chain() transaction recorded through
+    on_signed, in the same shape. None if the node does not know it (never
+    sent, or dropped), in which case it is safe to send again.
+    """
+    from web3.exceptions import TransactionNotFound
+
+    w3 = get_w3()
+    try:
+        w3.eth.get_transaction(tx_hash)
+    except TransactionNotFound:
+        return None
+    with deadlines.lifted():
+        receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=RECEIPT_TIMEOUT)
+    log.info("transaction confirmed", extra={"tx": tx_hash, "gas_used": receipt.gasUsed})
+    return {
+        "txHash": tx_hash,
+        "status": receipt.status,
+        "gasUsed": receipt.gasUsed
+    }
+
+
 def hamming_distance(hash1: str, hash2: str) -> int:
     if not hash1 or not hash2:
         return float('inf')
@@ -215,7 +496,15 @@ def hamming_distance(hash1: str, hash2: str) -> int:
         return distance
 
 
-def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10) -> dict:
+@timed("chain_scan")
+def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10, start_index: int = 0) -> dict:
+    """
+    Compare a pHash against registered images from start_index on (0 scans
+    the whole registry). "registry_size" in the result is the image count the
+    scan saw, i.e. where a later incremental scan should start.
+    """
+    w3 = get_w3()
+    contract_instance = get_contract()
     if not w3.is_connected():
         raise Exception("Not connected to Ganache. Is it running on http://127.0.0.1:8545?")
     
@@ -225,28 +514,29 @@ def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10) -> di
         raise Exception(f"No contract deployed at {CONTRACT_ADDRESS}. Please deploy your contract first!")
     
     try:
-        print(f"[BLOCKCHAIN] Checking similarity for phash: {new_phash}")
-        print(f"[BLOCKCHAIN] Contract address: {CONTRACT_ADDRESS}")
-        
         # Get total images on blockchain
         total_images = contract_instance.functions.getImageCount().call()
-        print(f"[BLOCKCHAIN] Total images on chain: {total_images}")
+        REGISTRY_SIZE.set(total_images)
+        log.debug("similarity check", extra={"phash": new_phash, "total": total_images})
         
-        if total_images == 0:
-            print("[BLOCKCHAIN] No images on chain yet - Image is unique")
-            return {
+        if total_images <= start_index:
+            return _with_local({
                 "is_duplicate": False,
                 "similar_images": [],
-                "min_distance": None
-            }
+                "min_distance": None,
+                "registry_size": total_images
+            }, new_phash, similarity_threshold)
         
         similar_images = []
         min_distance = float('inf')
         
-        # Compare with all existing images
-        print(f"[BLOCKCHAIN] Comparing with {total_images} existing images...")
-        
-        for i in range(total_images):
+        # Compare with all existing images. Per-item debug lines are
+        # sampled, and the level is checked once rather than per image.
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        for i in range(start_index, total_images):
+            # Cooperative cancellation: stop scanning once the request is out of time
+            deadlines.check()
             try:
                 stored_phash = contract_instance.functions.getPerceptualHash(i).call()
                 distance = hamming_distance(new_phash, stored_phash)
@@ -254,7 +544,8 @@ def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10) -> di
                 if distance < min_distance:
                     min_distance = distance
                 
-                print(f"[BLOCKCHAIN]   Image {i}: distance={distance}")
+                if debug and sample(i):
+                    log.debug("scan progress", extra={"index": i, "distance": distance})
                 
                 if distance <= similarity_threshold:
                     # Found similar image - fetch full details
@@ -267,44 +558,59 @@ def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10) -> di
                         "timestamp": image_details[3],
                         "distance": distance
                     })
-                    print(f"[BLOCKCHAIN] SIMILAR IMAGE FOUND at index {i} (distance={distance})")
+                    log.info("similar image found", extra={"index": i, "distance": distance})
                     
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"[BLOCKCHAIN] Error checking image {i}: {e}")
+                log.warning("error checking image %s: %s", i, e)
                 continue
         
         result = {
             "is_duplicate": len(similar_images) > 0,
             "similar_images": similar_images,
-            "min_distance": min_distance if min_distance != float('inf') else None
+            "min_distance": min_distance if min_distance != float('inf') else None,
+            "registry_size": total_images
         }
         
-        if result["is_duplicate"]:
-            print(f"[BLOCKCHAIN] DUPLICATE DETECTED - Found {len(similar_images)} similar image(s)")
-        else:
-            print(f"[BLOCKCHAIN] Image is UNIQUE (min distance: {min_distance})")
+        result = _with_local(result, new_phash, similarity_threshold)
+        log.info("similarity check finished", extra={
+            "total": total_images, "scanned": total_images - start_index, "similar": len(similar_images), "min_distance": result["min_distance"]
+        })
         
         return result
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"[BLOCKCHAIN] Error in similarity check: {e}")
-        import traceback
-        traceback.print_exc()
+        deadlines.translate(e)
+        log.exception("similarity check failed: %s", e)
         raise
 
 
 
 
+def _with_local(result, new_phash, similarity_threshold):
+    # Merkle-batched images are only in the local leaf store, and uploads
+    # whose chain write is still running only in the reservation table.
+    import anchoring
+    import reservations
+    result = anchoring.add_local_matches(result, new_phash, similarity_threshold)
+    return reservations.add_reserved_matches(result, new_phash, similarity_threshold)
+
+
 def get_total_images():
     if not health_check():
         raise Exception("Blockchain not connected")
-    return contract_instance.functions.getImageCount().call()
+    total = get_contract().functions.getImageCount().call()
+    REGISTRY_SIZE.set(total)
+    return total
 
 
 def get_image_by_index(index):
     if not health_check():
         raise Exception("Blockchain not connected")
-    return contract_instance.functions.getImage(index).call()
+    return get_contract().functions.getImage(index).call()
 
 
 # ---------------------------
@@ -315,6 +621,8 @@ if __name__ == "__main__":
     print("BLOCKCHAIN CONNECTION TEST")
     print("="*60)
     
+    w3 = get_w3()
+    contract_instance = get_contract()
     if w3.is_connected():
         print("Connected to Ganache")
         print(f"RPC: {GANACHE_RPC}")
@@ -0,0 +1,167 @@
+"""
+AsyncWeb3 versions of the chain calls used by the upload routes, for the
+ASGI serving mode (asgi.py). Settings, ABI and the distance function are
+shared with blockchain.py.
+
+The similarity scan issues up to ASYNC_SCAN_CONCURRENCY getPerceptualHash
+calls at once instead of one round trip after another. Transaction sends go
+through blockchain.send_store_transaction on a worker thread, behind the same
+blockchain.send_lock as the upload workers and the batch anchorer, so every
+sender from the account gets its own nonce; the receipt is awaited here.
+"""
+import asyncio
+import logging
+import os
+
+import anchoring
+import blockchain
+import deadlines
+import services
+from blockchain import hamming_distance, RECEIPT_TIMEOUT
+from deadlines import DeadlineExceeded
+from logs import get_logger, sample
+from metrics import span, RPC_CALLS, REGISTRY_SIZE
+
+ASYNC_SCAN_CONCURRENCY = int(os.getenv("ASYNC_SCAN_CONCURRENCY", "32"))
+
+log = get_logger("blockchain")
+
+
+async def _create_async_web3():
+    import aiohttp
+    from web3 import AsyncWeb3, AsyncHTTPProvider
+    from http_pools import create_async_rpc_session, RPC_TIMEOUT
+
+    class CountingAsyncHTTPProvider(AsyncHTTPProvider):
+        """Counts calls, and sizes each call's timeout to the request deadline."""
+
+        def get_request_kwargs(self):
+            kwargs = dict(super().get_request_kwargs())
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=deadlines.timeout(RPC_TIMEOUT))
+            return kwargs
+
+        async def make_request(self, method, params):
+            deadlines.check()
+            RPC_CALLS.inc(method=method)
+            return await super().make_request(method, params)
+
+    provider = CountingAsyncHTTPProvider(blockchain.GANACHE_RPC)
+    await provider.cache_async_session(create_async_rpc_session())
+    return AsyncWeb3(provider)
+
+
+async def _create_async_contract():
+    w3 = await services.aget("async_web3")
+    return w3.eth.contract(address=blockchain.CONTRACT_ADDRESS, abi=blockchain.CONTRACT_ABI)
+
+
+services.register_async("async_web3", _create_async_web3)
+services.register_async("async_contract", _create_async_contract)
+
+
+async def get_async_w3():
+    return await services.aget("async_web3")
+
+
+async def get_async_contract():
+    return await services.aget("async_contract")
+
+
+async def health_check() -> bool:
+    """Async blockchain.health_check()."""
+    with span("chain_health"):
+        w3 = await get_async_w3()
+        if not await w3.is_connected():
+            deadlines.check()
+            return False
+        try:
+            code = await w3.eth.get_code(blockchain.CONTRACT_ADDRESS)
+        except Exception as e:
+            deadlines.check()
+            log.warning("health check failed: %s", e)
+            return False
+        if len(code) <= 2:
+            log.error("no contract deployed", extra={"contract": blockchain.CONTRACT_ADDRESS})
+            return False
+        return True
+
+
+async def is_similar_to_existing(new_phash: str, similarity_threshold: int = 10, start_index: int = 0) -> dict:
+    """Async blockchain.is_similar_to_existing(); same arguments and result shape."""
+    with span("chain_scan"):
+        contract = await get_async_contract()
+        total_images = await contract.functions.getImageCount().call()
+        REGISTRY_SIZE.set(total_images)
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        async def distance_at(i):
+            try:
+                stored_phash = await contract.functions.getPerceptualHash(i).call()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                log.warning("error checking image %s: %s", i, e)
+                return None
+            return hamming_distance(new_phash, stored_phash)
+
+        similar_indexes = []
+        min_distance = float('inf')
+        # Bounded batches keep at most ASYNC_SCAN_CONCURRENCY calls in flight
+        # and avoid creating one task per image on large registries.
+        for start in range(start_index, total_images, ASYNC_SCAN_CONCURRENCY):
+            deadlines.check()
+            indexes = range(start, min(start + ASYNC_SCAN_CONCURRENCY, total_images))
+            distances = await asyncio.gather(*(distance_at(i) for i in indexes))
+            for i, distance in zip(indexes, distances):
+                if distance is None:
+                    continue
+                min_distance = min(min_distance, distance)
+                if debug and sample(i):
+                    log.debug("scan progress", extra={"index": i, "distance": distance})
+                if distance <= similarity_threshold:
+                    similar_indexes.append((i, distance))
+
+        similar_images = []
+        for i, distance in similar_indexes:
+            details = await contract.functions.getImage(i).call()
+            similar_images.append({
+                "index": i,
+                "shaHash": details[0],
+                "perceptualHash": details[1],
+                "uploader": details[2],
+                "timestamp": details[3],
+                "distance": distance
+            })
+
+        result = {
+            "is_duplicate": len(similar_images) > 0,
+            "similar_images": similar_images,
+            "min_distance": min_distance if min_distance != float('inf') else None,
+            "registry_size": total_images
+        }
+        result = await asyncio.to_thread(blockchain._with_local, result, new_phash, similarity_threshold)
+        log.info("similarity check finished", extra={
+            "total": total_images, "scanned": max(0, total_images - start_index), "similar": len(similar_images), "min_distance": result["min_distance"]
+        })
+        return result
+
+
+async def store_image_on_chain(sha_hash, perceptual_hash) -> dict:
+    """Async blockchain.store_image_on_chain(); awaits the receipt without holding a thread."""
+    if anchoring.batching():
+        return await asyncio.to_thread(anchoring.get_anchorer().submit, sha_hash, perceptual_hash)
+
+    with span("chain_store"):
+        w3 = await get_async_w3()
+        tx_hash = await asyncio.to_thread(blockchain.send_store_transaction, sha_hash, perceptual_hash)
+
+        # Sent, so awaited in full rather than within the request deadline
+        # (see blockchain.store_image_on_chain)
+        with deadlines.lifted():
+            receipt = await w3.eth.wait_for_transaction_receipt(tx_hash, timeout=RECEIPT_TIMEOUT)
+        log.info("transaction confirmed", extra={"tx": tx_hash.hex(), "gas_used": receipt.gasUsed})
+        return {
+            "txHash": tx_hash.hex(),
+            "status": receipt.status,
+            "gasUsed": receipt.gasUsed
+        }
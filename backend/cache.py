@@ -0,0 +1,174 @@
+"""
+Small read-through caches for hot, rarely changing reads.
+
+Entries live in a per-process LRU with a TTL. Each key also has a version
+number; writers bump it to invalidate. Versions are kept in-process by
+default, or in a SQLite file shared by every worker on the host
+(CACHE_SHARED_DB), so a write in one worker invalidates the others.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import services
+
+CACHE_SHARED_DB = os.getenv("CACHE_SHARED_DB", "")
+COMMENTS_CACHE_TTL = float(os.getenv("COMMENTS_CACHE_TTL", "30"))
+COMMENTS_CACHE_SIZE = int(os.getenv("COMMENTS_CACHE_SIZE", "1024"))
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalVersions:
+    """Per-key version counters visible to this process only."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> int:
+        return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+
+class SharedVersions:
+    """Per-key version counters in a SQLite file shared by all local workers."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM cache_versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, key):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cache_versions (key, version) VALUES (?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1",
+                (key,)
+            )
+
+
+def make_etag(value) -> str:
+    """Strong ETag over the JSON serialization of `value`."""
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+
+class ReadThroughCache:
+    """
+    get(key, loader) returns (value, etag), calling loader() only on a miss,
+    an expired entry, or after invalidate(key) bumped the key's version.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float, versions=None):
+        self.namespace = namespace
+        self._entries = TTLCache(maxsize, ttl)
+        self._versions = versions or LocalVersions()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key, loader):
+        key, version, cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        return self._store(key, version, loader())
+
+    async def aget(self, key, loader):
+        """get() with a coroutine function as the loader."""
+        key, version, cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        return self._store(key, version, await loader())
+
+    def _lookup(self, key):
+        key = self._key(key)
+        version = self._versions.get(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return key, version, (entry[1], entry[2])
+        self.misses += 1
+        return key, version, None
+
+    def _store(self, key, version, value):
+        etag = make_etag(value)
+        # Stored under the version read before loading: a write that lands
+        # while we load bumps the version, so this entry is never served.
+        self._entries.set(key, (version, value, etag))
+        return value, etag
+
+    def invalidate(self, key):
+        key = self._key(key)
+        self._versions.bump(key)
+        self._entries.delete(key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def _create_comment_cache():
+    versions = SharedVersions(CACHE_SHARED_DB) if CACHE_SHARED_DB else LocalVersions()
+    return ReadThroughCache("comments", COMMENTS_CACHE_SIZE, COMMENTS_CACHE_TTL, versions)
+
+
+services.register("comment_cache", _create_comment_cache)
+
+
+def get_comment_cache() -> ReadThroughCache:
+    return services.get("comment_cache")
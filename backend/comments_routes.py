@@ -2,13 +2,20 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import traceback
 
-try:
-    from supabaseClient import supabase
-except Exception as e:
-    supabase = None
-    print("Warning: supabase client not available in comments_routes:", e)
+from supabaseClient import get_supabase
+from cache import get_comment_cache
 
 comments_bp = Blueprint("comments_bp", __name__)
+
+
+class SupabaseError(Exception):
+    """Error payload returned (not raised) by the Supabase client."""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
 def _extract_supabase_result(resp):
     """
     Normalize various supabase-py return shapes.
@@ -42,6 +49,7 @@ def _extract_supabase_result(resp):
 @comments_bp.route("/comments", methods=["POST"])
 @jwt_required()
 def add_comment():
+    supabase = get_supabase()
     if supabase is None:
         return jsonify({"error": "Supabase client not configured"}), 500
 
@@ -92,12 +100,14 @@ def add_comment():
         created = data
 
     current_app.logger.debug("Inserted comment row: %r", created)
+    get_comment_cache().invalidate(post_id_val)
 
     return jsonify({"status": "ok", "comment": created})
 
 
 @comments_bp.route("/comments", methods=["GET"])
 def get_comments():
+    supabase = get_supabase()
     if supabase is None:
         return jsonify({"error": "Supabase client not configured"}), 500
 
@@ -112,7 +122,7 @@ def get_comments():
 
     current_app.logger.debug("get_comments: post_id param=%r normalized=%r", post_id, pid_val)
 
-    try:
+    def load_comments():
         resp = (
             supabase.table("comments")
             .select("*")
@@ -120,15 +130,25 @@ def get_comments():
             .order("created_at")
             .execute()
         )
+        data, error = _extract_supabase_result(resp)
+        if error:
+            raise SupabaseError(error)
+        return data or []
+
+    try:
+        comments, etag = get_comment_cache().get(pid_val, load_comments)
+    except SupabaseError as e:
+        current_app.logger.error("Supabase returned error on select: %s", e.error)
+        return jsonify({"error": e.error}), 500
     except Exception as e:
         current_app.logger.error("Supabase select exception: %s", traceback.format_exc())
         return jsonify({"error": "Supabase select failed", "detail": str(e)}), 500
 
-    data, error = _extract_supabase_result(resp)
-    if error:
-        current_app.logger.error("Supabase returned error on select: %s", error)
-        return jsonify({"error": error}), 500
-
-    comments = data or []
-    return jsonify({"comments": comments})
+    # make_etag() values are quoted; werkzeug keeps the If-None-Match tags unquoted
+    if request.if_none_match.contains_raw(etag):
+        return "", 304, {"ETag": etag}
 
+    resp = jsonify({"comments": comments})
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
@@ -0,0 +1,91 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+// Registry of image hashes; matches CONTRACT_ABI in blockchain.py.
+contract ImageRegistry {
+    struct Image {
+        string shaHash;
+        string perceptualHash;
+        address uploader;
+        uint256 timestamp;
+    }
+
+    // A Merkle root covering many images, anchored in one transaction.
+    // Leaves are keccak256(abi.encodePacked(shaHash, perceptualHash, uploader));
+    // interior nodes hash their two children in sorted order.
+    struct Batch {
+        bytes32 root;
+        uint256 count;
+        address submitter;
+        uint256 timestamp;
+    }
+
+    address public owner;
+    // Accounts besides the owner allowed to anchor batches (e.g. a backfill sender)
+    mapping(address => bool) public anchorers;
+    Image[] private images;
+    Batch[] private batches;
+
+    event BatchAnchored(uint256 indexed index, bytes32 root, uint256 count);
+
+    // Only roots anchored by this server's accounts make verifyLeaf() meaningful
+    modifier onlyAnchorer() {
+        require(msg.sender == owner || anchorers[msg.sender], "Not an anchorer");
+        _;
+    }
+
+    constructor() {
+        owner = msg.sender;
+    }
+
+    function setAnchorer(address _account, bool _allowed) public {
+        require(msg.sender == owner, "Not the owner");
+        anchorers[_account] = _allowed;
+    }
+
+    function storeImageHash(string memory _shaHash, string memory _perceptualHash, address _uploader) public {
+        images.push(Image(_shaHash, _perceptualHash, _uploader, block.timestamp));
+    }
+
+    function getImageCount() public view returns (uint256) {
+        return images.length;
+    }
+
+    function getPerceptualHash(uint256 index) public view returns (string memory) {
+        require(index < images.length, "Index out of bounds");
+        return images[index].perceptualHash;
+    }
+
+    function anchorBatch(bytes32 _root, uint256 _count) public onlyAnchorer returns (uint256) {
+        batches.push(Batch(_root, _count, msg.sender, block.timestamp));
+        emit BatchAnchored(batches.length - 1, _root, _count);
+        return batches.length - 1;
+    }
+
+    function getBatchCount() public view returns (uint256) {
+        return batches.length;
+    }
+
+    function getBatch(uint256 index) public view returns (bytes32, uint256, address, uint256) {
+        require(index < batches.length, "Index out of bounds");
+        Batch storage b = batches[index];
+        return (b.root, b.count, b.submitter, b.timestamp);
+    }
+
+    function verifyLeaf(uint256 index, bytes32 leaf, bytes32[] calldata proof) public view returns (bool) {
+        require(index < batches.length, "Index out of bounds");
+        bytes32 node = leaf;
+        for (uint256 i = 0; i < proof.length; i++) {
+            node = node < proof[i]
+                ? keccak256(abi.encodePacked(node, proof[i]))
+                : keccak256(abi.encodePacked(proof[i], node));
+        }
+        return node == batches[index].root;
+    }
+
+    function getImage(uint256 index) public view returns (string memory, string memory, address, uint256) {
+        require(index < images.length, "Index out of bounds");
+        Image storage img = images[index];
+        return (img.shaHash, img.perceptualHash, img.uploader, img.timestamp);
+    }
+}
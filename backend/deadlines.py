@@ -0,0 +1,106 @@
+"""
+Per-request deadlines.
+
+A route opens a budget with `with deadline(seconds):`; everything it calls
+on the same thread (or asyncio task) sees it through current(). The chain
+providers size each RPC timeout to the time left and refuse to send once it
+is spent, and long loops call check() between items, so a request that runs
+out of time stops using RPC capacity instead of finishing in the background.
+
+    CHECK_DUPLICATE_DEADLINE  seconds for /check-duplicate (default 10)
+    UPLOAD_DEADLINE           seconds for /upload (default 60)
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+CHECK_DUPLICATE_DEADLINE = float(os.getenv("CHECK_DUPLICATE_DEADLINE", "10"))
+UPLOAD_DEADLINE = float(os.getenv("UPLOAD_DEADLINE", "60"))
+
+_current = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.seconds:g}s exceeded")
+
+    def timeout(self, default: float) -> float:
+        """`default` capped at the remaining budget; raises if none is left."""
+        self.check()
+        return min(default, self.remaining())
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Run the block under a deadline `seconds` from now (or the enclosing one, if sooner)."""
+    outer = _current.get()
+    new = Deadline(seconds)
+    if outer is not None and outer.expires_at < new.expires_at:
+        new = outer
+    token = _current.set(new)
+    try:
+        yield new
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def lifted():
+    """
+    Run the block with no deadline, for work that must not be abandoned
+    once started (waiting for the receipt of a transaction already sent).
+    """
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """The active Deadline, or None."""
+    return _current.get()
+
+
+def check():
+    """Raise DeadlineExceeded if the active deadline has passed."""
+    active = _current.get()
+    if active is not None:
+        active.check()
+
+
+def timeout(default: float) -> float:
+    """Timeout for one blocking call: `default`, capped at the active deadline."""
+    active = _current.get()
+    return default if active is None else active.timeout(default)
+
+
+def expired() -> bool:
+    active = _current.get()
+    return active is not None and active.expired()
+
+
+def translate(exc: Exception):
+    """
+    Raise DeadlineExceeded from `exc` if the deadline has passed, so a
+    client-library timeout (requests, aiohttp, web3's TimeExhausted) caused
+    by the shrunken budget surfaces as a deadline rather than a failure.
+    """
+    if expired() and not isinstance(exc, DeadlineExceeded):
+        raise DeadlineExceeded(str(exc)) from exc
@@ -0,0 +1,118 @@
+"""
+Display-only previews of stego images.
+
+Previews are size-bucketed WebP (or JPEG, per PREVIEW_FORMAT) renders stored
+under previews/<sha256>/<size>.<ext>, keyed by the SHA-256 of the stego
+original, so identical inputs are never rendered twice. The lossless
+original is left untouched for verification.
+
+Only rows whose `previews` column is true advertise them; it is set when a
+post's previews were stored, so older posts and posts whose render failed
+show the original instead of a missing preview. The column is added by
+migrations/001_stego_uploads_previews.sql, which must be applied first.
+"""
+import os
+from io import BytesIO
+
+from cache import TTLCache
+from supabaseClient import get_supabase, build_public_url
+
+PREVIEW_BUCKET = os.getenv("PREVIEW_BUCKET", "image")
+PREVIEW_SIZES = tuple(int(s) for s in os.getenv("PREVIEW_SIZES", "320,640").split(","))
+# Size the feed shows by default (cards are 500px wide)
+PREVIEW_DEFAULT_SIZE = int(os.getenv("PREVIEW_DEFAULT_SIZE", "640"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "webp").lower()
+
+# Pillow format name, file extension and content type per PREVIEW_FORMAT
+_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+# Hashes whose previews are known to be in storage
+_known = TTLCache(maxsize=int(os.getenv("PREVIEW_KNOWN_CACHE", "10000")), ttl=3600)
+
+
+def preview_path(sha256: str, size: int) -> str:
+    return f"previews/{sha256}/{size}.{_FORMATS[PREVIEW_FORMAT][1]}"
+
+
+def preview_urls(sha256: str) -> dict:
+    """Public URLs of every preview size for an image hash."""
+    return {
+        str(size): build_public_url(PREVIEW_BUCKET, preview_path(sha256, size))
+        for size in PREVIEW_SIZES
+    }
+
+
+def add_preview_urls(rows):
+    """Attach "preview_url" (default size) and "preview_urls" to listing rows whose previews were stored."""
+    for row in rows:
+        sha256 = row.get("hash")
+        if not sha256 or not row.get("previews"):
+            continue
+        urls = preview_urls(sha256)
+        row["preview_urls"] = urls
+        row["preview_url"] = urls.get(str(PREVIEW_DEFAULT_SIZE)) or next(iter(urls.values()))
+    return rows
+
+
+def render_previews(source, sizes=PREVIEW_SIZES) -> dict:
+    """
+    Render {size: encoded bytes} from PNG bytes or a file path. Each size is
+    the longest edge; images already smaller are not upscaled.
+    """
+    from PIL import Image
+
+    fmt = _FORMATS[PREVIEW_FORMAT][0]
+    image = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    image.load()
+    keep_alpha = fmt == "WEBP" and "A" in image.getbands()
+    if image.mode != ("RGBA" if keep_alpha else "RGB"):
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+
+    results = {}
+    for size in sorted(sizes, reverse=True):
+        # Shrink from the previous (larger) render: cheaper than from the original.
+        image.thumbnail((size, size), Image.LANCZOS)
+        buf = BytesIO()
+        image.save(buf, format=fmt, quality=PREVIEW_QUALITY)
+        results[size] = buf.getvalue()
+    return results
+
+
+def _already_stored(bucket, sha256: str) -> bool:
+    if _known.get(sha256):
+        return True
+    try:
+        names = {item.get("name") for item in bucket.list(f"previews/{sha256}") or []}
+    except Exception:
+        return False
+    if all(preview_path(sha256, size).rsplit("/", 1)[1] in names for size in PREVIEW_SIZES):
+        _known.set(sha256, True)
+        return True
+    return False
+
+
+def ensure_previews(sha256: str, source) -> dict:
+    """
+    Render and upload previews for an image unless they already exist.
+    Returns {size: public URL}.
+    """
+    supabase = get_supabase()
+    if supabase is None:
+        raise Exception("Supabase client is not initialized.")
+
+    bucket = supabase.storage.from_(PREVIEW_BUCKET)
+    if not _already_stored(bucket, sha256):
+        content_type = _FORMATS[PREVIEW_FORMAT][2]
+        for size, data in render_previews(source).items():
+            bucket.upload(
+                path=preview_path(sha256, size),
+                file=data,
+                file_options={"content-type": content_type, "upsert": "true"}
+            )
+        _known.set(sha256, True)
+
+    return preview_urls(sha256)
@@ -0,0 +1,73 @@
+import csv
+import json
+import os
+
+from logs import get_logger
+
+# Source dataset and the compiled lexicon built from it.
+EMOJI_CSV_PATH = os.getenv("EMOJI_CSV_PATH", "Datasets/Emoji_trimmed.csv")
+EMOJI_LEXICON_PATH = os.getenv("EMOJI_LEXICON_PATH", "Datasets/Emoji_lexicon.json")
+
+_emoji_scores = None
+
+log = get_logger("emoji")
+
+
+def _read_csv_scores(csv_path: str) -> dict:
+    """Parse the emoji CSV into {emoji: Positive - Negative} using the stdlib csv module."""
+    scores = {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            emoji = row.get("Emoji")
+            if not emoji:
+                continue
+            try:
+                scores[emoji] = float(row["Positive"]) - float(row["Negative"])
+            except (KeyError, TypeError, ValueError):
+                continue
+    return scores
+
+
+def compile_lexicon(csv_path: str = EMOJI_CSV_PATH, out_path: str = EMOJI_LEXICON_PATH) -> int:
+    """
+    Build step: compile the emoji CSV into a compact JSON lexicon.
+    Returns the number of entries written.
+    """
+    scores = _read_csv_scores(csv_path)
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(scores, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, out_path)
+    return len(scores)
+
+
+def load_emoji_scores(lexicon_path: str = EMOJI_LEXICON_PATH, csv_path: str = EMOJI_CSV_PATH) -> dict:
+    """
+    Load {emoji: score} from the compiled lexicon, falling back to the CSV.
+    The result is cached per process, so every caller shares one dict.
+    """
+    global _emoji_scores
+    if _emoji_scores is not None:
+        return _emoji_scores
+
+    scores = {}
+    try:
+        with open(lexicon_path, encoding="utf-8") as f:
+            scores = json.load(f)
+    except Exception as e:
+        log.warning("compiled lexicon not loaded (%s), falling back to CSV", e)
+        try:
+            scores = _read_csv_scores(csv_path)
+        except Exception as e:
+            log.error("emoji dataset not loaded: %s", e)
+
+    _emoji_scores = scores
+    return _emoji_scores
+
+
+if __name__ == "__main__":
+    count = compile_lexicon()
+    print(f"Compiled {count} emoji scores from {EMOJI_CSV_PATH} -> {EMOJI_LEXICON_PATH}")
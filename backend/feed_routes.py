@@ -0,0 +1,154 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+import os
+import time
+import traceback
+
+from supabaseClient import get_supabase
+from pagination import parse_page_args, fetch_page
+from derivatives import add_preview_urls
+from logs import get_logger
+
+feed_bp = Blueprint("feed_bp", __name__)
+log = get_logger("feed")
+
+# Comments attached to each post in a feed page
+FEED_COMMENTS_DEFAULT = int(os.getenv("FEED_COMMENTS_DEFAULT", "3"))
+FEED_COMMENTS_MAX = int(os.getenv("FEED_COMMENTS_MAX", "20"))
+COMMENT_COLUMNS = ("id", "post_id", "username", "avatar_url", "text", "created_at")
+
+
+# First `per_post` comments of each post plus its total, computed in Postgres
+# (migrations/002_feed_comments.sql). Posts without returned comments come
+# back as one row with a null id that only carries comment_count.
+FEED_COMMENTS_RPC = "feed_comments"
+# Seconds to use the fallback query before trying the RPC again once it
+# turned out not to be installed
+FEED_RPC_RECHECK = float(os.getenv("FEED_RPC_RECHECK", "300"))
+
+_rpc_missing_until = 0.0
+
+
+def _rpc_available() -> bool:
+    return time.time() >= _rpc_missing_until
+
+
+def _rpc_missing(error) -> bool:
+    """Whether PostgREST rejected the call because the function does not exist."""
+    global _rpc_missing_until
+    if getattr(error, "code", None) != "PGRST202":
+        return False
+    log.warning("%s() not installed, using the unbounded comments query", FEED_COMMENTS_RPC)
+    _rpc_missing_until = time.time() + FEED_RPC_RECHECK
+    return True
+
+
+def attach_comments(supabase, posts, per_post: int):
+    """
+    Add "comments" (first `per_post`, oldest first) and "comment_count" to each
+    post, using a single feed_comments() call for the whole page (or the
+    fallback query if the function is not installed).
+    """
+    if not posts:
+        return posts
+    resp = None
+    if _rpc_available():
+        try:
+            resp = comments_query(supabase, posts, per_post).execute()
+        except Exception as e:
+            if not _rpc_missing(e):
+                raise
+    if resp is None:
+        resp = fallback_comments_query(supabase, posts).execute()
+    return merge_comments(posts, getattr(resp, "data", None) or [], per_post)
+
+
+async def aattach_comments(supabase, posts, per_post: int):
+    """attach_comments() for the async Supabase client."""
+    if not posts:
+        return posts
+    resp = None
+    if _rpc_available():
+        try:
+            resp = await comments_query(supabase, posts, per_post).execute()
+        except Exception as e:
+            if not _rpc_missing(e):
+                raise
+    if resp is None:
+        resp = await fallback_comments_query(supabase, posts).execute()
+    return merge_comments(posts, getattr(resp, "data", None) or [], per_post)
+
+
+def comments_query(supabase, posts, per_post: int):
+    """The feed_comments() call for the posts in `posts` (not yet executed)."""
+    return supabase.rpc(
+        FEED_COMMENTS_RPC,
+        {"post_ids": [post["id"] for post in posts], "per_post": per_post},
+    )
+
+
+def fallback_comments_query(supabase, posts):
+    """
+    Every comment of the posts in `posts`, oldest first, in one in_() select
+    (not yet executed). Unbounded, and subject to PostgREST's max-rows cap,
+    so counts from it can fall short on busy posts.
+    """
+    return (
+        supabase.table("comments")
+        .select(",".join(COMMENT_COLUMNS))
+        .in_("post_id", [post["id"] for post in posts])
+        .order("created_at")
+    )
+
+
+def merge_comments(posts, rows, per_post: int):
+    """
+    Distribute comment rows onto their posts as "comments" and
+    "comment_count". feed_comments() rows carry the count; plain comment
+    rows (the fallback) are counted.
+    """
+    by_id = {post["id"]: post for post in posts}
+    for post in posts:
+        post["comments"] = []
+        post["comment_count"] = 0
+    for row in rows:
+        post = by_id.get(row.get("post_id"))
+        if post is None:
+            continue
+        if "comment_count" in row:
+            post["comment_count"] = row["comment_count"] or 0
+        else:
+            post["comment_count"] += 1
+        if row.get("id") is not None and len(post["comments"]) < per_post:
+            post["comments"].append({column: row.get(column) for column in COMMENT_COLUMNS})
+    return posts
+
+
+@feed_bp.route("/feed", methods=["GET"])
+@jwt_required()
+def get_feed():
+    """
+    One feed page with comments attached: two database round trips however
+    many posts are on the page. Accepts the GET /upload paging params plus
+    comments=<K> (first K comments per post).
+    """
+    supabase = get_supabase()
+    if supabase is None:
+        return jsonify({"error": "Supabase not configured"}), 500
+
+    try:
+        limit, cursor, columns = parse_page_args(request.args)
+        per_post = int(request.args.get("comments", FEED_COMMENTS_DEFAULT))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    per_post = max(0, min(per_post, FEED_COMMENTS_MAX))
+
+    try:
+        posts, next_cursor = fetch_page(supabase, "stego_uploads", columns, limit, cursor)
+        attach_comments(supabase, posts, per_post)
+        add_preview_urls(posts)
+    except Exception as e:
+        current_app.logger.error("Feed fetch failed: %s", traceback.format_exc())
+        return jsonify({"error": "Supabase fetch failed", "detail": str(e)}), 500
+
+    return jsonify({"posts": posts, "next_cursor": next_cursor}), 200
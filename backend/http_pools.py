@@ -0,0 +1,174 @@
+"""
+Connection-pool configuration for the outbound HTTP clients.
+
+The Web3 provider gets a requests.Session with a bounded keep-alive pool,
+per-call timeouts and connect retries; the Supabase postgrest and storage
+sub-clients share an httpx client built on a pooled transport with the same
+treatment, handed to supabase through ClientOptions(httpx_client=...). All
+of them are thread-safe, so request threads and the background upload workers share
+one pool per client instead of churning connections. The async serving mode
+(asgi.py) gets the same limits on an aiohttp session and async httpx
+transports. pool_stats() reports utilization.
+"""
+import os
+import threading
+
+from metrics import Gauge
+
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "16"))
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+RPC_RETRIES = int(os.getenv("RPC_RETRIES", "2"))
+
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_KEEPALIVE = int(os.getenv("SUPABASE_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "20"))
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", "2"))
+
+_lock = threading.Lock()
+_rpc_adapters = []
+_supabase_transports = []
+
+
+def create_rpc_session(pool_size: int = RPC_POOL_SIZE, retries: int = RPC_RETRIES):
+    """
+    requests.Session for the JSON-RPC endpoint. Only connection failures are
+    retried (the request never reached the node, so even a transaction send
+    is safe to repeat); pool_block makes callers wait for a free connection
+    instead of opening extra ones.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.2),
+        pool_block=True,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with _lock:
+        _rpc_adapters.append((pool_size, adapter))
+    return session
+
+
+def create_async_rpc_session(pool_size: int = RPC_POOL_SIZE):
+    """aiohttp session for AsyncHTTPProvider, capped at pool_size connections."""
+    import aiohttp
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT),
+    )
+
+
+def create_supabase_transport():
+    """httpx transport with a bounded keep-alive pool and connect retries."""
+    import httpx
+
+    transport = httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+        retries=SUPABASE_RETRIES,
+    )
+    with _lock:
+        _supabase_transports.append(transport)
+    return transport
+
+
+def create_async_supabase_transport():
+    """Async counterpart of create_supabase_transport()."""
+    import httpx
+
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+        retries=SUPABASE_RETRIES,
+    )
+    with _lock:
+        _supabase_transports.append(transport)
+    return transport
+
+
+def create_supabase_http_client():
+    """
+    httpx client for ClientOptions(httpx_client=...). The pooled transport is
+    passed when the client is built, so httpx owns and closes it; proxies then
+    come from the transport, not the environment. supabase sets the base URL
+    and headers on it.
+    """
+    import httpx
+
+    return httpx.Client(transport=create_supabase_transport(), timeout=SUPABASE_TIMEOUT)
+
+
+def create_async_supabase_http_client():
+    """Async counterpart of create_supabase_http_client()."""
+    import httpx
+
+    return httpx.AsyncClient(transport=create_async_supabase_transport(), timeout=SUPABASE_TIMEOUT)
+
+
+def _rpc_pool_stats():
+    stats = {"max_size": 0, "in_use": 0, "requests": 0, "connections_opened": 0}
+    with _lock:
+        adapters = list(_rpc_adapters)
+    for pool_size, adapter in adapters:
+        for pool in list(adapter.poolmanager.pools._container.values()):
+            # The LIFO queue holds idle connections plus placeholder slots.
+            stats["max_size"] += pool_size
+            stats["in_use"] += max(0, pool_size - pool.pool.qsize())
+            stats["requests"] += pool.num_requests
+            stats["connections_opened"] += pool.num_connections
+    return stats
+
+
+def _supabase_pool_stats():
+    with _lock:
+        transports = list(_supabase_transports)
+    stats = {"max_size": SUPABASE_POOL_SIZE * len(transports), "in_use": 0, "idle": 0}
+    for transport in transports:
+        try:
+            connections = transport._pool.connections
+        except AttributeError:
+            continue
+        for conn in connections:
+            if conn.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["in_use"] += 1
+    return stats
+
+
+def pool_stats() -> dict:
+    """Current utilization of the outbound connection pools."""
+    result = {}
+    for name, collect in (("rpc", _rpc_pool_stats), ("supabase", _supabase_pool_stats)):
+        try:
+            result[name] = collect()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
+
+
+def _pool_gauge_values():
+    values = {}
+    for pool, stats in pool_stats().items():
+        for state in ("in_use", "idle", "max_size"):
+            if state in stats:
+                values[(pool, state)] = stats[state]
+    return values
+
+
+POOL_CONNECTIONS = Gauge(
+    "trifecta_pool_connections", "Outbound connection-pool usage.", ("pool", "state"), callback=_pool_gauge_values
+)
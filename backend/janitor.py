@@ -0,0 +1,178 @@
+"""
+Age and quota limits for the uploads folder.
+
+Request images are spooled (stego_utils.spool_upload) and upload jobs
+delete their stego copies, so little should be left in UPLOAD_FOLDER. What
+is left, such as STEGO_LOCAL_RETENTION=keep copies, jobs killed and never
+resumed, or files from older versions, is swept by a background thread
+every UPLOAD_JANITOR_INTERVAL seconds (started by services.warm_up() or
+with the upload executor):
+
+    UPLOAD_MAX_AGE        files older than this many seconds are removed
+    UPLOAD_QUOTA_BYTES    past this total, oldest files are removed first
+    UPLOAD_JANITOR_GRACE  files younger than this are never touched
+
+Either limit is off at 0. Files of queued, running or retrying upload jobs are
+never removed; a resumed job needs them.
+"""
+import os
+import shutil
+import threading
+import time
+
+import services
+from job_store import JobStore, UPLOAD_JOB_DB
+from logs import get_logger
+from metrics import Counter, Gauge
+from stego_utils import UPLOAD_FOLDER
+
+log = get_logger("janitor")
+
+UPLOAD_JANITOR_ENABLED = os.getenv("UPLOAD_JANITOR_ENABLED", "1") == "1"
+UPLOAD_JANITOR_INTERVAL = float(os.getenv("UPLOAD_JANITOR_INTERVAL", "300"))
+UPLOAD_MAX_AGE = float(os.getenv("UPLOAD_MAX_AGE", str(24 * 3600)))
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_BYTES", str(1024 ** 3)))
+UPLOAD_JANITOR_GRACE = float(os.getenv("UPLOAD_JANITOR_GRACE", "600"))
+
+UPLOAD_DIR_BYTES = Gauge("trifecta_upload_dir_bytes", "Bytes in the uploads folder after the last sweep.")
+UPLOAD_DIR_FILES = Gauge("trifecta_upload_dir_files", "Files in the uploads folder after the last sweep.")
+REMOVED_FILES = Counter(
+    "trifecta_upload_janitor_removed_total", "Files removed from the uploads folder.", ("reason",)
+)
+REMOVED_BYTES = Counter(
+    "trifecta_upload_janitor_removed_bytes_total", "Bytes removed from the uploads folder.", ("reason",)
+)
+
+
+def _free_bytes():
+    return {(): shutil.disk_usage(UPLOAD_FOLDER).free}
+
+
+UPLOAD_FS_FREE = Gauge(
+    "trifecta_upload_fs_free_bytes", "Free space on the filesystem holding the uploads folder.",
+    callback=_free_bytes
+)
+
+
+def _in_use() -> set:
+    """Stego files of queued, running or retrying upload jobs (shared job store, so every worker's)."""
+    executor = services.peek("upload_executor")
+    if executor is not None:
+        jobs = executor.store.unfinished()
+    elif os.path.exists(UPLOAD_JOB_DB):
+        # Not built yet in this process; jobs left to resume still need their files
+        store = JobStore()
+        try:
+            jobs = store.unfinished()
+        finally:
+            store.close()
+    else:
+        return set()
+    return {
+        os.path.abspath(job["payload"]["output_path"])
+        for job in jobs
+        if job["payload"].get("output_path")
+    }
+
+
+class UploadJanitor:
+    """Sweeps a folder down to its age and size limits from a background thread."""
+
+    def __init__(self, folder: str = UPLOAD_FOLDER, max_age: float = UPLOAD_MAX_AGE,
+                 quota: int = UPLOAD_QUOTA_BYTES, grace: float = UPLOAD_JANITOR_GRACE,
+                 interval: float = UPLOAD_JANITOR_INTERVAL):
+        self.folder = folder
+        self.max_age = max_age
+        self.quota = quota
+        self.grace = grace
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="upload-janitor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                log.warning("uploads sweep failed: %s", e)
+            self._stop.wait(self.interval)
+
+    def sweep(self) -> dict:
+        """One pass over the folder. Returns the totals left and what was removed."""
+        now = time.time()
+        in_use = _in_use()
+        files = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    files.append((st.st_mtime, st.st_size, os.path.abspath(entry.path)))
+        files.sort()  # oldest first
+
+        removed = {"age": 0, "quota": 0}
+        total = sum(size for _, size, _ in files)
+        kept = []
+        for mtime, size, path in files:
+            removable = path not in in_use and now - mtime >= self.grace
+            if removable and self.max_age and now - mtime > self.max_age and self._remove(path, size, "age"):
+                total -= size
+                removed["age"] += 1
+            else:
+                kept.append((mtime, size, path, removable))
+
+        remaining = len(kept)
+        if self.quota and total > self.quota:
+            for mtime, size, path, removable in kept:
+                if total <= self.quota:
+                    break
+                if removable and self._remove(path, size, "quota"):
+                    total -= size
+                    removed["quota"] += 1
+                    remaining -= 1
+            if total > self.quota:
+                log.warning("uploads folder over quota with nothing removable", extra={
+                    "bytes": total, "quota": self.quota
+                })
+
+        UPLOAD_DIR_BYTES.set(total)
+        UPLOAD_DIR_FILES.set(remaining)
+        if removed["age"] or removed["quota"]:
+            log.info("uploads swept", extra={
+                "removed_age": removed["age"], "removed_quota": removed["quota"], "bytes": total, "files": remaining
+            })
+        return {"files": remaining, "bytes": total, "removed": removed}
+
+    def _remove(self, path: str, size: int, reason: str) -> bool:
+        """Whether the file is gone (removed here or by someone else)."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            log.warning("could not remove %s: %s", path, e)
+            return False
+        REMOVED_FILES.inc(reason=reason)
+        REMOVED_BYTES.inc(size, reason=reason)
+        return True
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+def _create_janitor():
+    return UploadJanitor().start()
+
+
+# Registered only when enabled, like the anchor batcher. Started by
+# services.warm_up() or together with the upload executor, never at import.
+if UPLOAD_JANITOR_ENABLED:
+    services.register("upload_janitor", _create_janitor)
+
+
+def get_janitor() -> UploadJanitor:
+    return services.get("upload_janitor")
@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# SQLite file backing the upload job queue
+UPLOAD_JOB_DB = os.getenv("UPLOAD_JOB_DB", "upload_jobs.db")
+# Seconds a process holds the jobs it runs without renewing them (renew_leases)
+UPLOAD_JOB_LEASE = float(os.getenv("UPLOAD_JOB_LEASE", "60"))
+
+# A job that failed past a point of no return (e.g. its hashes are already on
+# chain) is parked as "retrying" and re-queued later instead of failing
+RETRY_STATUS = "retrying"
+UNFINISHED_STATUSES = ("queued", "running", RETRY_STATUS)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    owner       TEXT,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    payload     TEXT NOT NULL,
+    stages_done TEXT NOT NULL DEFAULT '{}',
+    result      TEXT,
+    lease_pid   INTEGER,
+    lease_until REAL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs (status, created_at);
+"""
+
+_JSON_COLUMNS = ("payload", "stages_done", "result")
+
+
+def pid_alive(pid) -> bool:
+    """Whether a process with this id exists on the host."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Durable record of background jobs and the pipeline stages they completed.
+
+    Every state change is committed before the worker moves on, so after a
+    crash the unfinished jobs can be reloaded and resumed from the first
+    stage that has no recorded output.
+
+    The file is shared by every worker process on the host, so each job is
+    leased to the process running it (lease_pid, lease_until). Only jobs
+    whose process is gone or whose lease has run out can be claimed by
+    another one.
+    """
+
+    def __init__(self, path: str = UPLOAD_JOB_DB, lease: float = UPLOAD_JOB_LEASE):
+        self.lease = lease
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across process crashes in WAL mode (only an OS
+        # crash can lose the last commits) and much faster than FULL.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(upload_jobs)")}
+        for column, kind in (("lease_pid", "INTEGER"), ("lease_until", "REAL")):
+            if column not in columns:
+                # Job files written before leases
+                self._conn.execute(f"ALTER TABLE upload_jobs ADD COLUMN {column} {kind}")
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        for column in _JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] else None
+        return job
+
+    def create(self, kind: str, payload: dict, owner: str = None) -> dict:
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "owner": owner,
+            "status": "queued",
+            "stage": None,
+            "attempts": 0,
+            "error": None,
+            "payload": payload,
+            "stages_done": {},
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO upload_jobs (id, kind, owner, status, attempts, payload, stages_done, "
+                "lease_pid, lease_until, created_at, updated_at) VALUES (?, ?, ?, ?, 0, ?, '{}', ?, ?, ?, ?)",
+                (job["id"], kind, owner, job["status"], json.dumps(payload), os.getpid(), now + self.lease, now, now)
+            )
+        return job
+
+    def update(self, job_id: str, **fields):
+        """Persist the given columns (JSON columns are serialized)."""
+        if not fields:
+            return
+        fields["updated_at"] = time.time()
+        columns = []
+        values = []
+        for name, value in fields.items():
+            if name in _JSON_COLUMNS and value is not None:
+                value = json.dumps(value)
+            columns.append(f"{name} = ?")
+            values.append(value)
+        values.append(job_id)
+        with self._lock:
+            self._conn.execute(f"UPDATE upload_jobs SET {', '.join(columns)} WHERE id = ?", values)
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def unfinished(self):
+        """Jobs queued, running or waiting to retry in any process, oldest first."""
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM upload_jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                UNFINISHED_STATUSES
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def claim_orphaned(self):
+        """
+        Take over the lease of every queued or running job whose process is
+        gone or whose lease has expired, and return those jobs (retrying
+        ones come back queued). A job is claimed by exactly one caller.
+        """
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        pid = os.getpid()
+        with self._lock:
+            now = time.time()
+            rows = self._conn.execute(
+                f"SELECT * FROM upload_jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                UNFINISHED_STATUSES
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                # Held by a live process (this one included): leave it to that process
+                if row["status"] != RETRY_STATUS and (row["lease_until"] or 0) >= now and \
+                        (row["lease_pid"] == pid or pid_alive(row["lease_pid"])):
+                    continue
+                cur = self._conn.execute(
+                    "UPDATE upload_jobs SET status = 'queued', lease_pid = ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ? AND status = ? AND lease_pid IS ? AND lease_until IS ?",
+                    (pid, now + self.lease, now, row["id"], row["status"], row["lease_pid"], row["lease_until"])
+                )
+                if cur.rowcount == 1:
+                    job = self._row_to_job(row)
+                    job["status"] = "queued"
+                    claimed.append(job)
+        return claimed
+
+    def renew_leases(self) -> int:
+        """Extend the lease on every unfinished job this process holds."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE upload_jobs SET lease_until = ? WHERE lease_pid = ? AND status IN ('queued', 'running')",
+                (time.time() + self.lease, os.getpid())
+            )
+        return cur.rowcount
+
+    def claim_retryable(self, older_than: float):
+        """
+        Move jobs parked as retrying since before `older_than` back to queued
+        and return them. A job is claimed by exactly one caller, even with
+        several processes sharing the file.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM upload_jobs WHERE status = ? AND updated_at < ? ORDER BY created_at",
+                (RETRY_STATUS, older_than)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                now = time.time()
+                cur = self._conn.execute(
+                    "UPDATE upload_jobs SET status = 'queued', lease_pid = ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ? AND status = ?",
+                    (os.getpid(), now + self.lease, now, row["id"], RETRY_STATUS)
+                )
+                if cur.rowcount == 1:
+                    job = self._row_to_job(row)
+                    job["status"] = "queued"
+                    claimed.append(job)
+        return claimed
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM upload_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def prune_finished(self, keep: int):
+        """Delete all but the newest `keep` done/failed jobs."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM upload_jobs WHERE status IN ('done', 'failed') AND id NOT IN ("
+                "SELECT id FROM upload_jobs WHERE status IN ('done', 'failed') "
+                "ORDER BY updated_at DESC LIMIT ?)",
+                (keep,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
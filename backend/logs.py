@@ -0,0 +1,113 @@
+"""
+Structured, level-gated logging for the backend.
+
+    from logs import get_logger
+    log = get_logger("blockchain")
+    log.info("similarity check", extra={"phash": phash, "total": n})
+
+Records go through a QueueHandler, so the calling thread only enqueues; a
+listener thread formats and writes them. Level checks happen before any
+formatting, so debug calls on hot paths cost one comparison when debug is
+off. Per-item messages in loops should go through sample() as well.
+
+    LOG_LEVEL         DEBUG / INFO (default) / WARNING / ...
+    LOG_FORMAT        "text" (default) or "json" (one object per line)
+    LOG_SAMPLE_EVERY  log one in N per-item debug messages (default 100)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+
+ROOT = "trifecta"
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_lock = threading.Lock()
+_listener = None
+
+
+def _extras(record) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extras(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """`LEVEL [name] message key=value ...`"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extras = _extras(record)
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+def configure(level: str = None, fmt: str = None, stream=None):
+    """
+    Install the queue handler on the "trifecta" logger. Safe to call again to
+    change level or format (e.g. from a benchmark).
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JSONFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=False)
+        _listener.start()
+
+        root = logging.getLogger(ROOT)
+        root.handlers = [logging.handlers.QueueHandler(records)]
+        root.setLevel((level or LOG_LEVEL).upper())
+        root.propagate = False
+
+
+def shutdown():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown)
+
+
+def get_logger(name: str) -> logging.Logger:
+    if _listener is None:
+        configure()
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def sample(index: int, every: int = None) -> bool:
+    """True for one in `every` items of a loop (the first always logs)."""
+    return index % (every or LOG_SAMPLE_EVERY) == 0
@@ -0,0 +1,4 @@
+-- Whether a post's display previews were stored (derivatives.py).
+-- Listings select this column and upload jobs insert it, so it must exist
+-- before running a version that renders previews.
+alter table stego_uploads add column if not exists previews boolean not null default false;
@@ -0,0 +1,25 @@
+-- First `per_post` comments of each post plus its total, for GET /feed
+-- (feed_routes.py). The cost follows the page size and K rather than the
+-- comment volume, and PostgREST's max-rows cap cannot truncate it. Without
+-- this function /feed falls back to one unbounded comments query.
+--
+-- Post ids are integers (int or bigint) as everywhere in the app; columns
+-- are cast so either width works.
+create index if not exists comments_post_id_created_at_id_idx on comments (post_id, created_at, id);
+
+create or replace function feed_comments(post_ids bigint[], per_post int)
+returns table (id bigint, post_id bigint, username text, avatar_url text,
+               text text, created_at timestamptz, comment_count bigint)
+language sql stable as $$
+  select c.id::bigint, p.pid, c.username::text, c.avatar_url::text, c.text::text,
+         c.created_at::timestamptz, n.total
+  from unnest(post_ids) as p(pid)
+  cross join lateral (
+    select count(*) as total from comments cc where cc.post_id = p.pid
+  ) n
+  left join lateral (
+    select * from comments cc where cc.post_id = p.pid
+    order by cc.created_at, cc.id limit per_post
+  ) c on true
+  order by p.pid, c.created_at, c.id
+$$;
@@ -0,0 +1,126 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+# Columns the feed and profile grid render (hash and previews give the
+# preview URLs); heavy ones are opt-in via ?expand=
+FEED_COLUMNS = ("id", "username", "file_url", "hash", "previews", "created_at")
+EXPANDABLE_COLUMNS = ("sentiment", "score")
+
+DEFAULT_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("FEED_MAX_PAGE_SIZE", "100"))
+
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor pointing just past `row` in (created_at, id) DESC order."""
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Return (created_at, id) from a cursor. Raises ValueError if malformed.
+
+    Cursors come from the client and end up in a PostgREST filter string, so
+    created_at must parse as an ISO timestamp and is returned re-serialized
+    from the parsed value, never as the raw input.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or type(row_id) is not int:
+        raise ValueError("Invalid cursor")
+    try:
+        created_at = datetime.fromisoformat(created_at).isoformat()
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+
+def parse_page_args(args):
+    """
+    Read ?limit=, ?cursor= and ?expand= from request args.
+    Returns (limit, cursor, columns). Raises ValueError on bad input.
+    """
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    cursor = args.get("cursor")
+    if cursor:
+        cursor = decode_cursor(cursor)
+
+    columns = list(FEED_COLUMNS)
+    for name in filter(None, (args.get("expand") or "").split(",")):
+        name = name.strip()
+        # Feed columns are always selected; expand=hash predates hash being one
+        if name not in EXPANDABLE_COLUMNS and name not in FEED_COLUMNS:
+            raise ValueError(f"Cannot expand '{name}'")
+        if name not in columns:
+            columns.append(name)
+
+    return limit, cursor, columns
+
+
+def fetch_page(supabase, table: str, columns, limit: int, cursor=None, filters=None):
+    """
+    Keyset-paginated select ordered by (created_at, id) DESC.
+
+    Only `columns` are selected, and one extra row is fetched to tell whether
+    another page exists. Returns (rows, next_cursor); next_cursor is None on
+    the last page. Needs an index on (created_at DESC, id DESC), e.g.
+    create index on stego_uploads (created_at desc, id desc).
+    """
+    resp = page_query(supabase, table, columns, limit, cursor, filters).execute()
+    return page_result(resp, limit)
+
+
+async def afetch_page(supabase, table: str, columns, limit: int, cursor=None, filters=None):
+    """fetch_page() for the async Supabase client."""
+    resp = await page_query(supabase, table, columns, limit, cursor, filters).execute()
+    return page_result(resp, limit)
+
+
+def page_query(supabase, table: str, columns, limit: int, cursor=None, filters=None):
+    """The keyset select behind fetch_page(), not yet executed."""
+    query = supabase.table(table).select(",".join(columns))
+    for column, value in (filters or {}).items():
+        query = query.eq(column, value)
+    if cursor:
+        created_at, row_id = cursor
+        query = query.or_(
+            f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})'
+        )
+    return (
+        query
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+    )
+
+
+def count_rows(supabase, table: str, filters=None):
+    """Rows matching `filters`, counted by PostgREST (count=exact) without fetching them."""
+    query = supabase.table(table).select("id", count="exact")
+    for column, value in (filters or {}).items():
+        query = query.eq(column, value)
+    return getattr(query.limit(1).execute(), "count", None)
+
+
+def page_result(resp, limit: int):
+    """Split a page_query() response into (rows, next_cursor)."""
+    rows = getattr(resp, "data", None)
+    if rows is None and isinstance(resp, dict):
+        rows = resp.get("data")
+    rows = rows or []
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
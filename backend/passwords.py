@@ -0,0 +1,85 @@
+"""
+Password hashing off the request threads.
+
+bcrypt runs on a small dedicated pool (AUTH_HASH_WORKERS threads; bcrypt
+releases the GIL while hashing), so a login storm uses at most that many
+cores and the other routes keep theirs. The calling request thread still
+waits for its hash, so the queue is kept short: by default only as many
+hashes may wait as the pool gets through in half of AUTH_HASH_TIMEOUT
+(AUTH_HASH_SECONDS per hash). Beyond that, or when a hash is not done in
+time, callers get HasherBusy and answer 503 instead of piling up.
+
+The work factor comes from BCRYPT_LOG_ROUNDS. Hashes made with a different
+factor still verify, and login rehashes them (needs_rehash()).
+
+    AUTH_HASH_WORKERS=0 hashes inline on the calling thread (old behaviour).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_TIMEOUT = float(os.getenv("AUTH_HASH_TIMEOUT", "10"))
+# Rough seconds per hash on one core; cost 12 takes about a quarter second
+AUTH_HASH_SECONDS = float(os.getenv("AUTH_HASH_SECONDS", str(0.25 * 2 ** (BCRYPT_LOG_ROUNDS - 12))))
+# Unset: derived from the pool size and timeout (see default_queue_max)
+AUTH_HASH_QUEUE_MAX = os.getenv("AUTH_HASH_QUEUE_MAX")
+# Seconds clients are asked to wait when the hashing pool is saturated
+AUTH_RETRY_AFTER = int(os.getenv("AUTH_RETRY_AFTER", "2"))
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already queued, or one did not finish in time."""
+
+
+def default_queue_max(workers: int, timeout: float = AUTH_HASH_TIMEOUT,
+                      seconds_per_hash: float = AUTH_HASH_SECONDS) -> int:
+    """Waiting hashes the pool clears in half the timeout, leaving the rest for the caller's own hash."""
+    return max(0, int(workers * (timeout / 2) / seconds_per_hash) - workers)
+
+
+def hash_rounds(pw_hash: str):
+    """Cost factor of a modular-crypt bcrypt hash ("$2b$12$..."), or None if unparseable."""
+    parts = pw_hash.split("$")
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, bcrypt, rounds: int = BCRYPT_LOG_ROUNDS, workers: int = AUTH_HASH_WORKERS,
+                 queue_max: int = None):
+        if queue_max is None:
+            queue_max = int(AUTH_HASH_QUEUE_MAX) if AUTH_HASH_QUEUE_MAX else default_queue_max(workers)
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt") if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(workers + queue_max) if workers > 0 else None
+
+    def _run(self, fn, *args):
+        if self._pool is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Password hashing is saturated")
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=AUTH_HASH_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy(f"Password hash not done within {AUTH_HASH_TIMEOUT:g}s")
+
+    def hash(self, password: str) -> str:
+        return self._run(self.bcrypt.generate_password_hash, password, self.rounds).decode("utf-8")
+
+    def verify(self, pw_hash: str, password: str) -> bool:
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        return hash_rounds(pw_hash) != self.rounds
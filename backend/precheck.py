@@ -0,0 +1,51 @@
+"""
+Signed pre-check tokens.
+
+/check-duplicate returns a short-lived token binding the user, the SHA-256
+of the image bytes it checked, their pHash, the contract and the registry
+size at the time of the scan. /upload with the same image and a valid token
+reuses the pHash and only compares against images registered since.
+
+    PRECHECK_SECRET     signing key (defaults to JWT_SECRET_KEY)
+    PRECHECK_TOKEN_TTL  seconds a token stays valid (default 300)
+"""
+import os
+
+PRECHECK_SECRET = os.getenv("PRECHECK_SECRET") or os.getenv("JWT_SECRET_KEY", "super-secret")
+PRECHECK_TOKEN_TTL = int(os.getenv("PRECHECK_TOKEN_TTL", "300"))
+
+_SALT = "precheck"
+
+
+def _serializer():
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(PRECHECK_SECRET, salt=_SALT)
+
+
+def issue(username: str, sha256: str, phash: str, contract: str, checked_up_to: int) -> str:
+    return _serializer().dumps({
+        "u": username,
+        "sha": sha256,
+        "ph": phash,
+        "c": contract,
+        "n": checked_up_to,
+    })
+
+
+def verify(token: str, username: str, sha256: str, contract: str):
+    """
+    Return (phash, checked_up_to) when `token` is genuine, unexpired and was
+    issued to this user for these exact bytes against this contract; None
+    otherwise.
+    """
+    from itsdangerous import BadSignature
+
+    if not token:
+        return None
+    try:
+        claims = _serializer().loads(token, max_age=PRECHECK_TOKEN_TTL)
+    except BadSignature:
+        return None
+    if claims.get("u") != username or claims.get("sha") != sha256 or claims.get("c") != contract:
+        return None
+    return claims["ph"], int(claims["n"])
@@ -0,0 +1,239 @@
+"""
+Opt-in per-request profiling.
+
+With PROFILE_ENABLED=1, a request to one of PROFILE_ROUTES is profiled when
+it carries `X-Profile: <PROFILE_TOKEN>` or is picked by PROFILE_SAMPLE_RATE.
+The capture is written to PROFILE_DIR as <ms>_<request id>_<route>.<ext>;
+the request ID (X-Request-ID if the client sent one) is echoed back in
+X-Profile-Id.
+
+    PROFILE_MODE=sample    a sampler thread records the request's stack every
+                           PROFILE_INTERVAL seconds into .collapsed (one
+                           "frame;frame;frame count" line per stack, the
+                           input flamegraph.pl and speedscope take)
+    PROFILE_MODE=cprofile  deterministic cProfile into .pstats
+                           (python -m pstats, snakeviz)
+
+Sampling costs nothing on the request thread; cProfile slows it noticeably
+and suits one-off header-triggered captures. At most PROFILE_MAX_CONCURRENT
+requests are profiled at once and the newest PROFILE_KEEP captures are kept.
+GET /debug/profiles (same header) lists them and /debug/profiles/<name>
+downloads one.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from logs import get_logger
+
+log = get_logger("profiling")
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTES = [r.strip() for r in os.getenv("PROFILE_ROUTES", "/upload,/check-duplicate").split(",") if r.strip()]
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").lower()
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "1"))
+
+HEADER = "X-Profile"
+EXTENSIONS = {"sample": ".collapsed", "cprofile": ".pstats"}
+
+_slots = threading.BoundedSemaphore(max(1, PROFILE_MAX_CONCURRENT))
+_SAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+# File names are <ms>_<request id>_<route>, so IDs must not contain "_"
+_SAFE_ID = re.compile(r"[^A-Za-z0-9.-]+")
+
+
+def authorized(header_value) -> bool:
+    """True if `header_value` is the admin profiling token."""
+    return bool(PROFILE_TOKEN) and header_value == PROFILE_TOKEN
+
+
+def wanted(path: str, header_value=None) -> bool:
+    """Whether a request to `path` with this X-Profile value should be profiled."""
+    if not PROFILE_ENABLED:
+        return False
+    if "*" not in PROFILE_ROUTES and path not in PROFILE_ROUTES:
+        return False
+    return authorized(header_value) or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame) -> str:
+    """Root-first `a;b;c` stack for `frame`."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Samples the stacks of the given threads (all other threads if None) on a
+    background thread. Stacks of other threads are prefixed with the thread
+    name, which is what ASGI mode needs since its work hops between the event
+    loop and the CPU pool.
+    """
+
+    def __init__(self, thread_ids=None, interval: float = PROFILE_INTERVAL):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            names = {t.ident: t.name for t in threading.enumerate()} if self.thread_ids is None else None
+            for tid, frame in frames.items():
+                if tid == own or (self.thread_ids is not None and tid not in self.thread_ids):
+                    continue
+                stack = collapse(frame)
+                if names is not None:
+                    stack = f"{names.get(tid, tid)};{stack}"
+                self.counts[stack] += 1
+            self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Capture:
+    """One request being profiled; start() when it begins, finish() when done."""
+
+    def __init__(self, request_id: str, route: str, all_threads: bool = False, mode: str = PROFILE_MODE):
+        self.request_id = _SAFE_ID.sub("-", request_id)[:64]
+        self.route = route
+        self.mode = mode if mode in EXTENSIONS else "sample"
+        # cProfile only sees the thread that enabled it
+        self.all_threads = all_threads and self.mode == "sample"
+        self._profiler = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            ids = None if self.all_threads else {threading.get_ident()}
+            self._profiler = StackSampler(ids).start()
+        return self
+
+    def finish(self, status=None):
+        """Stop profiling and write the capture. Returns its file name, or None on failure."""
+        elapsed = time.perf_counter() - self._started
+        if self.mode == "cprofile":
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        name = f"{int(time.time() * 1000)}_{self.request_id}_{_SAFE.sub('_', self.route.strip('/')) or 'root'}"
+        name += EXTENSIONS[self.mode]
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, name)
+            if self.mode == "cprofile":
+                self._profiler.dump_stats(path)
+            else:
+                self._profiler.write(path)
+            _prune()
+        except OSError as e:
+            log.warning("profile not written: %s", e, extra={"request_id": self.request_id})
+            return None
+        log.info("profile captured", extra={
+            "request_id": self.request_id, "route": self.route, "status": status,
+            "seconds": round(elapsed, 3), "file": name,
+        })
+        return name
+
+
+def begin(path: str, header_value=None, request_id=None, all_threads=False):
+    """
+    Start a Capture for this request if it should be profiled and a slot is
+    free; returns None otherwise. The caller must call end() on it.
+    """
+    if not wanted(path, header_value):
+        return None
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        return Capture(request_id or uuid.uuid4().hex, path, all_threads).start()
+    except Exception as e:
+        _slots.release()
+        log.warning("profiling not started: %s", e)
+        return None
+
+
+def end(capture, status=None):
+    try:
+        return capture.finish(status)
+    finally:
+        _slots.release()
+
+
+def _prune():
+    entries = sorted(
+        (e for e in os.scandir(PROFILE_DIR) if e.is_file() and e.name.endswith(tuple(EXTENSIONS.values()))),
+        key=lambda e: e.name, reverse=True
+    )
+    for entry in entries[PROFILE_KEEP:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def recent(limit: int = 50) -> list:
+    """Newest captures first: name, request_id, route, mode, size and creation time."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    names = sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(tuple(EXTENSIONS.values()))), reverse=True)
+    for name in names[:limit]:
+        stem, ext = os.path.splitext(name)
+        parts = stem.split("_", 2)
+        if len(parts) != 3 or not parts[0].isdigit():
+            continue
+        out.append({
+            "name": name,
+            "request_id": parts[1],
+            "route": parts[2],
+            "mode": "cprofile" if ext == ".pstats" else "sample",
+            "bytes": os.path.getsize(os.path.join(PROFILE_DIR, name)),
+            "created_at": int(parts[0]) / 1000,
+        })
+    return out
+
+
+def capture_path(name: str):
+    """Absolute path of the capture `name`, or None if it is not one."""
+    if name != os.path.basename(name) or not name.endswith(tuple(EXTENSIONS.values())):
+        return None
+    path = os.path.abspath(os.path.join(PROFILE_DIR, name))
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,198 @@
+"""
+Optimistic pHash reservations for /upload.
+
+/upload used to wait for the storeImageHash receipt before answering, only so
+that a second upload of the same image could not pass the duplicate check
+while the first was still unmined. Instead, once an upload's check passes,
+its pHash is reserved here. The insert re-checks the other reservations in
+the same SQLite write transaction, so of two near-identical uploads racing
+each other exactly one wins. Reservations are part of every similarity scan
+from then on.
+
+The chain write then runs first in the background upload job. Success
+confirms the reservation; failure removes it (and the job stops before
+anything is published). Confirmed reservations stay visible for
+RESERVATION_KEEP seconds, by which time every scan sees the image on chain.
+
+    UPLOAD_CHAIN_ASYNC=0  store on chain inside the request, as before
+    RESERVATION_DB        SQLite file, shared by all workers on the host
+    RESERVATION_TTL       seconds an unconfirmed reservation counts
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import blockchain
+import deadlines
+import services
+from logs import get_logger
+
+log = get_logger("reservations")
+
+UPLOAD_CHAIN_ASYNC = os.getenv("UPLOAD_CHAIN_ASYNC", "1") == "1"
+RESERVATION_DB = os.getenv("RESERVATION_DB", "reservations.db")
+RESERVATION_KEEP = float(os.getenv("RESERVATION_KEEP", "3600"))
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS phash_reservations (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    phash       TEXT NOT NULL,
+    owner       TEXT,
+    status      TEXT NOT NULL,
+    tx_hash     TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_phash_reservations_updated ON phash_reservations (status, updated_at);
+"""
+
+
+class Reservation:
+    """A held pHash; confirm() after the chain write, release() if the upload is abandoned."""
+
+    def __init__(self, store, reservation_id: int):
+        self.store = store
+        self.id = reservation_id
+        # Set once a job owns the reservation; it confirms or releases it
+        self.submitted = False
+
+    def release(self, reason: str = None):
+        self.store.release(self.id, reason)
+
+    def release_unused(self):
+        """Give the reservation back if it was never handed to a job."""
+        if not self.submitted:
+            self.release("upload abandoned")
+
+
+class ReservationStore:
+    def __init__(self, path: str = RESERVATION_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _active(self, now: float):
+        """Rows that still count: unconfirmed within the TTL, confirmed within KEEP."""
+        return self._conn.execute(
+            "SELECT * FROM phash_reservations WHERE "
+            "(status = 'reserved' AND updated_at >= ?) OR (status = 'confirmed' AND updated_at >= ?)",
+            (now - RESERVATION_TTL, now - RESERVATION_KEEP)
+        ).fetchall()
+
+    def reserve(self, phash: str, owner: str, threshold: int):
+        """
+        Reserve `phash` unless an active reservation is within `threshold`.
+        Returns (Reservation, None) or (None, the conflicting match).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in self._active(now):
+                    distance = blockchain.hamming_distance(phash, row["phash"])
+                    if distance <= threshold:
+                        self._conn.execute("COMMIT")
+                        return None, _match(row, distance)
+                reservation_id = self._conn.execute(
+                    "INSERT INTO phash_reservations (phash, owner, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'reserved', ?, ?)", (phash, owner, now, now)
+                ).lastrowid
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        log.debug("phash reserved", extra={"reservation": reservation_id, "phash": phash})
+        return Reservation(self, reservation_id), None
+
+    def confirm(self, reservation_id: int, tx_hash: str = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE phash_reservations SET status = 'confirmed', tx_hash = ?, updated_at = ? WHERE id = ?",
+                (tx_hash, time.time(), reservation_id)
+            )
+
+    def release(self, reservation_id: int, reason: str = None):
+        with self._lock:
+            self._conn.execute("DELETE FROM phash_reservations WHERE id = ?", (reservation_id,))
+        log.info("phash reservation released", extra={"reservation": reservation_id, "reason": reason})
+
+    def scan(self, phash: str, threshold: int):
+        """(active reservations within `threshold`, closest first; minimum distance or None)."""
+        with self._lock:
+            rows = self._active(time.time())
+        found, closest = [], None
+        for row in rows:
+            distance = blockchain.hamming_distance(phash, row["phash"])
+            closest = distance if closest is None else min(closest, distance)
+            if distance <= threshold:
+                found.append(_match(row, distance))
+        return sorted(found, key=lambda m: m["distance"]), closest
+
+    def phashes(self) -> list:
+        """Every reservation that still counts."""
+        with self._lock:
+            return self._active(time.time())
+
+    def prune(self) -> int:
+        """Delete reservations that no longer count."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM phash_reservations WHERE "
+                "(status = 'reserved' AND updated_at < ?) OR (status = 'confirmed' AND updated_at < ?)",
+                (now - RESERVATION_TTL, now - RESERVATION_KEEP)
+            )
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _match(row, distance) -> dict:
+    """A reservation in the shape of an is_similar_to_existing() match."""
+    return {
+        "index": None,
+        "reservation": row["id"],
+        "pending": row["status"] == "reserved",
+        "shaHash": None,
+        "perceptualHash": row["phash"],
+        "uploader": None,
+        "timestamp": int(row["created_at"]),
+        "distance": distance
+    }
+
+
+def _create_reservation_store():
+    store = ReservationStore()
+    pruned = store.prune()
+    if pruned:
+        log.info("pruned %d stale phash reservation(s)", pruned)
+    return store
+
+
+services.register("reservations", _create_reservation_store)
+
+
+def get_reservations() -> ReservationStore:
+    return services.get("reservations")
+
+
+def add_reserved_matches(result: dict, new_phash: str, threshold: int) -> dict:
+    """Fold reserved pHashes into an is_similar_to_existing() result."""
+    if not UPLOAD_CHAIN_ASYNC and services.peek("reservations") is None:
+        return result
+    deadlines.check()
+    matches, closest = get_reservations().scan(new_phash, threshold)
+    if closest is not None and (result["min_distance"] is None or closest < result["min_distance"]):
+        result["min_distance"] = closest
+    result["similar_images"].extend(matches)
+    result["is_duplicate"] = len(result["similar_images"]) > 0
+    return result
@@ -0,0 +1,33 @@
+import services
+from emoji_lexicon import load_emoji_scores
+
+
+def _create_analyzer():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+services.register("sentiment", _create_analyzer)
+
+
+def analyze_sentiment(text: str):
+    """
+    VADER compound score adjusted by the emoji lexicon.
+    Returns (label, score) where label is positive / negative / neutral.
+    """
+    score = services.get("sentiment").polarity_scores(text)
+    compound = score.get("compound", 0.0)
+
+    emoji_scores = load_emoji_scores()
+    for ch in text:
+        if ch in emoji_scores:
+            compound += emoji_scores[ch]
+
+    score["compound"] = compound
+    if compound > 0.05:
+        label = "positive"
+    elif compound < -0.05:
+        label = "negative"
+    else:
+        label = "neutral"
+    return label, score
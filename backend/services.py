@@ -0,0 +1,180 @@
+"""
+Registry of lazily initialized subsystems (Supabase client, Web3 + contract,
+sentiment analyzer, ...).
+
+Modules register a zero-argument factory under a name; the first call to
+get() builds the instance and every later call reuses it. Nothing heavy is
+imported or connected at app import time, so /health answers immediately.
+
+Clients bound to an event loop (AsyncWeb3, the async Supabase client) are
+registered with register_async() and built with `await aget(name)`.
+
+Pre-fork servers can pay the cost up front, e.g. in a gunicorn config:
+
+    on_starting = lambda server: services.preload_modules()
+    post_fork = lambda server, worker: services.warm_up()
+"""
+import importlib
+import os
+import threading
+import time
+
+from logs import get_logger
+
+log = get_logger("services")
+
+_factories = {}
+_async_factories = {}
+_async_locks = {}
+_instances = {}
+_errors = {}
+_lock = threading.RLock()
+
+# Heavy third-party modules that are safe to import before forking.
+PRELOAD_MODULES = [
+    "web3",
+    "supabase",
+    "stegano.lsb",
+    "imagehash",
+    "numpy",
+    "scipy.stats",
+    "PIL.Image",
+    "cryptography.hazmat.primitives.ciphers.aead",
+    "vaderSentiment.vaderSentiment",
+]
+
+
+def register(name: str, factory):
+    """Register a factory for a subsystem. Re-registering drops any cached instance."""
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+        _errors.pop(name, None)
+
+
+def get(name: str):
+    """Return the subsystem instance, building it on first use. Raises if the factory fails."""
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name in _instances:
+            return _instances[name]
+        if name not in _factories:
+            raise KeyError(f"Unknown subsystem: {name}")
+        try:
+            instance = _factories[name]()
+        except Exception as e:
+            _errors[name] = str(e)
+            raise
+        _instances[name] = instance
+        _errors.pop(name, None)
+        return instance
+
+
+def register_async(name: str, factory):
+    """Register a coroutine factory, built on first `await aget(name)`."""
+    with _lock:
+        _async_factories[name] = factory
+        _instances.pop(name, None)
+        _errors.pop(name, None)
+
+
+async def aget(name: str):
+    """Async get(): awaits the factory once; concurrent callers wait for the same build."""
+    import asyncio
+
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    if name not in _async_factories:
+        raise KeyError(f"Unknown async subsystem: {name}")
+    lock = _async_locks.setdefault(name, asyncio.Lock())
+    async with lock:
+        if name in _instances:
+            return _instances[name]
+        try:
+            instance = await _async_factories[name]()
+        except Exception as e:
+            _errors[name] = str(e)
+            raise
+        _instances[name] = instance
+        _errors.pop(name, None)
+        return instance
+
+
+def peek(name: str):
+    """Return the instance if it has already been built, without building it."""
+    return _instances.get(name)
+
+
+def get_optional(name: str):
+    """Like get(), but returns None (and logs) when the subsystem cannot be built."""
+    try:
+        return get(name)
+    except Exception as e:
+        log.warning("%s not available: %s", name, e)
+        return None
+
+
+def reset(name: str = None):
+    """Drop cached instances so the next get() rebuilds them."""
+    with _lock:
+        if name is None:
+            _instances.clear()
+            _errors.clear()
+        else:
+            _instances.pop(name, None)
+            _errors.pop(name, None)
+
+
+def status() -> dict:
+    """Return {name: "ready" | "pending" | "error: ..."} for every registered subsystem."""
+    with _lock:
+        result = {}
+        for name in _factories:
+            if name in _instances:
+                result[name] = "ready"
+            elif name in _errors:
+                result[name] = f"error: {_errors[name]}"
+            else:
+                result[name] = "pending"
+        return result
+
+
+def preload_modules(modules=None) -> dict:
+    """Import heavy modules without creating clients or connections. Returns seconds per module."""
+    timings = {}
+    for module in modules or PRELOAD_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            timings[module] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            timings[module] = f"error: {e}"
+    return timings
+
+
+def warm_up(names=None) -> dict:
+    """
+    Build the given subsystems (all registered ones by default).
+    Failures are recorded, not raised, so a missing backend never blocks boot.
+    """
+    timings = {}
+    for name in names or list(_factories):
+        start = time.perf_counter()
+        try:
+            get(name)
+            timings[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            timings[name] = f"error: {e}"
+    log.info("warm-up finished", extra={"timings": timings})
+    return timings
+
+
+def warm_up_enabled() -> bool:
+    return os.getenv("WARM_UP", "0").lower() in ("1", "true", "yes")
@@ -1,57 +1,39 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import CORS  
-from stegano import lsb
 import os
 import re
-from uploadFile import async_upload_stego_and_insert
-from stego_utils import get_image_hash, save_uploaded_image, embed_message
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import pandas as pd
+from uploadFile import async_upload_stego_and_insert, get_upload_executor
+from stego_utils import (
+    get_bytes_hash, spool_upload, embed_message_bytes, new_stego_path, reveal_message, STEGO_LOCAL_RETENTION
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from supabaseClient import supabase
-from stego_utils import get_perceptual_hash
+from supabaseClient import get_supabase
+from stego_utils import get_perceptual_hash, get_image_hash
+import blockchain
+import precheck
 from blockchain import is_similar_to_existing, health_check
+from sentiment import analyze_sentiment as _analyze_sentiment
+from pagination import parse_page_args, fetch_page
+from derivatives import add_preview_urls
+from metrics import span
+from logs import get_logger
+from deadlines import deadline, DeadlineExceeded, CHECK_DUPLICATE_DEADLINE, UPLOAD_DEADLINE
+from admission import admit
+from reservations import UPLOAD_CHAIN_ASYNC, get_reservations
 
 
 upload_bp = Blueprint("upload_bp", __name__)
 CORS(upload_bp) 
 
+log = get_logger("upload")
 
-try:
-    from supabaseClient import supabase
-except Exception as e:
-    supabase = None
-    print("Warning: supabase client not available in comments_routes:", e)
-    
-_analyzer = SentimentIntensityAnalyzer()
-_emoji_scores = {}
-try:
-    df = pd.read_csv("Datasets/Emoji_trimmed.csv")
-    df['Score'] = df['Positive'] - df['Negative']
-    _emoji_scores = dict(zip(df['Emoji'], df['Score']))
-except Exception as e:
-    print("Emoji dataset not loaded in stego_routes:", e)
-
-def _analyze_sentiment(text: str):
-    score = _analyzer.polarity_scores(text)
-    compound = score["compound"]
-
-    for ch in text:
-        if ch in _emoji_scores:
-            compound += _emoji_scores[ch]
-
-    score["compound"] = compound
-    if compound > 0.05:
-        label = "positive"
-    elif compound < -0.05:
-        label = "negative"
-    else:
-        label = "neutral"
-    return label, score
+# Seconds clients are asked to wait when the upload executor is full
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "5"))
 
 
 @upload_bp.route("/check-duplicate", methods=["POST"])
 @jwt_required()
+@admit("check_duplicate")
 def check_duplicate():
     """
     Check if uploaded image is a duplicate BEFORE processing.
@@ -65,7 +47,26 @@ def check_duplicate():
 
     image_file = request.files["image"]
     username = get_jwt_identity()
-    
+
+    # One budget for the whole check: RPC timeouts shrink to what is left and
+    # the chain scan stops once it is spent.
+    with deadline(CHECK_DUPLICATE_DEADLINE):
+        try:
+            return _check_duplicate(image_file, username)
+        except DeadlineExceeded:
+            log.warning("duplicate check: deadline of %ss exceeded", CHECK_DUPLICATE_DEADLINE)
+            return _timed_out()
+
+
+def _timed_out():
+    return jsonify({
+        "status": "error",
+        "message": "Blockchain call timed out",
+        "hint": "Check if Ganache is running on http://127.0.0.1:8545"
+    }), 503
+
+
+def _check_duplicate(image_file, username):
     # Step 1: Blockchain health check
     try:
         if not health_check():
@@ -73,95 +74,53 @@ def check_duplicate():
                 "status": "error",
                 "message": "Blockchain connection unavailable"
             }), 503
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"[DUPLICATE CHECK] Health check failed: {e}")
+        log.warning("duplicate check: health check failed: %s", e)
         return jsonify({
             "status": "error",
             "message": f"Blockchain health check failed: {str(e)}"
         }), 503
     
-    # Step 2: Save uploaded image temporarily
-    image_path = None
+    # Step 2: Spool the uploaded image (in memory unless it is large)
     try:
-        image_path = save_uploaded_image(image_file)
-        print(f"[DUPLICATE CHECK] Image saved to: {image_path}")
+        with span("spool_upload"):
+            image = spool_upload(image_file)
     except Exception as e:
-        print(f"[DUPLICATE CHECK] Failed to save image: {e}")
+        log.error("duplicate check: failed to save image: %s", e)
         return jsonify({
             "status": "error",
             "message": "Failed to save image"
         }), 500
-    
-    # Step 3: Compute perceptual hash
+    try:
+        return _check_spooled(image, username)
+    finally:
+        image.close()
+
+
+def _check_spooled(image, username):
+    # Step 3: Compute perceptual hash (and the SHA-256 the pre-check token binds)
     phash = None
     try:
-        phash = get_perceptual_hash(image_path)
-        print(f"[DUPLICATE CHECK] Computed perceptual hash: {phash}")
+        phash = get_perceptual_hash(image)
+        image_sha256 = get_image_hash(image)
+        log.debug("duplicate check: perceptual hash computed", extra={"phash": phash})
     except Exception as e:
-        print(f"[DUPLICATE CHECK] Failed to compute perceptual hash: {e}")
-        if image_path and os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except:
-                pass
+        log.error("duplicate check: failed to compute perceptual hash: %s", e)
         return jsonify({
             "status": "error",
             "message": "Failed to compute perceptual hash",
             "error": str(e)
         }), 500
     
-    # Step 4: Check for similar images on blockchain
+    # Step 4: Check for similar images on blockchain (bounded by the deadline)
     try:
-        print(f"[DUPLICATE CHECK] Starting blockchain similarity check...")
-        
-        # Use threading for timeout
-        from threading import Thread
-        import queue
-        
-        result_queue = queue.Queue()
-        
-        def blockchain_check():
-            try:
-                result = is_similar_to_existing(phash, similarity_threshold=10)
-                result_queue.put(("success", result))
-            except Exception as e:
-                result_queue.put(("error", e))
-        
-        check_thread = Thread(target=blockchain_check)
-        check_thread.daemon = True
-        check_thread.start()
-        check_thread.join(timeout=10)
-        
-        if check_thread.is_alive():
-            print(f"[DUPLICATE CHECK] Blockchain call timed out after 10 seconds")
-            if image_path and os.path.exists(image_path):
-                try:
-                    os.remove(image_path)
-                except:
-                    pass
-            return jsonify({
-                "status": "error",
-                "message": "Blockchain call timed out",
-                "hint": "Check if Ganache is running on http://127.0.0.1:8545"
-            }), 503
-        
-        try:
-            status, result = result_queue.get_nowait()
-        except queue.Empty:
-            raise Exception("Blockchain check completed but no result returned")
-        
-        if status == "error":
-            raise result
-        
-        similarity_result = result
-        print(f"[DUPLICATE CHECK] Similarity result: {similarity_result}")
-        
-        # Clean up temporary file
-        if image_path and os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except Exception as cleanup_err:
-                print(f"[DUPLICATE CHECK] Failed to cleanup temp file: {cleanup_err}")
+        similarity_result = is_similar_to_existing(phash, similarity_threshold=10)
+        log.info("duplicate check finished", extra={
+            "phash": phash, "is_duplicate": similarity_result["is_duplicate"],
+            "min_distance": similarity_result["min_distance"]
+        })
         
         if similarity_result["is_duplicate"]:
             similar_images_info = []
@@ -182,24 +141,23 @@ def check_duplicate():
                 "perceptual_hash": phash
             }), 200
         else:
+            # Only unique results get a token: /upload skips the records it covers.
             return jsonify({
                 "status": "unique",
                 "is_duplicate": False,
                 "message": "Image is unique",
                 "perceptual_hash": phash,
-                "min_distance": similarity_result["min_distance"]
+                "min_distance": similarity_result["min_distance"],
+                "precheck_token": precheck.issue(
+                    username, image_sha256, phash, blockchain.CONTRACT_ADDRESS,
+                    similarity_result["registry_size"]
+                )
             }), 200
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"[DUPLICATE CHECK] Blockchain similarity check failed: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        if image_path and os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except:
-                pass
+        log.exception("duplicate check: blockchain similarity check failed: %s", e)
         return jsonify({
             "status": "error",
             "message": "Failed to check for duplicates on blockchain",
@@ -210,6 +168,7 @@ def check_duplicate():
 
 @upload_bp.route("/upload", methods=["POST"])
 @jwt_required()
+@admit("upload", embed=True)
 def embed_route():
     """
     Upload route with integrated duplicate checking.
@@ -220,10 +179,36 @@ def embed_route():
 
     image_file = request.files["image"]
     message = request.form["message"]
+    precheck_token = request.form.get("precheck_token")
     username = get_jwt_identity()
-    
+
+    # Backpressure: reserve room on the background upload executor up front
+    slot = get_upload_executor().reserve()
+    if slot is None:
+        return jsonify({
+            "status": "busy",
+            "message": "Too many uploads in progress, please retry shortly"
+        }), 503, {"Retry-After": str(UPLOAD_RETRY_AFTER)}
+
+    image = None
+    try:
+        with span("spool_upload"):
+            image = spool_upload(image_file)
+        with deadline(UPLOAD_DEADLINE):
+            return _process_upload(image, message, username, slot, precheck_token)
+    except DeadlineExceeded:
+        log.warning("upload: deadline of %ss exceeded", UPLOAD_DEADLINE, extra={"user": username})
+        return _timed_out()
+    finally:
+        slot.release_unused()
+        if image is not None:
+            image.close()
+
+
+def _process_upload(image, message, username, slot, precheck_token=None):
     # Step 1: Sentiment analysis
-    sentiment, score = _analyze_sentiment(message)
+    with span("sentiment"):
+        sentiment, score = _analyze_sentiment(message)
     if sentiment == "negative":
         return jsonify({
             "status": "rejected",
@@ -232,94 +217,111 @@ def embed_route():
             "score": score
         }), 400
     
-    # Step 2: Save uploaded image
-    image_path = save_uploaded_image(image_file)
-    
+    # Step 2 (spooling the image) is done by embed_route, which closes it
+
     # Step 3: Check for hidden message
-    hidden_message = None
     try:
-        hidden_message = lsb.reveal(image_path)
-    except IndexError:
-        hidden_message = None
+        with span("reveal_probe"):
+            hidden_message = reveal_message(image)
     except Exception as e:
-        print(f"Reveal error: {e}")
+        log.warning("reveal error: %s", e)
         hidden_message = None
 
     if hidden_message:
-        # Clean up
-        if os.path.exists(image_path):
-            os.remove(image_path)
         return jsonify({
             "status": "hidden data detected",
             "hidden_message": hidden_message
         }), 400
     
     # === NEW: DUPLICATE CHECK BEFORE EMBEDDING ===
-    print("[UPLOAD] Checking for duplicates on blockchain...")
-    
     try:
         # Check blockchain health
         if not health_check():
-            if os.path.exists(image_path):
-                os.remove(image_path)
             return jsonify({
                 "status": "error",
                 "message": "Blockchain connection unavailable"
             }), 503
         
-        # Compute perceptual hash of original image
-        phash = get_perceptual_hash(image_path)
-        print(f"[UPLOAD] Computed perceptual hash: {phash}")
+        # A valid token from /check-duplicate for these same bytes supplies
+        # the pHash and lets the scan start where that check stopped.
+        reused = precheck.verify(
+            precheck_token, username, get_image_hash(image), blockchain.CONTRACT_ADDRESS
+        ) if precheck_token else None
+        if reused:
+            phash, checked_up_to = reused
+        else:
+            phash, checked_up_to = get_perceptual_hash(image), 0
+        log.debug("perceptual hash ready", extra={"phash": phash, "checked_up_to": checked_up_to})
         
         # Check for duplicates
-        similarity_result = is_similar_to_existing(phash, similarity_threshold=10)
+        similarity_result = is_similar_to_existing(phash, similarity_threshold=10, start_index=checked_up_to)
         
         if similarity_result["is_duplicate"]:
             # DUPLICATE FOUND - REJECT UPLOAD
             similar = similarity_result["similar_images"][0]
-            print(f"[UPLOAD] DUPLICATE DETECTED - Upload blocked!")
-            print(f"[UPLOAD] Similar to image #{similar['index']} (distance: {similar['distance']})")
-            
-            # Clean up
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            
-            return jsonify({
-                "status": "duplicate",
-                "message": "This image is too similar to an existing image on the blockchain",
-                "is_duplicate": True,
-                "details": {
-                    "distance": similar["distance"],
-                    "threshold": 10,
-                    "existing_image_index": similar["index"],
-                    "existing_uploader": similar["uploader"],
-                    "timestamp": similar["timestamp"]
-                }
-            }), 409  # 409 Conflict
-        
-        print("[UPLOAD] Image is unique - Proceeding with embedding and upload")
+            log.info("duplicate upload blocked", extra={
+                "user": username, "index": similar["index"], "distance": similar["distance"]
+            })
+
+            return _duplicate_response(similar)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"[UPLOAD] Duplicate check failed: {e}")
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        log.error("duplicate check failed: %s", e)
         return jsonify({
             "status": "error",
             "message": "Failed to verify image uniqueness on blockchain",
             "error": str(e)
         }), 500
     
+    # Hold the pHash so concurrent uploads see it before the chain does;
+    # the upload job confirms or releases it (reservations.py)
+    reservation = None
+    if UPLOAD_CHAIN_ASYNC:
+        reservation, conflict = get_reservations().reserve(phash, username, 10)
+        if conflict:
+            log.info("duplicate upload blocked by a pending upload", extra={
+                "user": username, "reservation": conflict["reservation"], "distance": conflict["distance"]
+            })
+            return _duplicate_response(conflict)
+    try:
+        return _embed_and_register(image, message, username, slot, phash, sentiment, score, reused, reservation)
+    finally:
+        if reservation is not None:
+            reservation.release_unused()
+
+
+def _duplicate_response(similar):
+    return jsonify({
+        "status": "duplicate",
+        "message": "This image is too similar to an existing image on the blockchain",
+        "is_duplicate": True,
+        "details": {
+            "distance": similar["distance"],
+            "threshold": 10,
+            "existing_image_index": similar["index"],
+            "existing_uploader": similar["uploader"],
+            "timestamp": similar["timestamp"]
+        }
+    }), 409  # 409 Conflict
+
+
+def _embed_and_register(image, message, username, slot, phash, sentiment, score, reused, reservation=None):
     # === IMAGE IS UNIQUE - PROCEED WITH EMBEDDING ===
     
-    # Step 4: Embed message
-    output_path = None
+    # Step 4: Embed message (in memory; written to uploads/ only if the
+    # retention policy keeps a local copy)
+    output_path = new_stego_path()
+    stego_bytes = None
     try:
-        output_path = embed_message(image_path, message)
-        print(f"[UPLOAD] Message embedded successfully: {output_path}")
+        stego_bytes = embed_message_bytes(image, message)
+        if STEGO_LOCAL_RETENTION != "none":
+            with open(output_path, "wb") as f:
+                f.write(stego_bytes)
+        log.debug("message embedded", extra={"path": output_path})
     except Exception as e:
-        print(f"[UPLOAD] Embedding error: {e}")
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        log.error("embedding failed: %s", e)
         return jsonify({
             "status": "error",
             "message": "Failed to embed message.",
@@ -329,10 +331,10 @@ def embed_route():
     # Step 5: Compute hash of embedded image
     image_hash = None
     try:
-        image_hash = get_image_hash(output_path)
-        print(f"[UPLOAD] Computed hash: {image_hash}")
+        image_hash = get_bytes_hash(stego_bytes)
+        log.debug("sha256 computed", extra={"sha256": image_hash})
     except Exception as e:
-        print(f"[UPLOAD] Hash computation error: {e}")
+        log.error("hash computation failed: %s", e)
         if os.path.exists(output_path):
             os.remove(output_path)
         return jsonify({
@@ -340,51 +342,81 @@ def embed_route():
             "message": "Failed to compute image hash after embedding."
         }), 500
 
-    # Step 6: Store on blockchain SYNCHRONOUSLY to prevent race conditions
-    # This ensures duplicate detection works even for rapid re-uploads
-    try:
-        from blockchain import store_image_on_chain
-        print("[UPLOAD] Storing perceptual hash on blockchain BEFORE returning success...")
-        tx_result = store_image_on_chain(
-            sha_hash=image_hash,
-            perceptual_hash=phash
-        )
-        print(f"[UPLOAD] Stored on blockchain - TX: {tx_result['txHash']}")
-    except Exception as e:
-        print(f"[UPLOAD] FAILED to store on blockchain: {e}")
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        return jsonify({
-            "status": "error",
-            "message": "Failed to store image on blockchain",
-            "error": str(e)
-        }), 500
-    
-    # Step 7: Start async upload to Supabase (DB record insert)
-    # Blockchain storage already done, so Supabase upload can be async
+    # Step 6: Store on chain. With a reservation the upload job does it
+    # first thing, so the response does not wait for the receipt.
+    if reservation is not None:
+        tx_result = {"txHash": None, "status": "pending"}
+    else:
+        # Synchronously, so rapid re-uploads see it (UPLOAD_CHAIN_ASYNC=0)
+        try:
+            from blockchain import store_image_on_chain
+            tx_result = store_image_on_chain(
+                sha_hash=image_hash,
+                perceptual_hash=phash
+            )
+            log.info("stored on chain", extra={"user": username, "tx": tx_result["txHash"]})
+        except DeadlineExceeded:
+            # Raised only before the transaction is sent; once it is out,
+            # the receipt is awaited past the deadline and the job queued.
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        except Exception as e:
+            log.error("failed to store on chain: %s", e)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return jsonify({
+                "status": "error",
+                "message": "Failed to store image on blockchain",
+                "error": str(e)
+            }), 500
+
+    # Step 7: Start async upload to Supabase (DB record insert), after the
+    # chain write when it was deferred
     data_to_insert = {
         "username": username,
         "hash": image_hash,
         "perceptual_hash": phash,  # Pass the already computed phash
         "sentiment": sentiment,
         "score": score,
-        "blockchain_stored": True  # Flag that blockchain storage is complete
+        "blockchain_stored": reservation is None  # Flag that blockchain storage is complete
     }
     
-    async_upload_stego_and_insert(output_path, data_to_insert, skip_blockchain=True)
+    job_id = async_upload_stego_and_insert(
+        output_path, data_to_insert, skip_blockchain=reservation is None, slot=slot, image_bytes=stego_bytes,
+        reservation=reservation
+    )
 
     return jsonify({
         "status": "ok",
         "message": "Message embedded and uploaded successfully!",
-        "saved_path": output_path,
+        "upload_job_id": job_id,
+        "saved_path": output_path if STEGO_LOCAL_RETENTION == "keep" else None,
         "sha256": image_hash,
         "perceptual_hash": phash,
         "sentiment": sentiment,
         "score": score,
-        "blockchain_tx": tx_result['txHash']
+        "blockchain_tx": tx_result['txHash'],
+        # Queued for a Merkle batch; GET /anchor/proof/<sha256> once anchored
+        "blockchain_batched": tx_result.get("batched", False),
+        # Chain write still running; /upload/status/<upload_job_id> reports it
+        "blockchain_pending": reservation is not None,
+        "precheck_reused": reused is not None
     }), 200
 
 
+@upload_bp.route("/upload/status/<job_id>", methods=["GET"])
+@jwt_required()
+def upload_status(job_id):
+    """Status of a background upload job (queued / running / done / failed)."""
+    job = get_upload_executor().get_status(job_id)
+    if job is None or job.get("owner") != get_jwt_identity():
+        return jsonify({"status": "error", "message": "Unknown upload job"}), 404
+
+    job.pop("owner", None)
+    return jsonify({"job": job}), 200
+
+
 def _extract_supabase_result(resp):
     """
     Normalizes supabase-py return shapes.
@@ -402,16 +434,26 @@ def _extract_supabase_result(resp):
 @upload_bp.route("/upload", methods=["GET"])
 @jwt_required()
 def list_uploads():
+    """
+    Feed page, newest first. Query params: limit (capped), cursor (from the
+    previous page's next_cursor) and expand=sentiment,score for the heavy
+    columns the feed does not render (hash is always included, so
+    expand=hash is accepted and changes nothing). Rows carry preview_url(s)
+    for display; file_url stays the lossless stego original.
+    """
+    supabase = get_supabase()
     if supabase is None:
         return jsonify({"error": "Supabase not configured"}), 500
 
     try:
-        resp = supabase.table("stego_uploads").select("*").order("created_at", desc=True).execute()
+        limit, cursor, columns = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        rows, next_cursor = fetch_page(supabase, "stego_uploads", columns, limit, cursor)
     except Exception as e:
         return jsonify({"error": "Supabase fetch failed", "detail": str(e)}), 500
 
-    data, error = _extract_supabase_result(resp)
-    if error:
-        return jsonify({"error": error}), 500
-
-    return jsonify({"uploads": data}), 200
\ No newline at end of file
+    add_preview_urls(rows)
+    return jsonify({"uploads": rows, "next_cursor": next_cursor}), 200
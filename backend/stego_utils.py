@@ -1,116 +1,223 @@
 import hashlib
 import os
-from stegano import lsb
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import numpy as np
-from scipy.stats import chisquare
+import shutil
+import tempfile
 import uuid
-from PIL import Image
-from supabaseClient import supabase 
-import imagehash
+from io import BytesIO
+from supabaseClient import get_supabase, build_public_url
+from metrics import Counter, timed
+from logs import get_logger
+
+# stegano, PIL, imagehash, numpy, scipy and cryptography are imported inside
+# the functions that use them so importing this module stays cheap.
 
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# What happens to the local stego PNG once its bytes exist in memory:
+#   keep            - write it and leave it in uploads/
+#   until_uploaded  - write it (so a restarted job can resume) and delete it
+#                     when the upload job finishes
+#   none            - never write it; upload straight from memory. A job
+#                     whose storage upload fails after the chain write
+#                     (in the request or in the job) then has nothing to
+#                     retry from: the image stays on chain without a post.
+STEGO_LOCAL_RETENTION = os.getenv("STEGO_LOCAL_RETENTION", "until_uploaded")
+
+# Uploads are held in memory up to this many bytes, then in an anonymous
+# temporary file in UPLOAD_FOLDER (see spool_upload)
+UPLOAD_SPOOL_MAX = int(os.getenv("UPLOAD_SPOOL_MAX", str(4 * 1024 * 1024)))
+
+# Longest side decoded for pHash (0 = full resolution); see get_perceptual_hash
+PHASH_DECODE_SIZE = int(os.getenv("PHASH_DECODE_SIZE", "256"))
+
+log = get_logger("stego")
+
+SPOOL_ROLLOVERS = Counter(
+    "trifecta_upload_spool_rollovers_total", "Uploads larger than UPLOAD_SPOOL_MAX, spooled to disk."
+)
+
 def generate_key():
     return os.urandom(32)
 
 KEY = generate_key()  # 32 bytes for AES-256        
 # AES 
 def encrypt_message(plaintext: str, key: bytes):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
     aesgcm = AESGCM(key)
     iv = os.urandom(12)
     ciphertext = aesgcm.encrypt(iv, plaintext.encode(), None)
     return iv + ciphertext 
 
 def decrypt_message(iv_and_ciphertext: bytes, key: bytes):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
     aesgcm = AESGCM(key)
     iv = iv_and_ciphertext[:12]
     ciphertext = iv_and_ciphertext[12:]
     plaintext = aesgcm.decrypt(iv, ciphertext, None)
     return plaintext.decode()
 
-def save_uploaded_image(image_file):
-    """Save uploaded image and return file path"""
-    file_id = str(uuid.uuid4()) + ".png"
-    file_path = os.path.join(UPLOAD_FOLDER, file_id)
-    image_file.save(file_path)
-    return file_path
+def spool_upload(source):
+    """
+    Copy an uploaded image into a SpooledTemporaryFile and return it rewound.
+
+    `source` is bytes, a file object, or an upload object wrapping one (a
+    werkzeug FileStorage or a Starlette UploadFile). Small images never
+    touch disk; larger ones roll over to an unnamed temporary file, so
+    closing the spool (or the process dying) is all the cleanup needed.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX, dir=UPLOAD_FOLDER)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        spool.write(source)
+    else:
+        stream = getattr(source, "stream", None) or getattr(source, "file", None) or source
+        shutil.copyfileobj(stream, spool, 1024 * 1024)
+    if spool.tell() > UPLOAD_SPOOL_MAX:
+        SPOOL_ROLLOVERS.inc()
+    spool.seek(0)
+    return spool
+
+def _rewind(source):
+    """File objects are read by several steps in turn; each starts at the top."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
 
-def get_image_hash(image_path: str) -> str:
-    """Compute SHA-256 hash of an image file."""
+def get_image_hash(source) -> str:
+    """Compute SHA-256 hash of an image file (a path or a file object)."""
     hash_sha256 = hashlib.sha256()
-    with open(image_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                hash_sha256.update(chunk)
+    else:
+        _rewind(source)
+        for chunk in iter(lambda: source.read(65536), b""):
             hash_sha256.update(chunk)
     return hash_sha256.hexdigest()
 
-def get_perceptual_hash(image_path: str) -> str:
+@timed("sha256")
+def get_bytes_hash(data) -> str:
+    """Compute SHA-256 hash of an in-memory buffer (bytes or memoryview)."""
+    return hashlib.sha256(data).hexdigest()
+
+@timed("phash")
+def get_perceptual_hash(source) -> str:
     """
-    Compute the perceptual hash (pHash) of an image file.
-    Returns a hexadecimal string representing the hash.
+    Compute the perceptual hash (pHash) of an image and return it as hex.
+
+    `source` is a file path, a bytes-like buffer or a file object. pHash
+    only looks at a 32x32 grayscale version, so only about
+    PHASH_DECODE_SIZE pixels per side are decoded: JPEGs are scaled inside
+    libjpeg via draft(), other formats are thumbnailed after decoding.
+    PHASH_DECODE_SIZE=0 decodes at full resolution (the old behaviour).
     """
-    image = Image.open(image_path)
-    phash = imagehash.phash(image)
-    return str(phash)
+    import imagehash
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    with Image.open(_rewind(source)) as img:
+        if not PHASH_DECODE_SIZE:
+            return str(imagehash.phash(img))
+        size = (PHASH_DECODE_SIZE, PHASH_DECODE_SIZE)
+        img.draft("L", size)  # no-op for anything but JPEG
+        # imagehash converts to L before resizing too; doing it first also
+        # keeps palette images off the nearest-neighbour resize path.
+        gray = img.convert("L")
+    if gray.width > size[0] or gray.height > size[1]:
+        gray.thumbnail(size, Image.LANCZOS, reducing_gap=2.0)
+    return str(imagehash.phash(gray))
 
 
-def embed_message(image_path, message):
-    #Embed message into image and return stego image path
-    stego_file_path = os.path.join(UPLOAD_FOLDER, "stego_" + os.path.basename(image_path))
+def new_stego_path():
+    """Local path for a new stego output."""
+    return os.path.join(UPLOAD_FOLDER, f"stego_{uuid.uuid4()}.png")
 
+def reveal_message(source):
+    """The message hidden in an image (path or file object) by lsb.hide, or None."""
+    from stegano import lsb
+    try:
+        return lsb.reveal(_rewind(source))
+    except IndexError:
+        return None
+
+@timed("embed")
+def embed_message_bytes(source, message) -> bytes:
+    """
+    Embed message into an image (path or file object) and return the stego
+    PNG as bytes (nothing is written to disk).
+    """
+    from stegano import lsb
     encrypted_msg = encrypt_message(message, KEY).hex()    # hex encode for embedding
-    secret_image = lsb.hide(image_path, encrypted_msg)
-    secret_image.save(stego_file_path)
+    secret_image = lsb.hide(_rewind(source), encrypted_msg)
+    buf = BytesIO()
+    secret_image.save(buf, format="PNG")
+    return buf.getvalue()
+
+def embed_message(image_path, message):
+    #Embed message into image and return stego image path
+    stego_file_path = new_stego_path()
+    with open(stego_file_path, "wb") as f:
+        f.write(embed_message_bytes(image_path, message))
     return stego_file_path
 
-def upload_stego_to_supabase(local_path: str, bucket_name: str = "image"):
+@timed("storage_upload")
+def upload_stego_to_supabase(source, bucket_name: str = "image", file_name: str = None,
+                             content_type: str = "image/png"):
     """
-    Uploads the file to Supabase Storage and returns the Public URL.
+    Uploads the stego image to Supabase Storage and returns the Public URL.
+
+    `source` is either a local file path or the PNG bytes themselves
+    (bytes / bytearray / memoryview), which are sent without touching disk;
+    in that case `file_name` names the object. The public URL is built
+    locally instead of asking the storage API for it.
     """
-    file_name = os.path.basename(local_path)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if not file_name:
+            raise ValueError("file_name is required when uploading from memory")
+        # supabase-py sends bytes as-is; other buffers are materialized once.
+        body = source if isinstance(source, bytes) else bytes(source)
+    else:
+        file_name = file_name or os.path.basename(source)
+        body = None
     remote_path = f"stego_uploads/{file_name}" 
 
     file_options = {
-        "content-type": "image/png",
+        "content-type": content_type,
         "upsert": "true"
     }
 
+    supabase = get_supabase()
     if supabase is None:
         raise Exception("Supabase client is not initialized.")
 
     try:
-        with open(local_path, "rb") as f:
-            # Execute the upload
-            response = supabase.storage.from_(bucket_name).upload(
-                path=remote_path, 
-                file=f, 
-                file_options=file_options
-            )
+        bucket = supabase.storage.from_(bucket_name)
+        if body is not None:
+            response = bucket.upload(path=remote_path, file=body, file_options=file_options)
+        else:
+            with open(source, "rb") as f:
+                response = bucket.upload(path=remote_path, file=f, file_options=file_options)
 
         if hasattr(response, 'error') and response.error:
              raise Exception(f"Supabase API Error: {response.error}")
 
-        # Get Public URL
-        public_url = supabase.storage.from_(bucket_name).get_public_url(remote_path)
+        public_url = build_public_url(bucket_name, remote_path)
 
-        print(f"Supabase public URL: {public_url}")
+        log.debug("uploaded to storage", extra={"url": public_url})
         return public_url
 
     except Exception as e:
-        print(f"Error uploading to Supabase: {str(e)}")
+        log.error("error uploading to Supabase: %s", e)
         raise e
 
-def get_perceptual_hash(image_path):
-    img = Image.open(image_path)
-    phash = str(imagehash.phash(img))
-    return phash
-
 # NEW FUNCTION TO INSERT RECORD
+@timed("db_insert")
 def insert_stego_record(record_data: dict):
     """
     Inserts a record into the 'stego_uploads' table.
     """
+    supabase = get_supabase()
     if supabase is None:
         raise Exception("Supabase client is not initialized.")
     
@@ -122,7 +229,7 @@ def insert_stego_record(record_data: dict):
         # Note: 'score' is a JSONB type, so we pass the Python dictionary
         resp = supabase.table("stego_uploads").insert(record_data).execute()
     except Exception as e:
-        print(f"Error inserting record into stego_uploads: {str(e)}")
+        log.error("error inserting record into stego_uploads: %s", e)
         raise e
     
     # Simple check for error on insert response
@@ -131,9 +238,46 @@ def insert_stego_record(record_data: dict):
     
     return resp
 
+@timed("db_insert")
+def insert_stego_records(records: list):
+    """Insert several 'stego_uploads' rows in one request (same fields as insert_stego_record)."""
+    supabase = get_supabase()
+    if supabase is None:
+        raise Exception("Supabase client is not initialized.")
+
+    resp = supabase.table("stego_uploads").insert(records).execute()
+    if hasattr(resp, 'error') and resp.error:
+        raise Exception(f"Supabase DB Insert Error: {resp.error}")
+    return resp
+
+@timed("db_lookup")
+def find_stego_record(image_hash: str):
+    """Return the 'stego_uploads' row with this SHA-256 hash, or None."""
+    supabase = get_supabase()
+    if supabase is None:
+        raise Exception("Supabase client is not initialized.")
+
+    resp = supabase.table("stego_uploads").select("id").eq("hash", image_hash).limit(1).execute()
+    data = getattr(resp, "data", None)
+    return data[0] if data else None
+
+@timed("db_lookup")
+def existing_stego_hashes(image_hashes: list) -> set:
+    """The subset of `image_hashes` that already have a 'stego_uploads' row."""
+    supabase = get_supabase()
+    if supabase is None:
+        raise Exception("Supabase client is not initialized.")
+
+    resp = supabase.table("stego_uploads").select("hash").in_("hash", list(image_hashes)).execute()
+    return {row["hash"] for row in getattr(resp, "data", None) or []}
+
 def detect_steganography(image_path, threshold=0.2):
 
     #chi-square steganalysis
+    import numpy as np
+    from PIL import Image
+    from scipy.stats import chisquare
+    from stegano import lsb
     
     img = Image.open(image_path).convert("L")
     pixels = np.array(img).flatten()
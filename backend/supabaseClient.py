@@ -1,13 +1,80 @@
 from dotenv import load_dotenv
 import os
-from supabase import create_client, Client
+import services
+from logs import get_logger
 
 load_dotenv()  # loads .env into environment variables
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise Exception("Supabase URL or key not found in environment variables!")
+log = get_logger("supabase")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
\ No newline at end of file
+
+def create_supabase_client():
+    """
+    Build the shared Supabase client (the supabase package is imported here,
+    not at startup) with pooled keep-alive connections and per-call timeouts.
+    """
+    from supabase import create_client
+    from supabase.lib.client_options import ClientOptions
+    from http_pools import create_supabase_http_client, SUPABASE_TIMEOUT
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise Exception("Supabase URL or key not found in environment variables!")
+
+    timeouts = {"postgrest_client_timeout": SUPABASE_TIMEOUT, "storage_client_timeout": int(SUPABASE_TIMEOUT)}
+    if "httpx_client" in getattr(ClientOptions, "__dataclass_fields__", {}):
+        # Also used when supabase rebuilds postgrest after an auth change
+        options = ClientOptions(httpx_client=create_supabase_http_client(), **timeouts)
+    else:
+        log.warning("supabase predates ClientOptions(httpx_client=...); using its default connection pools")
+        options = ClientOptions(**timeouts)
+    client = create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+    # The sub-clients are built lazily on first attribute access; building
+    # them here (under the registry lock) keeps worker threads from racing
+    # to create them.
+    client.postgrest, client.storage
+    return client
+
+
+async def create_async_supabase_client():
+    """Async Supabase client for the ASGI serving mode, pooled like the sync one."""
+    from supabase import acreate_client, AsyncClientOptions
+    from http_pools import create_async_supabase_http_client, SUPABASE_TIMEOUT
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise Exception("Supabase URL or key not found in environment variables!")
+
+    timeouts = {"postgrest_client_timeout": SUPABASE_TIMEOUT, "storage_client_timeout": int(SUPABASE_TIMEOUT)}
+    if "httpx_client" in getattr(AsyncClientOptions, "__dataclass_fields__", {}):
+        options = AsyncClientOptions(httpx_client=create_async_supabase_http_client(), **timeouts)
+    else:
+        log.warning("supabase predates AsyncClientOptions(httpx_client=...); using its default connection pools")
+        options = AsyncClientOptions(**timeouts)
+    client = await acreate_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+    client.postgrest, client.storage
+    return client
+
+
+def build_public_url(bucket_name: str, path: str) -> str:
+    """Public object URL, built locally (same shape as storage.get_public_url)."""
+    return f"{(SUPABASE_URL or '').rstrip('/')}/storage/v1/object/public/{bucket_name}/{path}"
+
+
+def get_supabase():
+    """Return the shared Supabase client, or None if it cannot be created."""
+    return services.get_optional("supabase")
+
+
+async def get_async_supabase():
+    """Return the shared async Supabase client, or None if it cannot be created."""
+    try:
+        return await services.aget("async_supabase")
+    except Exception as e:
+        log.warning("async_supabase not available: %s", e)
+        return None
+
+
+services.register("supabase", create_supabase_client)
+services.register_async("async_supabase", create_async_supabase_client)
@@ -0,0 +1,219 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("web3")
+
+import anchoring  # noqa: E402
+import blockchain  # noqa: E402
+from anchoring import (  # noqa: E402
+    BatchAnchorer, LeafStore, _parent, leaf_hash, merkle_levels, merkle_proof, verify_proof
+)
+from web3.exceptions import TransactionNotFound  # noqa: E402
+
+UPLOADER = "0x" + "11" * 20
+DEAD_PID = 2 ** 22 + 1  # above Linux's pid_max
+
+
+def leaves(n):
+    return [leaf_hash(f"{i:064x}", f"{i:016x}", UPLOADER) for i in range(n)]
+
+
+def test_single_leaf_is_its_own_root():
+    (leaf,) = leaves(1)
+    levels = merkle_levels([leaf])
+    assert levels == [[leaf]]
+    assert merkle_proof(levels, 0) == []
+    assert verify_proof(leaf, [], leaf)
+
+
+def test_odd_node_is_promoted():
+    l0, l1, l2 = leaves(3)
+    levels = merkle_levels([l0, l1, l2])
+    assert levels[-1] == [_parent(_parent(l0, l1), l2)]
+    assert merkle_proof(levels, 2) == [_parent(l0, l1)]
+
+
+@pytest.mark.parametrize("count", [2, 3, 5, 8, 13])
+def test_every_leaf_proves_against_the_root(count):
+    items = leaves(count)
+    levels = merkle_levels(items)
+    root = levels[-1][0]
+    for i, leaf in enumerate(items):
+        assert verify_proof(leaf, merkle_proof(levels, i), root)
+    assert not verify_proof(leaves(count + 1)[-1], merkle_proof(levels, 0), root)
+
+
+def test_empty_tree_rejected():
+    with pytest.raises(ValueError):
+        merkle_levels([])
+
+
+def make_store(n=3):
+    store = LeafStore(":memory:")
+    for i in range(n):
+        store.add(f"{i:064x}", f"{i:016x}", UPLOADER)
+    return store
+
+
+def test_open_batch_assigns_leaves_with_proofs():
+    store = make_store(3)
+    batch_id, root, count = store.open_batch(2)
+    assert count == 2
+    assert store.pending_count() == 1
+    entry = store.lookup(f"{0:064x}")
+    assert entry["batch_id"] == batch_id and entry["status"] == "sending"
+    assert verify_proof(
+        anchoring._unhex(entry["leaf"]), [anchoring._unhex(p) for p in entry["proof"]], anchoring._unhex(root)
+    )
+    (batch,) = store.batches("sending")
+    assert batch["owner_pid"] == os.getpid()
+    assert store.open_batch(2)[2] == 1
+    assert store.open_batch(2) is None
+
+
+def test_fail_batch_releases_leaves_once():
+    store = make_store(2)
+    batch_id, _, _ = store.open_batch(10)
+    assert store.fail_batch(batch_id, "boom")
+    assert store.pending_count() == 2
+    assert store.lookup(f"{0:064x}")["proof"] is None
+    assert store.batches("failed")[0]["error"] == "boom"
+    # Settled already: neither call changes it again
+    assert not store.fail_batch(batch_id, "again")
+    assert not store.anchor_batch(batch_id, 0, 21000)
+
+
+def test_anchored_batch_cannot_be_failed():
+    store = make_store(2)
+    batch_id, _, _ = store.open_batch(10)
+    assert store.anchor_batch(batch_id, 4, 21000)
+    assert not store.fail_batch(batch_id, "late")
+    assert store.pending_count() == 0
+    assert store.batches("anchored")[0]["chain_index"] == 4
+
+
+class FakeEth:
+    def __init__(self, receipt=None, known=True, error=None):
+        self.receipt = receipt
+        self.known = known
+        self.error = error
+
+    def get_transaction_receipt(self, tx_hash):
+        if self.error:
+            raise self.error
+        if self.receipt is None:
+            raise TransactionNotFound("pending")
+        return self.receipt
+
+    def get_transaction(self, tx_hash):
+        if not self.known:
+            raise TransactionNotFound("unknown")
+        return {"hash": tx_hash}
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    state = SimpleNamespace(eth=FakeEth())
+    event = SimpleNamespace(process_receipt=lambda receipt: [{"args": {"index": 7}}])
+    contract = SimpleNamespace(events=SimpleNamespace(BatchAnchored=lambda: event))
+    monkeypatch.setattr(blockchain, "get_w3", lambda: SimpleNamespace(eth=state.eth))
+    monkeypatch.setattr(blockchain, "get_contract", lambda: contract)
+    return state
+
+
+def sending_batch(owner_pid=DEAD_PID, tx_hash="0xabc", age=0.0):
+    store = make_store(2)
+    batch_id, _, _ = store.open_batch(10)
+    store.update_batch(batch_id, owner_pid=owner_pid, tx_hash=tx_hash,
+                       created_at=store.batches("sending")[0]["created_at"] - age)
+    return store, batch_id
+
+
+def status(store, batch_id):
+    return next(b["status"] for b in store.batches() if b["id"] == batch_id)
+
+
+def receipt(ok=True):
+    return SimpleNamespace(status=1 if ok else 0, gasUsed=50000, transactionHash=b"\xab" * 32)
+
+
+def test_recover_leaves_a_fresh_batch_of_a_live_process(chain):
+    store, batch_id = sending_batch(owner_pid=os.getppid(), tx_hash=None)
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "sending"
+
+
+def test_recover_takes_over_a_stale_batch_of_a_live_process(chain):
+    store, batch_id = sending_batch(owner_pid=os.getppid(), tx_hash=None, age=3600)
+    BatchAnchorer(store, stale=600)._recover()
+    assert status(store, batch_id) == "failed"
+
+
+def test_recover_releases_a_batch_never_sent(chain):
+    store, batch_id = sending_batch(tx_hash=None)
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "failed"
+    assert store.pending_count() == 2
+
+
+def test_recover_releases_a_transaction_the_node_does_not_know(chain):
+    chain.eth = FakeEth(known=False)
+    store, batch_id = sending_batch()
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "failed"
+
+
+def test_recover_keeps_a_pending_transaction(chain):
+    chain.eth = FakeEth(receipt=None, known=True)
+    store, batch_id = sending_batch()
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "sending"
+    assert store.pending_count() == 0
+
+
+def test_recover_keeps_the_batch_when_the_node_cannot_be_asked(chain):
+    chain.eth = FakeEth(error=ConnectionError("down"))
+    store, batch_id = sending_batch()
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "sending"
+
+
+def test_recover_anchors_a_mined_transaction(chain):
+    chain.eth = FakeEth(receipt=receipt())
+    store, batch_id = sending_batch(owner_pid=os.getpid())
+    BatchAnchorer(store)._recover()
+    (batch,) = store.batches("anchored")
+    assert batch["id"] == batch_id and batch["chain_index"] == 7 and batch["gas_used"] == 50000
+
+
+def test_recover_releases_a_reverted_transaction(chain):
+    chain.eth = FakeEth(receipt=receipt(ok=False))
+    store, batch_id = sending_batch()
+    BatchAnchorer(store)._recover()
+    assert status(store, batch_id) == "failed"
+    assert store.pending_count() == 2
+
+
+def test_flush_keeps_a_batch_whose_send_may_have_gone_out(monkeypatch):
+    signed = SimpleNamespace(hash=b"\xcd" * 32, raw_transaction=b"raw")
+
+    def send(raw):
+        raise ConnectionError("reset while sending")
+
+    eth = SimpleNamespace(
+        get_transaction_count=lambda account, block: 0, gas_price=1,
+        account=SimpleNamespace(sign_transaction=lambda tx, key: signed),
+        send_raw_transaction=send,
+    )
+    build = SimpleNamespace(build_transaction=lambda params: {})
+    contract = SimpleNamespace(functions=SimpleNamespace(anchorBatch=lambda root, count: build))
+    monkeypatch.setattr(blockchain, "get_w3", lambda: SimpleNamespace(eth=eth))
+    monkeypatch.setattr(blockchain, "get_contract", lambda: contract)
+
+    store = make_store(2)
+    BatchAnchorer(store).flush()
+    (batch,) = store.batches()
+    assert batch["status"] == "sending" and batch["tx_hash"] == signed.hash.hex()
+    assert store.pending_count() == 0
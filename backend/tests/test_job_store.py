@@ -0,0 +1,49 @@
+import os
+import time
+
+from job_store import JobStore
+
+
+def make_store(lease=60):
+    return JobStore(":memory:", lease=lease)
+
+
+def paths(jobs):
+    return sorted(job["payload"]["output_path"] for job in jobs)
+
+
+def test_live_lease_is_not_claimed():
+    store = make_store()
+    store.create("stego_upload", {"output_path": "a"})
+    assert store.claim_orphaned() == []
+
+
+def test_expired_or_dead_leases_are_claimed_once():
+    store = make_store()
+    expired = store.create("stego_upload", {"output_path": "expired"})
+    dead = store.create("stego_upload", {"output_path": "dead"})
+    store.update(expired["id"], lease_until=0)
+    store.update(dead["id"], status="running", lease_pid=2 ** 22 + 1)
+
+    claimed = store.claim_orphaned()
+    assert paths(claimed) == ["dead", "expired"]
+    assert all(job["status"] == "queued" for job in claimed)
+    assert store.get(dead["id"])["lease_pid"] == os.getpid()
+    assert store.claim_orphaned() == []
+
+
+def test_retrying_jobs_are_claimed_by_resume_and_by_the_retry_timer_once():
+    store = make_store()
+    job = store.create("stego_upload", {"output_path": "a"})
+    store.update(job["id"], status="retrying")
+    assert paths(store.claim_orphaned()) == ["a"]
+    assert store.claim_retryable(time.time() + 1) == []
+
+
+def test_renew_leases_extends_own_unfinished_jobs():
+    store = make_store(lease=5)
+    job = store.create("stego_upload", {"output_path": "a"})
+    store.update(job["id"], lease_until=0)
+    assert store.renew_leases() == 1
+    assert store.get(job["id"])["lease_until"] > time.time()
+    assert store.claim_orphaned() == []
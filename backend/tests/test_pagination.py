@@ -0,0 +1,69 @@
+import base64
+import json
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, page_query, parse_page_args
+
+
+def raw_cursor(value) -> str:
+    raw = json.dumps(value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+class FakeQuery:
+    """Records the PostgREST builder calls page_query() makes."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args))
+            return self
+
+        return call
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2024-05-01T12:30:00.123456+00:00", "id": 42}
+    assert decode_cursor(encode_cursor(row)) == (row["created_at"], 42)
+
+
+def test_cursor_accepts_zulu_suffix():
+    created_at, _ = decode_cursor(raw_cursor(["2024-05-01T12:30:00Z", 1]))
+    assert created_at == "2024-05-01T12:30:00+00:00"
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64 at all!",
+        raw_cursor("just a string"),
+        raw_cursor(["2024-05-01T12:30:00+00:00"]),
+        raw_cursor(["2024-05-01T12:30:00+00:00", "7"]),
+        raw_cursor(["2024-05-01T12:30:00+00:00", True]),
+        raw_cursor([1714566600, 7]),
+        raw_cursor(["yesterday", 7]),
+        raw_cursor(['x",username.neq."', 7]),
+        raw_cursor(['2024-05-01T12:30:00+00:00",username.neq."', 7]),
+    ],
+)
+def test_bad_cursor_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+    with pytest.raises(ValueError):
+        parse_page_args({"cursor": cursor})
+
+
+def test_page_query_filter_uses_reserialized_timestamp():
+    cursor = decode_cursor(raw_cursor(["2024-05-01 12:30:00+00:00", 9]))
+    query = FakeQuery()
+    client = type("Client", (), {"table": lambda self, name: query})()
+    page_query(client, "stego_uploads", ["id"], 10, cursor, filters={"username": "alice"})
+
+    (filter_string,) = next(args for name, args in query.calls if name == "or_")
+    assert filter_string == (
+        'created_at.lt."2024-05-01T12:30:00+00:00",'
+        'and(created_at.eq."2024-05-01T12:30:00+00:00",id.lt.9)'
+    )
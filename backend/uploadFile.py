@@ -1,6 +1,20 @@
+import os
+import queue
+import random
 import threading
-from stego_utils import upload_stego_to_supabase, insert_stego_record, get_perceptual_hash
-from blockchain import store_image_on_chain, health_check, is_similar_to_existing
+import time
+import services
+from metrics import Gauge, span
+from logs import get_logger
+from job_store import JobStore, RETRY_STATUS
+from stego_utils import (
+    upload_stego_to_supabase, insert_stego_record, get_perceptual_hash, find_stego_record,
+    STEGO_LOCAL_RETENTION
+)
+from derivatives import ensure_previews
+from blockchain import store_image_on_chain, wait_for_stored, health_check, is_similar_to_existing
+
+log = get_logger("upload_worker")
 
 
 def check_duplicate_before_upload(image_path, similarity_threshold=10):
@@ -24,7 +38,7 @@ def check_duplicate_before_upload(image_path, similarity_threshold=10):
         if not phash:
             raise Exception("Failed to compute perceptual hash")
         
-        print(f"[DUPLICATE CHECK] Computed perceptual hash: {phash}")
+        log.debug("perceptual hash computed", extra={"phash": phash})
         
         # Check for similar images on blockchain
         similarity_result = is_similar_to_existing(phash, similarity_threshold)
@@ -37,76 +51,482 @@ def check_duplicate_before_upload(image_path, similarity_threshold=10):
         }
         
     except Exception as e:
-        print(f"[DUPLICATE CHECK] Error: {e}")
+        log.error("duplicate check failed: %s", e)
+        raise
+
+
+# Background upload executor settings
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+UPLOAD_QUEUE_MAX = int(os.getenv("UPLOAD_QUEUE_MAX", "64"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "4"))
+UPLOAD_RETRY_BASE_DELAY = float(os.getenv("UPLOAD_RETRY_BASE_DELAY", "0.5"))
+UPLOAD_JOB_HISTORY = int(os.getenv("UPLOAD_JOB_HISTORY", "1000"))
+# Seconds a job parked as retrying waits before it is queued again
+UPLOAD_RETRY_INTERVAL = float(os.getenv("UPLOAD_RETRY_INTERVAL", "60"))
+
+
+class UploadQueueFull(Exception):
+    """Raised when the upload executor has no free slot."""
+
+
+class RetryLater(Exception):
+    """Raised by a job handler when the job must not fail but be run again later."""
+
+
+def retry_with_backoff(fn, *args, retries=None, base_delay=None, label="task", **kwargs):
+    """
+    Call fn(*args, **kwargs), retrying failures with exponential backoff and jitter.
+    Re-raises the last exception once retries are exhausted.
+    """
+    retries = UPLOAD_MAX_RETRIES if retries is None else retries
+    base_delay = UPLOAD_RETRY_BASE_DELAY if base_delay is None else base_delay
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            attempt += 1
+            log.warning("%s failed (%s), retry %d/%d in %.2fs", label, e, attempt, retries, delay)
+            time.sleep(delay)
+
+
+class UploadSlot:
+    """A reserved place in the executor. Released by the job, or explicitly if never submitted."""
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._released = False
+        self._lock = threading.Lock()
+        self.submitted = False
+
+    def release(self):
+        with self._lock:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+    def release_unused(self):
+        """Give the slot back if it was never handed to a job."""
+        if not self.submitted:
+            self.release()
+
+
+class UploadExecutor:
+    """
+    Fixed pool of worker threads fed by a queue, backed by a durable JobStore.
+    Capacity (running + queued jobs) is bounded by a semaphore, so callers can
+    reserve a slot before doing expensive work and get backpressure instead of
+    an unbounded backlog. Jobs are persisted with the stages they completed,
+    and resume() re-queues whatever a previous process left unfinished.
+    Jobs are leased to the process running them (see JobStore); a
+    background thread renews the leases and takes over those of dead workers.
+    Jobs whose handler raises RetryLater are parked as retrying and queued
+    again every `retry_interval` seconds until they finish.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, queue_max=UPLOAD_QUEUE_MAX,
+                 history=UPLOAD_JOB_HISTORY, store=None, retry_interval=UPLOAD_RETRY_INTERVAL):
+        self.capacity = workers + queue_max
+        self.store = store or JobStore()
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._queue = queue.Queue()
+        self._handlers = {}
+        self._history = history
+        self._finished = 0
+        self._finished_lock = threading.Lock()
+        self._threads = []
+        for n in range(workers):
+            t = threading.Thread(target=self._worker, name=f"upload-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self.retry_interval = retry_interval
+        for target, name in ((self._retrier, "upload-retrier"), (self._lease_keeper, "upload-leases")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def register_handler(self, kind: str, handler):
+        """handler(executor, job) runs a job of this kind and returns its JSON-serializable result."""
+        self._handlers[kind] = handler
+
+    def reserve(self, timeout=None):
+        """Reserve capacity for one job. Returns an UploadSlot, or None if the executor is full."""
+        if timeout is None:
+            acquired = self._slots.acquire(blocking=False)
+        else:
+            acquired = self._slots.acquire(timeout=timeout)
+        return UploadSlot(self._slots) if acquired else None
+
+    def submit(self, kind: str, payload: dict, slot=None, owner=None, attachments=None):
+        """
+        Persist and queue a job, returning its id.
+        `attachments` (e.g. in-memory image bytes) ride along with the queued
+        job but are not persisted; a resumed job runs without them.
+        Without a pre-reserved slot, raises UploadQueueFull when at capacity.
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"No handler registered for job kind: {kind}")
+        if slot is None:
+            slot = self.reserve()
+            if slot is None:
+                raise UploadQueueFull("Upload queue is full")
+
+        job = self.store.create(kind, payload, owner=owner)
+        job["attachments"] = attachments or {}
+        slot.submitted = True
+        self._queue.put((job, slot))
+        return job["id"]
+
+    def resume(self):
+        """
+        Re-queue jobs a stopped process left unfinished: waiting to retry, or
+        queued or running under a lease that is dead or expired. Jobs a live
+        worker still holds are left to it.
+        """
+        jobs = self.store.claim_orphaned()
+        for job in jobs:
+            job["resumed"] = True
+            job["attachments"] = {}
+            # Already admitted before the restart, so they do not take a slot.
+            self._queue.put((job, None))
+        if jobs:
+            log.info("resuming %d unfinished upload job(s)", len(jobs))
+        return len(jobs)
+
+    def update(self, job, **fields):
+        job.update(fields)
+        self.store.update(job["id"], **fields)
+
+    def complete_stage(self, job, stage: str, output=None):
+        """Record a finished stage so a re-run skips it."""
+        job["stages_done"][stage] = output
+        self.store.update(job["id"], stages_done=job["stages_done"])
+
+    def get_status(self, job_id):
+        """Return the public part of the job record, or None if unknown or pruned."""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        return {
+            key: job[key]
+            for key in ("id", "owner", "status", "stage", "attempts", "error", "result", "created_at", "updated_at")
+        }
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def join(self):
+        """Block until every queued job has finished."""
+        self._queue.join()
+
+    def _worker(self):
+        while True:
+            job, slot = self._queue.get()
+            try:
+                self.update(job, status="running")
+                result = self._handlers[job["kind"]](self, job)
+                self.update(job, status="done", result=result, error=None)
+            except RetryLater as e:
+                log.warning("job will be retried: %s", e, extra={"job": job["id"]})
+                self.update(job, status=RETRY_STATUS, error=str(e))
+            except Exception as e:
+                log.error("job failed: %s", e, extra={"job": job["id"]})
+                self.update(job, status="failed", error=str(e))
+            finally:
+                if slot is not None:
+                    slot.release()
+                self._queue.task_done()
+                self._after_finish()
+
+    def _retrier(self):
+        """Queue parked jobs again once they have waited retry_interval seconds."""
+        while True:
+            time.sleep(self.retry_interval)
+            try:
+                jobs = self.store.claim_retryable(time.time() - self.retry_interval)
+            except Exception as e:
+                log.warning("could not claim jobs to retry: %s", e)
+                continue
+            for job in jobs:
+                job["resumed"] = True
+                job["attachments"] = {}
+                self._queue.put((job, None))
+            if jobs:
+                log.info("retrying %d upload job(s)", len(jobs))
+
+    def _lease_keeper(self):
+        """Renew this process's job leases, and take over jobs of workers that died."""
+        while True:
+            time.sleep(self.store.lease / 3)
+            try:
+                self.store.renew_leases()
+                self.resume()
+            except Exception as e:
+                log.warning("could not renew upload job leases: %s", e)
+
+    def _after_finish(self):
+        with self._finished_lock:
+            self._finished += 1
+            prune = self._finished % 100 == 0
+        if prune:
+            self.store.prune_finished(self._history)
+
+
+def _create_upload_executor():
+    executor = UploadExecutor()
+    executor.register_handler("stego_upload", _upload_job)
+    executor.resume()
+    # Uploads are what fill uploads/, so its janitor starts with them
+    import janitor
+    if janitor.UPLOAD_JANITOR_ENABLED:
+        services.get_optional("upload_janitor")
+    return executor
+
+
+services.register("upload_executor", _create_upload_executor)
+
+
+def get_upload_executor():
+    return services.get("upload_executor")
+
+
+def _queue_depth():
+    executor = services.peek("upload_executor")
+    return {} if executor is None else {(): executor.queue_depth()}
+
+
+UPLOAD_QUEUE_DEPTH = Gauge(
+    "trifecta_upload_queue_depth", "Background upload jobs waiting for a worker.", callback=_queue_depth
+)
+
+
+def _run_stage(executor, job, stage, fn, *args):
+    """Run one pipeline stage with retries, counting attempts on the job record."""
+    def counted(*a):
+        executor.update(job, stage=stage, attempts=job["attempts"] + 1)
+        with span(f"job_{stage}"):
+            return fn(*a)
+    return retry_with_backoff(counted, *args, label=stage)
+
+
+def _upload_job(executor, job):
+    """
+    Run _upload_stages, then remove the local stego copy unless
+    STEGO_LOCAL_RETENTION keeps it. A job interrupted by a restart keeps its
+    copy to resume from.
+
+    A job that fails once its hashes are (or may be) on chain, including
+    when the route stored them itself (skip_blockchain), cannot simply
+    fail: the image could never be uploaded again (it is a duplicate of
+    itself). It keeps its copy and is parked for a retry instead. With
+    STEGO_LOCAL_RETENTION=none there is no copy, so such a job is lost
+    unless its storage upload had already finished. Any other failure
+    removes the copy; failed jobs are not resumed.
+    """
+    output_path = job["payload"]["output_path"]
+    try:
+        result = _upload_stages(executor, job)
+    except Exception as e:
+        done = job["stages_done"]
+        # skip_blockchain: the route already stored the hashes during the request
+        on_chain = job["payload"].get("skip_blockchain") or "chain_store" in done or "chain_sent" in done
+        if on_chain and ("storage_upload" in done or os.path.exists(output_path)):
+            raise RetryLater(f"failed after the chain write: {e}") from e
+        _discard(output_path)
+        raise
+    if STEGO_LOCAL_RETENTION != "keep":
+        _discard(output_path)
+    return result
+
+
+def _discard(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.warning("could not remove %s: %s", path, e)
+
+
+def _upload_stages(executor, job):
+    """
+    Upload the stego image to Supabase, render its display previews, insert
+    its record and (unless skip_blockchain) store its hashes on chain.
+
+    Each completed stage is recorded, so a resumed job continues where it
+    stopped. Re-runs are idempotent: the storage upload uses upsert, and the
+    insert first checks for an existing row with the same hash whenever it
+    may already have run (a retry, or a job resumed after a restart).
+    """
+    payload = job["payload"]
+    output_path = payload["output_path"]
+    data_to_insert = payload["data"]
+    done = job["stages_done"]
+
+    log.debug("upload job started", extra={"job": job["id"], "path": output_path})
+    # An optimistic upload (reservations.py) writes to the chain before
+    # anything is published, so a failed transaction leaves nothing behind.
+    if payload.get("reservation") is not None and "chain_store" not in done:
+        _reserved_chain_store(executor, job)
+    if "storage_upload" in done:
+        public_url = done["storage_upload"]["file_url"]
+    else:
+        # Prefer the bytes handed over by the route; fall back to the local
+        # file (e.g. for a job resumed after a restart).
+        source = job["attachments"].get("image_bytes")
+        if source is None:
+            if not os.path.exists(output_path):
+                raise Exception(f"Stego image no longer available: {output_path}")
+            source = output_path
+        public_url = _run_stage(
+            executor, job, "storage_upload",
+            upload_stego_to_supabase, source, "image", os.path.basename(output_path)
+        )
+        executor.complete_stage(job, "storage_upload", {"file_url": public_url})
+        log.debug("uploaded to storage", extra={"job": job["id"], "url": public_url})
+
+    # Display previews, rendered while the stego bytes are still at hand.
+    # Best effort: the row records whether they exist, and a post without
+    # them shows the original.
+    if "previews" not in done:
+        source = job["attachments"].get("image_bytes")
+        if source is None and os.path.exists(output_path):
+            source = output_path
+        if source is None:
+            log.warning("no image data left for previews, skipping", extra={"job": job["id"]})
+            executor.complete_stage(job, "previews", {"skipped": True})
+        else:
+            try:
+                urls = _run_stage(executor, job, "previews", ensure_previews, data_to_insert.get("hash"), source)
+                executor.complete_stage(job, "previews", {"urls": urls})
+            except Exception as e:
+                log.warning("preview generation failed: %s", e, extra={"job": job["id"]})
+                executor.complete_stage(job, "previews", {"error": str(e)})
+    job["attachments"].pop("image_bytes", None)
+
+    if "db_insert" not in done:
+        insert_data = {
+            "username": data_to_insert.get("username"),
+            "file_url": public_url,
+            "hash": data_to_insert.get("hash"),
+            "sentiment": data_to_insert.get("sentiment"),
+            "score": data_to_insert.get("score"),
+            "previews": "urls" in (done.get("previews") or {})
+        }
+        may_exist = {"value": job.get("resumed", False)}
+
+        def insert_once(record):
+            if may_exist["value"] and find_stego_record(record["hash"]):
+                log.info("record already present, skipping insert", extra={"sha256": record["hash"]})
+                return
+            may_exist["value"] = True
+            insert_stego_record(record)
+
+        _run_stage(executor, job, "db_insert", insert_once, insert_data)
+        executor.complete_stage(job, "db_insert")
+        log.info("upload job record inserted", extra={"job": job["id"], "url": public_url})
+
+    result = {"file_url": public_url}
+
+    # Store on blockchain (only if not already done). Not retried with
+    # backoff: a chain write is not idempotent, so _send_chain_store sends
+    # it at most once.
+    if payload.get("skip_blockchain"):
+        log.debug("chain store skipped, already stored synchronously")
+    elif "chain_store" in done:
+        result["blockchain_tx"] = done["chain_store"]["txHash"]
+    else:
+        executor.update(job, stage="chain_store")
+        phash = data_to_insert.get("perceptual_hash", "")
+        if not phash:
+            log.warning("no perceptual hash provided, computing now", extra={"job": job["id"]})
+            phash = get_perceptual_hash(output_path)
+        tx_result = _send_chain_store(executor, job, data_to_insert.get("hash"), phash)
+        executor.complete_stage(job, "chain_store", {"txHash": tx_result["txHash"]})
+        log.info("stored on chain", extra={"job": job["id"], "tx": tx_result["txHash"]})
+        result["blockchain_tx"] = tx_result["txHash"]
+
+    return result
+
+
+def _send_chain_store(executor, job, sha_hash, phash):
+    """
+    store_image_on_chain() for a job, sent at most once: the signed
+    transaction's hash is recorded as "chain_sent" before it goes out, and a
+    re-run waits for that transaction instead of sending another.
+    """
+    sent = job["stages_done"].get("chain_sent")
+    if sent:
+        tx_result = wait_for_stored(sent["txHash"])
+        if tx_result is not None:
+            return tx_result
+        log.warning("recorded transaction unknown, sending again", extra={"job": job["id"], "tx": sent["txHash"]})
+    return store_image_on_chain(
+        sha_hash=sha_hash,
+        perceptual_hash=phash,
+        on_signed=lambda tx_hash: executor.complete_stage(job, "chain_sent", {"txHash": tx_hash})
+    )
+
+
+def _reserved_chain_store(executor, job):
+    """Store on chain for a reserved pHash; confirm the reservation, or release it and fail the job."""
+    from reservations import get_reservations
+
+    payload = job["payload"]
+    data_to_insert = payload["data"]
+    reservation_id = payload["reservation"]
+    executor.update(job, stage="chain_store")
+    try:
+        tx_result = _send_chain_store(
+            executor, job, data_to_insert.get("hash"), data_to_insert.get("perceptual_hash")
+        )
+    except Exception as e:
+        # A transaction that may have gone out keeps the reservation; the
+        # job is retried and settles it (see _upload_job)
+        if "chain_sent" not in job["stages_done"]:
+            get_reservations().release(reservation_id, f"chain store failed: {e}")
         raise
+    if tx_result.get("status") == 0:
+        job["stages_done"].pop("chain_sent", None)
+        executor.update(job, stages_done=job["stages_done"])
+        get_reservations().release(reservation_id, f"transaction reverted: {tx_result['txHash']}")
+        raise Exception(f"Transaction reverted: {tx_result['txHash']}")
+    get_reservations().confirm(reservation_id, tx_result["txHash"])
+    executor.complete_stage(job, "chain_store", {"txHash": tx_result["txHash"]})
+    log.info("stored on chain", extra={"job": job["id"], "tx": tx_result["txHash"]})
 
 
-def async_upload_stego_and_insert(output_path, data_to_insert: dict, skip_blockchain: bool = False):
+def async_upload_stego_and_insert(output_path, data_to_insert: dict, skip_blockchain: bool = False, slot=None,
+                                  image_bytes=None, reservation=None):
     """
-    Run the upload task and database insert in a background thread.
+    Queue the Supabase upload and database insert on the durable upload executor.
     After DB insert succeeds, store hash & pHash on blockchain (unless skip_blockchain=True).
     
     Args:
         output_path: Path to the stego image file
         data_to_insert: Dictionary with upload data (username, hash, perceptual_hash, etc.)
         skip_blockchain: If True, skip blockchain storage (already done synchronously)
+        slot: Capacity reserved earlier with get_upload_executor().reserve()
+        image_bytes: The stego PNG already in memory; uploaded directly instead
+            of rereading output_path
+        reservation: A reservations.Reservation for the pHash; the job then
+            stores on chain first and confirms or releases it
     
-    NOTE: When skip_blockchain=True, blockchain storage was already done synchronously
-    to prevent race conditions with duplicate detection.
+    Returns the job id, which /upload/status/<id> can query.
+    Raises UploadQueueFull if no slot was reserved and the executor is full.
     """
-    def task():
-        print(f"[UPLOAD THREAD] Starting upload for: {output_path}")
-        public_url = None
-        
-        try:
-            # Upload to Supabase
-            public_url = upload_stego_to_supabase(output_path)
-            print(f"[UPLOAD THREAD] SUCCESS - Uploaded to Supabase: {public_url}")
-        except Exception as e:
-            print(f"[UPLOAD THREAD] FAILED - Supabase upload error: {e}")
-            return
-        
-        if public_url:
-            # Insert record to database
-            print(f"[DB INSERT THREAD] Starting record insert for: {public_url}")
-            try:
-                insert_data = {
-                    "username": data_to_insert.get("username"),
-                    "file_url": public_url,
-                    "hash": data_to_insert.get("hash"),
-                    "sentiment": data_to_insert.get("sentiment"),
-                    "score": data_to_insert.get("score")
-                }
-                resp = insert_stego_record(insert_data)
-                print(f"[DB INSERT THREAD] SUCCESS - Record inserted for: {public_url}")
-            except Exception as e:
-                print(f"[DB INSERT THREAD] FAILED - Supabase insert error: {e}")
-                return
-            
-            # Store on blockchain (only if not already done)
-            if skip_blockchain:
-                print("[BLOCKCHAIN] Skipping - already stored synchronously to prevent race conditions")
-            else:
-                try:
-                    print("[BLOCKCHAIN] Storing image hash on blockchain...")
-                    
-                    # Get perceptual hash (already computed in the route)
-                    phash = data_to_insert.get("perceptual_hash", "")
-                    if not phash:
-                        print("[BLOCKCHAIN] WARNING: No perceptual hash provided, computing now...")
-                        phash = get_perceptual_hash(output_path)
-                        print(f"[BLOCKCHAIN] Computed perceptual hash: {phash}")
-                    
-                    # Store on blockchain (duplicate check already passed in the route)
-                    tx_result = store_image_on_chain(
-                        sha_hash=data_to_insert.get("hash"),
-                        perceptual_hash=phash
-                    )
-                    print(f"[BLOCKCHAIN] ✅ Stored on chain - TX: {tx_result['txHash']}")
-                    
-                except Exception as e:
-                    print(f"[BLOCKCHAIN] ❌ FAILED to store on chain: {e}")
-    
-    thread = threading.Thread(target=task)
-    thread.start()
-    return thread
\ No newline at end of file
+    payload = {
+        "output_path": output_path,
+        "data": data_to_insert,
+        "skip_blockchain": skip_blockchain,
+        "reservation": reservation.id if reservation is not None else None,
+    }
+    job_id = get_upload_executor().submit(
+        "stego_upload", payload, slot=slot, owner=data_to_insert.get("username"),
+        attachments={"image_bytes": image_bytes} if image_bytes is not None else None
+    )
+    if reservation is not None:
+        reservation.submitted = True
+    return job_id
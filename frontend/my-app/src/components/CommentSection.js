@@ -3,26 +3,38 @@ import axios from "axios";
 import { useEffect, useState } from "react";
 import { Button, Form, ListGroup } from "react-bootstrap";
 
-export default function CommentSection({ postId, username = "Anonymous", initialComments = [] }) {
+export default function CommentSection({ postId, username = "Anonymous", initialComments, commentCount }) {
   const [comments, setComments] = useState(initialComments || []);
   const [newComment, setNewComment] = useState("");
   const apiBase = "http://localhost:8000"; 
 
-  // Fetch comments from backend on mount or when postId changes
-  useEffect(() => {
-    if (!postId) return;
+  // The feed already attached this post's first comments
+  const preloaded = Array.isArray(initialComments);
+  const [total, setTotal] = useState(commentCount ?? 0);
+  const hiddenCount = preloaded ? Math.max(0, total - comments.length) : 0;
+
+  const fetchComments = () => {
     const token = sessionStorage.getItem("token");
     axios.get(`${apiBase}/comments`, {
       params: { post_id: postId },
       headers: token ? { Authorization: `Bearer ${token}` } : {},
     })
     .then(res => {
-      setComments(res.data.comments || []);
+      const fetched = res.data.comments || [];
+      setComments(fetched);
+      setTotal(fetched.length);
     })
     .catch(err => {
       console.error("Failed to fetch comments:", err.response?.data || err.message);
      
     });
+  };
+
+  // Fetch comments from backend on mount or when postId changes,
+  // unless the feed already supplied them
+  useEffect(() => {
+    if (!postId || preloaded) return;
+    fetchComments();
   }, [postId]);
 
   const addComment = async (e) => {
@@ -64,10 +76,12 @@ export default function CommentSection({ postId, username = "Anonymous", initial
       if (created) {
        
         setComments((c) => [...c, created]);
+        setTotal((t) => t + 1);
         setNewComment("");
       } else {
         
         setComments((c) => [...c, { text, username }]);
+        setTotal((t) => t + 1);
         setNewComment("");
       }
     } catch (error) {
@@ -88,6 +102,11 @@ export default function CommentSection({ postId, username = "Anonymous", initial
           </ListGroup.Item>
         ))}
       </ListGroup>
+      {hiddenCount > 0 && (
+        <Button variant="link" className="p-0 mb-2" onClick={fetchComments}>
+          View all {total} comments
+        </Button>
+      )}
 
       <Form onSubmit={addComment}>
         <Form.Control
@@ -4,12 +4,15 @@ import { Button, Form } from "react-bootstrap";
 const ImageUploadForm = forwardRef(({ onUpload }, ref) => {
   const [image, setImage] = useState(null);
   const [message, setMessage] = useState("");
+  // Signed result of the duplicate check; lets /upload skip re-scanning
+  const [precheckToken, setPrecheckToken] = useState(null);
 
   // Expose resetForm() to parent
   useImperativeHandle(ref, () => ({
     resetForm() {
       setImage(null);
       setMessage("");
+      setPrecheckToken(null);
 
       // Clear file input manually
       const fileInput = document.getElementById("image-input");
@@ -23,6 +26,7 @@ const ImageUploadForm = forwardRef(({ onUpload }, ref) => {
   const handleImageSelect = async (e) => {
     const file = e.target.files[0];
     setImage(file);
+    setPrecheckToken(null);
 
     if (!file) return;
 
@@ -49,6 +53,7 @@ const ImageUploadForm = forwardRef(({ onUpload }, ref) => {
         );
       } else {
         console.log("Image is unique.");
+        setPrecheckToken(result.precheck_token || null);
       }
     } catch (err) {
       console.error("Duplicate check failed:", err);
@@ -58,7 +63,7 @@ const ImageUploadForm = forwardRef(({ onUpload }, ref) => {
 
   const handleSubmit = (e) => {
     e.preventDefault();
-    onUpload({ image, message });
+    onUpload({ image, message, precheckToken });
   };
 
   return (
@@ -1,26 +1,30 @@
 import { useEffect, useState } from "react";
 import axios from "axios";
-import { Card, Container } from "react-bootstrap";
+import { Button, Card, Container } from "react-bootstrap";
 import CommentSection from "../components/CommentSection";
 import LikeButton from "../components/LikeButton";
 
 export default function FeedPage() {
   const [posts, setPosts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchUploads();
   }, []);
 
-  async function fetchUploads() {
+  // Fetch one page; pass the previous page's next_cursor to load more
+  async function fetchUploads(cursor = null) {
     try {
       const token = sessionStorage.getItem("token");
-      console.log("FETCHING UPLOADS WITH TOKEN:", token);
 
-      const res = await axios.get("http://localhost:8000/upload", {
-        headers: { Authorization: `Bearer ${token}` }
+      const res = await axios.get("http://localhost:8000/feed", {
+        headers: { Authorization: `Bearer ${token}` },
+        params: cursor ? { cursor } : {}
       });
 
-      setPosts(res.data.uploads);
+      const uploads = res.data.posts || [];
+      setPosts((prev) => (cursor ? [...prev, ...uploads] : uploads));
+      setNextCursor(res.data.next_cursor || null);
     } catch (err) {
       console.error("UPLOAD FETCH ERROR:", err);
     }
@@ -30,7 +34,14 @@ export default function FeedPage() {
     <Container className="mt-4">
   {posts.map((post) => (
     <Card key={post.id} className="mb-4" style={{ width: "500px", margin: "0 auto" }}>
-      <Card.Img variant="top" src={post.file_url} style={{ maxHeight: "500px",maxWidth:"500px", objectFit: "cover" }} />l̥
+      <Card.Img
+        variant="top"
+        src={post.preview_url || post.file_url}
+        onError={(e) => {
+          // Preview not rendered (yet): fall back to the original
+          if (e.currentTarget.src !== post.file_url) e.currentTarget.src = post.file_url;
+        }}
+        style={{ maxHeight: "500px",maxWidth:"500px", objectFit: "cover" }} />l̥
       <Card.Body>
         <Card.Text><b>User:</b> {post.username}</Card.Text>
         <LikeButton initialLikes={0} />
@@ -38,10 +49,19 @@ export default function FeedPage() {
           postId={post.id}
           username={post.username}
           imageUrl={post.file_url}
+          initialComments={post.comments}
+          commentCount={post.comment_count}
         />
       </Card.Body>
     </Card>
   ))}
+  {nextCursor && (
+    <div className="text-center mb-4">
+      <Button variant="outline-primary" onClick={() => fetchUploads(nextCursor)}>
+        Load more
+      </Button>
+    </div>
+  )}
 </Container>
   );
 }
@@ -11,24 +11,33 @@ export default function ProfilePage() {
   });
 
   const [userPosts, setUserPosts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [totalPosts, setTotalPosts] = useState(null);
 
   // ---------------------------
-  //  FETCH USER'S POSTS
+  //  FETCH USER'S POSTS (one page at a time)
   // ---------------------------
-  useEffect(() => {
+  const fetchMyPosts = (cursor = null) => {
     const token = sessionStorage.getItem("token");
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
 
-    fetch("http://localhost:8000/my-posts", {
+    fetch(`http://localhost:8000/my-posts${query}`, {
       headers: { Authorization: `Bearer ${token}` },
     })
       .then((res) => res.json())
       .then((data) => {
-        console.log("MY POSTS:", data);
         if (data.posts) {
-          setUserPosts(data.posts);
+          setUserPosts((prev) => (cursor ? [...prev, ...data.posts] : data.posts));
+          setNextCursor(data.next_cursor || null);
+          // Sent with the first page only
+          if (typeof data.total === "number") setTotalPosts(data.total);
         }
       })
       .catch((err) => console.error("Error fetching user posts:", err));
+  };
+
+  useEffect(() => {
+    fetchMyPosts();
   }, []);
 
   const [showEditModal, setShowEditModal] = useState(false);
@@ -74,7 +83,7 @@ export default function ProfilePage() {
           <p>{profile.bio}</p>
 
           <div className="d-flex gap-4 mb-3">
-            <div><strong>{userPosts.length}</strong> Posts</div>
+            <div><strong>{totalPosts ?? userPosts.length}</strong> Posts</div>
             <div><strong>0</strong> Followers</div>
             <div><strong>0</strong> Following</div>
           </div>
@@ -95,7 +104,10 @@ export default function ProfilePage() {
         <Card>
           <Card.Img
             variant="top"
-            src={post.file_url}
+            src={(post.preview_urls && post.preview_urls["320"]) || post.preview_url || post.file_url}
+            onError={(e) => {
+              if (e.currentTarget.src !== post.file_url) e.currentTarget.src = post.file_url;
+            }}
             style={{
               width: "100%",
               height: "250px",
@@ -108,6 +120,13 @@ export default function ProfilePage() {
     ))
   )}
 </Row>
+      {nextCursor && (
+        <div className="text-center mb-4">
+          <Button variant="outline-primary" onClick={() => fetchMyPosts(nextCursor)}>
+            Load more
+          </Button>
+        </div>
+      )}
 
       {/* Edit Modal */}
       <Modal show={showEditModal} onHide={handleClose} centered>
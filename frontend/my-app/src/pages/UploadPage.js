@@ -9,6 +9,7 @@ export default function UploadPage() {
     const formData = new FormData();
     formData.append("image", data.image);
     formData.append("message", data.message);
+    if (data.precheckToken) formData.append("precheck_token", data.precheckToken);
 
     const token = sessionStorage.getItem("token");
 